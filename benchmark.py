@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+
+# Headless benchmarks of the viewer and editor internals on synthetic
+# documents. Results are written as JSON so that two runs can be
+# compared:
+#
+#   QT_QPA_PLATFORM=offscreen python3 benchmark.py -o new.json
+#   QT_QPA_PLATFORM=offscreen python3 benchmark.py --compare old.json
+
+# Std
+import argparse
+import collections
+import io
+import json
+import os
+import platform
+import random
+import string
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+# External
+from PyQt5 import QtCore
+from PyQt5 import QtWidgets
+
+# Local
+from json_decode import available, get_decoder
+from json_diff import JsonDiff
+from json_intern import Interner
+from json_stream import count_nodes, iter_entries
+from json_treewidget import JsonTreeWidget
+from json_viewer import TextToTreeItem
+from qjsonmodel import QJsonModel, QJsonTreeItem
+
+# Approximate number of nodes of each document size
+SIZES = {
+    "small": 1000,
+    "medium": 10000,
+    "large": 100000,
+}
+
+# Nesting of "deep" documents stays below what the recursive code paths
+# (genJson, JsonTreeWidget) can handle
+MAX_DEPTH = 200
+
+WORDS = ["alpha", "beta", "gamma", "delta", "name", "value", "item", "pos"]
+
+
+def _word(rng):
+    return "%s_%d" % (rng.choice(WORDS), rng.randrange(1000))
+
+
+def _scalar(rng):
+    kind = rng.randrange(4)
+    if kind == 0:
+        return rng.randrange(100000)
+    if kind == 1:
+        return rng.random() * 1000
+    if kind == 2:
+        return _word(rng)
+    return rng.choice([True, False, None])
+
+
+def make_deep(nodes, rng):
+    """Chain of nested objects, each level holding a few scalars"""
+    depth = max(1, min(MAX_DEPTH, nodes // 5))
+    width = max(1, nodes // depth - 1)
+    document = level = {}
+    for i in range(depth):
+        for j in range(width):
+            level["f%d" % j] = _scalar(rng)
+        if i < depth - 1:
+            level["child"] = level = {}
+    return document
+
+
+def make_wide(nodes, rng):
+    """One object with a member per node"""
+    return {"key%07d" % i: _scalar(rng) for i in range(nodes)}
+
+
+def make_array(nodes, rng):
+    """Array of small records, like a table export"""
+    return [{"id": i, "name": _word(rng), "x": rng.randrange(1000),
+             "y": rng.randrange(1000)}
+            for i in range(max(1, nodes // 5))]
+
+
+def make_points(nodes, rng):
+    """Array of records with the same keys and few distinct values, as
+    described by test.scheme.json"""
+    return [{"name": rng.choice(WORDS),
+             "pos": {"x": rng.randrange(10), "y": rng.randrange(10)}}
+            for i in range(max(1, nodes // 5))]
+
+
+def make_strings(nodes, rng):
+    """Array of long strings"""
+    letters = string.ascii_letters + "     "
+    return ["".join(rng.choice(letters) for _ in range(64)) * 16
+            for _ in range(max(1, nodes // 10))]
+
+
+SHAPES = {
+    "deep": make_deep,
+    "wide": make_wide,
+    "array": make_array,
+    "points": make_points,
+    "strings": make_strings,
+}
+
+
+# Cases: prepare(document) returns the function that is timed
+
+
+def load_item_tree(item):
+    """Materialize every item below `item`"""
+    stack = [item]
+    while stack:
+        item = stack.pop()
+        item.fetchAll()
+        stack.extend(item.child(row) for row in range(item.childCount()))
+
+
+def case_item_load(document):
+    return lambda: QJsonTreeItem.load(document)
+
+
+def case_item_load_all(document):
+    return lambda: load_item_tree(QJsonTreeItem.load(document))
+
+
+def walk_model(model):
+    """Visit every index through index/parent/data, fetching as a view
+    would when expanding each branch"""
+    display = QtCore.Qt.DisplayRole
+    visited = 0
+    stack = [QtCore.QModelIndex()]
+    while stack:
+        parent = stack.pop()
+        while model.canFetchMore(parent):
+            model.fetchMore(parent)
+        for row in range(model.rowCount(parent)):
+            index = model.index(row, 0, parent)
+            model.data(index, display)
+            model.data(model.index(row, 1, parent), display)
+            model.parent(index)
+            visited += 1
+            if model.hasChildren(index):
+                stack.append(index)
+    return visited
+
+
+def case_model_walk(document):
+    def run():
+        model = QJsonModel()
+        model.load(document)
+        walk_model(model)
+    return run
+
+
+def case_model_repaint(document):
+    """Read the texts of the first rows again and again, as repaints of
+    a view scrolled to the top do"""
+    model = QJsonModel()
+    model.load(document)
+    rows = min(model.rowCount(), 50)
+    indexes = [model.index(row, column)
+               for row in range(rows) for column in range(3)]
+    display = QtCore.Qt.DisplayRole
+
+    def run():
+        for _ in range(1000):
+            for index in indexes:
+                model.data(index, display)
+    return run
+
+
+def case_gen_json(document):
+    model = QJsonModel()
+    model.load(document)
+    load_item_tree(model.getRoot())
+    return lambda: model.json()
+
+
+def case_decode(name):
+    """Parse the document text with one json_decode backend"""
+    def prepare(document):
+        data = json.dumps(document).encode("utf-8")
+        decoder = get_decoder(name)
+        return lambda: decoder.loads(data)
+    return prepare
+
+
+def case_decode_ordered(document):
+    """Parse as the loaders used to, into OrderedDicts"""
+    data = json.dumps(document).encode("utf-8")
+    return lambda: json.loads(
+        data, object_pairs_hook=collections.OrderedDict)
+
+
+def case_stream_load(share_leaves=None):
+    """Parse the document text entry by entry as JsonLoadThread does,
+    interning the entries unless `share_leaves` is None"""
+    def prepare(document):
+        data = json.dumps(document).encode("utf-8")
+
+        def run():
+            interner = None
+            if share_leaves is not None:
+                interner = Interner(share_leaves=share_leaves)
+            entries = iter_entries(io.BytesIO(data))
+            next(entries)
+            loaded = []
+            for key, value, _ in entries:
+                if interner is not None:
+                    value = interner.intern(value)
+                loaded.append((key, value))
+            return loaded
+        return run
+    return prepare
+
+
+def case_search_index(document):
+    def run():
+        TextToTreeItem(None).index.add_document(document)
+    return run
+
+
+def case_find(document):
+    finder = TextToTreeItem(None)
+    finder.index.add_document(document)
+    return lambda: finder.find("name")
+
+
+def case_filter_narrow(document):
+    """Filter while "name_1" is typed, each query within the last"""
+    index = TextToTreeItem(None).index
+    index.add_document(document)
+
+    def run():
+        nodes = None
+        query = ""
+        for char in "name_1":
+            query += char
+            nodes = list(index.iter_find(query, within=nodes))
+            index.key_tree(nodes)
+    return run
+
+
+def case_diff(document):
+    """Diff against a copy with one node inserted halfway and one
+    removed"""
+    new = json.loads(json.dumps(document))
+    if isinstance(new, list):
+        new.insert(len(new) // 2, "inserted")
+        new.pop()
+    else:
+        new["inserted"] = True
+        new.pop(next(iter(new)))
+
+    def run():
+        JsonDiff(document, new)
+    return run
+
+
+def case_tree_widget(document):
+    widget = JsonTreeWidget()
+    return lambda: widget.load_json(document, "root")
+
+
+CASES = {
+    "item_load": case_item_load,
+    "item_load_all": case_item_load_all,
+    "model_walk": case_model_walk,
+    "model_repaint": case_model_repaint,
+    "gen_json": case_gen_json,
+    "search_index": case_search_index,
+    "find": case_find,
+    "filter_narrow": case_filter_narrow,
+    "diff": case_diff,
+    "tree_widget": case_tree_widget,
+    "decode_ordered": case_decode_ordered,
+    "stream_load": case_stream_load(),
+    "stream_intern": case_stream_load(False),
+    "stream_shared": case_stream_load(True),
+}
+CASES.update(("decode_" + name, case_decode(name)) for name in available())
+
+
+def measure(run, repeat, memory):
+    """Best wall time of `repeat` runs, then peak traced memory of one"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            run()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return times, peak
+
+
+def run_benchmarks(sizes, shapes, cases, repeat=3, memory=True, log=None):
+    results = []
+    for size in sizes:
+        for shape in shapes:
+            rng = random.Random(size + shape)
+            document = SHAPES[shape](SIZES[size], rng)
+            nodes = count_nodes(document)
+            for case in cases:
+                result = {"case": case, "shape": shape, "size": size,
+                          "nodes": nodes}
+                try:
+                    run = CASES[case](document)
+                    times, peak = measure(run, repeat, memory)
+                except (RecursionError, MemoryError) as e:
+                    result["error"] = "%s: %s" % (type(e).__name__, e)
+                else:
+                    result["seconds"] = min(times)
+                    result["times"] = times
+                    result["peak_bytes"] = peak
+                results.append(result)
+                if log is not None:
+                    log(format_result(result))
+    return results
+
+
+def format_result(result, baseline=None):
+    name = "%-14s %-8s %-7s %8d nodes" % (result["case"], result["shape"],
+                                          result["size"], result["nodes"])
+    if "error" in result:
+        return "%s  %s" % (name, result["error"])
+
+    text = "%s %9.4f s" % (name, result["seconds"])
+    if result.get("peak_bytes") is not None:
+        text += " %9.1f MB" % (result["peak_bytes"] / 1e6)
+    if baseline is not None and baseline.get("seconds"):
+        text += "  x%.2f" % (result["seconds"] / baseline["seconds"])
+    return text
+
+
+def result_key(result):
+    return result["case"], result["shape"], result["size"]
+
+
+def compare(results, baseline, threshold):
+    """Print each result against the baseline run
+
+    Returns:
+        results slower than `threshold` times their baseline
+
+    """
+
+    old = {result_key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        before = old.get(result_key(result))
+        print(format_result(result, before))
+        if (before is not None and before.get("seconds")
+                and result.get("seconds")
+                and result["seconds"] > before["seconds"] * threshold):
+            regressions.append(result)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time the viewer and editor on synthetic documents")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES),
+                        default=["small", "medium"])
+    parser.add_argument("--shapes", nargs="+", choices=list(SHAPES),
+                        default=list(SHAPES))
+    parser.add_argument("--cases", nargs="+", choices=list(CASES),
+                        default=list(CASES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip the traced peak memory run")
+    parser.add_argument("-o", "--output", help="write results to this file")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="results file of an earlier run")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="slowdown reported as a regression")
+    args = parser.parse_args()
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+    log = None if args.compare else print
+    results = run_benchmarks(args.sizes, args.shapes, args.cases,
+                             args.repeat, not args.no_memory, log)
+
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "qt": QtCore.QT_VERSION_STR,
+            "pyqt": QtCore.PYQT_VERSION_STR,
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as out:
+            json.dump(report, out, indent=2)
+
+    if args.compare:
+        with open(args.compare) as bfile:
+            baseline = json.load(bfile)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("%d regressions over x%.2f" % (len(regressions),
+                                                 args.threshold))
+            sys.exit(1)
+
+
+if "__main__" == __name__:
+    main()
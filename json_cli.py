@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+
+# Command line front end of the viewer. The headless commands share the
+# search, query and serialisation code of the GUI but never import Qt:
+#
+#   ./json_cli.py stats big.json
+#   ./json_cli.py find big.json name -i
+#   ./json_cli.py query big.json '$.items[*].name'
+#   ./json_cli.py format big.json --indent 2 -o pretty.json
+#   ./json_cli.py diff old.json new.json
+#   ./json_cli.py view a.json b.json
+
+# Std
+import argparse
+import json
+import os
+import sys
+import time
+
+# Local
+from json_decode import DECODERS, get_decoder
+from json_diff import ADDED, REMOVED, JsonDiff
+from json_metrics import metrics
+from json_query import QueryError, compile_query, keys_to_pointer
+from json_search import SearchIndex
+from json_stream import iter_file_entries
+from json_writer import JsonWriter
+
+
+def load_document(fpath, decoder=None):
+    with metrics.timer("parse"):
+        return get_decoder(decoder).load(fpath)
+
+
+def walk_stats(document):
+    """Node counts by JSON type, deepest nesting and longest container"""
+    types = dict.fromkeys(("object", "array", "string", "number", "boolean",
+                           "null"), 0)
+    depth = widest = 0
+    stack = [(document, 0)]
+    while stack:
+        value, level = stack.pop()
+        depth = max(depth, level)
+        if isinstance(value, dict):
+            types["object"] += 1
+            widest = max(widest, len(value))
+            stack.extend((child, level + 1) for child in value.values())
+        elif isinstance(value, list):
+            types["array"] += 1
+            widest = max(widest, len(value))
+            stack.extend((child, level + 1) for child in value)
+        elif isinstance(value, str):
+            types["string"] += 1
+        elif isinstance(value, bool):
+            types["boolean"] += 1
+        elif value is None:
+            types["null"] += 1
+        else:
+            types["number"] += 1
+    return {
+        "nodes": sum(types.values()),
+        "types": types,
+        "depth": depth,
+        "widest": widest,
+    }
+
+
+def build_search_index(fpath, decoder=None):
+    """Index a file entry by entry, as the viewer does while loading"""
+    index = SearchIndex()
+    with open(fpath, "rb") as jfile:
+        entries = iter_file_entries(jfile, get_decoder(decoder))
+        next(entries)
+        for key, value, nbytes in entries:
+            index.add_value(index.ROOT, str(key), value)
+    return index
+
+
+def cmd_stats(args):
+    decoder = get_decoder(args.decoder)
+    start = time.perf_counter()
+    document = load_document(args.fpath, decoder.name)
+    parse_time = time.perf_counter() - start
+    stats = walk_stats(document)
+    stats["bytes"] = os.path.getsize(args.fpath)
+    stats["decoder"] = decoder.name
+    stats["parse_time"] = parse_time
+    if args.json:
+        json.dump(stats, sys.stdout, indent=2)
+        print()
+        return 0
+
+    print("file     %s" % args.fpath)
+    print("bytes    %s" % format(stats["bytes"], ","))
+    print("parse    %.3f s (%s)" % (parse_time, decoder.name))
+    print("nodes    %s" % format(stats["nodes"], ","))
+    print("depth    %d" % stats["depth"])
+    print("widest   %s" % format(stats["widest"], ","))
+    for name, count in stats["types"].items():
+        print("%-8s %s" % (name, format(count, ",")))
+    return 0
+
+
+def cmd_find(args):
+    index = build_search_index(args.fpath, args.decoder)
+    found = 0
+    for node in index.iter_find(args.text, not args.values_only,
+                                not args.keys_only, not args.ignore_case):
+        value = index.value(node)
+        pointer = keys_to_pointer(index.path(node))
+        print(pointer if value is None else "%s\t%s" % (pointer, value))
+        found += 1
+        if found == args.max_count:
+            break
+    return 0 if found else 1
+
+
+def cmd_query(args):
+    try:
+        query = compile_query(args.expression)
+    except QueryError as e:
+        print("json_cli: %s" % e, file=sys.stderr)
+        return 2
+
+    document = load_document(args.fpath, args.decoder)
+    found = 0
+    for match in query.iter_run(document):
+        text = json.dumps(match.node, ensure_ascii=False)
+        if args.values:
+            print(text)
+        else:
+            print("%s\t%s" % (keys_to_pointer(match.path), text))
+        found += 1
+    return 0 if found else 1
+
+
+def cmd_format(args):
+    document = load_document(args.fpath, args.decoder)
+    if args.compact:
+        writer = JsonWriter(separators=(",", ":"), ensure_ascii=args.ascii)
+    else:
+        writer = JsonWriter(indent=args.indent, ensure_ascii=args.ascii)
+    with metrics.timer("save"):
+        if args.output:
+            writer.save(document, args.output)
+        else:
+            writer.dump(document, sys.stdout)
+            print()
+    return 0
+
+
+def cmd_diff(args):
+    old = load_document(args.old, args.decoder)
+    new = load_document(args.new, args.decoder)
+    diff = JsonDiff(old, new)
+    for change in diff.changes:
+        if args.json:
+            print(json.dumps({
+                "kind": change.kind,
+                "old_path": (None if change.old_path is None
+                             else keys_to_pointer(change.old_path)),
+                "new_path": (None if change.new_path is None
+                             else keys_to_pointer(change.new_path)),
+                "old": change.old,
+                "new": change.new,
+            }, ensure_ascii=False))
+        elif change.kind == REMOVED:
+            print("-%s\t%s" % (keys_to_pointer(change.old_path),
+                               json.dumps(change.old, ensure_ascii=False)))
+        elif change.kind == ADDED:
+            print("+%s\t%s" % (keys_to_pointer(change.new_path),
+                               json.dumps(change.new, ensure_ascii=False)))
+        else:
+            print("~%s\t%s -> %s" % (
+                keys_to_pointer(change.new_path),
+                json.dumps(change.old, ensure_ascii=False),
+                json.dumps(change.new, ensure_ascii=False)))
+    return 1 if diff.changes else 0
+
+
+def cmd_view(args):
+    # The only command that needs Qt
+    import json_viewer
+    return json_viewer.main(args.fpaths)
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description="View, search and reformat JSON files")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="record timings to FILE")
+    parser.add_argument("--decoder", choices=list(DECODERS),
+                        help="JSON parser, the fastest installed by default")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    stats = commands.add_parser("stats", help="count nodes by type")
+    stats.add_argument("fpath")
+    stats.add_argument("--json", action="store_true",
+                       help="print the counts as JSON")
+    stats.set_defaults(run=cmd_stats)
+
+    find = commands.add_parser(
+        "find", help="keys and values containing a text, as in the viewer")
+    find.add_argument("fpath")
+    find.add_argument("text")
+    find.add_argument("-i", "--ignore-case", action="store_true")
+    scope = find.add_mutually_exclusive_group()
+    scope.add_argument("--keys-only", action="store_true")
+    scope.add_argument("--values-only", action="store_true")
+    find.add_argument("-m", "--max-count", type=int, default=0,
+                      help="stop after this many matches")
+    find.set_defaults(run=cmd_find)
+
+    query = commands.add_parser(
+        "query", help="values at a JSONPath ($...) or JSON Pointer (/...)")
+    query.add_argument("fpath")
+    query.add_argument("expression")
+    query.add_argument("--values", action="store_true",
+                       help="print values only, without their pointer")
+    query.set_defaults(run=cmd_query)
+
+    fmt = commands.add_parser("format", help="pretty print or compact")
+    fmt.add_argument("fpath")
+    fmt.add_argument("-o", "--output", help="write here instead of stdout")
+    layout = fmt.add_mutually_exclusive_group()
+    layout.add_argument("--indent", type=int, default=2)
+    layout.add_argument("--compact", action="store_true")
+    fmt.add_argument("--ascii", action="store_true",
+                     help="escape non-ASCII characters")
+    fmt.set_defaults(run=cmd_format)
+
+    diff = commands.add_parser(
+        "diff", help="added, removed and changed nodes, 1 if any")
+    diff.add_argument("old")
+    diff.add_argument("new")
+    diff.add_argument("--json", action="store_true",
+                      help="print one JSON object per change")
+    diff.set_defaults(run=cmd_diff)
+
+    view = commands.add_parser("view", help="open the files in the viewer")
+    view.add_argument("fpaths", nargs="*", metavar="fpath")
+    view.set_defaults(run=cmd_view)
+
+    return parser
+
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    if args.metrics:
+        metrics.enable()
+    try:
+        status = args.run(args)
+    except BrokenPipeError:
+        # Output piped into head and the like
+        sys.stderr.close()
+        status = 0
+    except (OSError, ValueError) as e:
+        print("json_cli: %s" % e, file=sys.stderr)
+        status = 2
+    if args.metrics:
+        metrics.dump(args.metrics)
+    return status
+
+
+if "__main__" == __name__:
+    sys.exit(main())
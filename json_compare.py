@@ -0,0 +1,292 @@
+from PyQt5 import QtCore
+from PyQt5 import QtGui
+from PyQt5 import QtWidgets
+
+from json_decode import get_decoder
+from json_diff import ADDED, CHANGED, INSIDE, REMOVED, JsonDiff
+from json_intern import Interner
+from json_metrics import metrics
+from qjsonmodel import QJsonBucket, QJsonModel
+
+
+class JsonDiffThread(QtCore.QThread):
+    """Parse two JSON files and diff them in the background"""
+
+    # (old document, new document, JsonDiff)
+    done = QtCore.pyqtSignal(object)
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, old_fpath, new_fpath, parent=None, decoder=None):
+        super(JsonDiffThread, self).__init__(parent)
+        self.old_fpath = old_fpath
+        self.new_fpath = new_fpath
+        self.decoder = decoder
+
+    def run(self):
+        decoder = get_decoder(self.decoder)
+        try:
+            with metrics.timer("parse"):
+                old = decoder.load(self.old_fpath)
+                new = decoder.load(self.new_fpath)
+        except (OSError, ValueError) as e:
+            self.failed.emit(str(e))
+            return
+        for fpath, document in ((self.old_fpath, old),
+                                (self.new_fpath, new)):
+            if not isinstance(document, (dict, list)):
+                self.failed.emit("%s: not an object or array" % fpath)
+                return
+        # Two versions of a document mostly hold the same strings
+        interner = Interner()
+        old = interner.intern(old)
+        new = interner.intern(new)
+        self.done.emit((old, new, JsonDiff(old, new)))
+
+
+class JsonDiffProxy(QtCore.QIdentityProxyModel):
+    """Rows of a QJsonModel coloured by the changes of a JsonDiff
+
+    Added, removed and changed nodes get a background, the containers
+    holding changes a bold font. Ranges of rows are bold when one of
+    their elements holds a change.
+
+    """
+
+    COLORS = {
+        ADDED: QtGui.QColor(200, 240, 200),
+        REMOVED: QtGui.QColor(250, 205, 205),
+        CHANGED: QtGui.QColor(250, 235, 180),
+    }
+
+    def __init__(self, parent=None):
+        super(JsonDiffProxy, self).__init__(parent)
+
+        self._diff = None
+        self._new = False
+        self._bold = QtGui.QFont()
+        self._bold.setBold(True)
+
+    def setDiff(self, diff, new):
+        """Colour the rows by `diff`, seen from its new document if
+        `new` else from the old one"""
+        self._diff = diff
+        self._new = new
+        if self.rowCount():
+            self.dataChanged.emit(
+                self.index(0, 0),
+                self.index(self.rowCount() - 1, self.columnCount() - 1))
+
+    def diff(self):
+        return self._diff
+
+    def _mark(self, index):
+        item = self.mapToSource(index).internalPointer()
+        if isinstance(item, QJsonBucket):
+            if self._diff.marked_between(item.item.keys(), item.start,
+                                         item.stop(), self._new):
+                return INSIDE
+            return None
+        marks = self._diff.new_marks if self._new else self._diff.old_marks
+        return marks.get(tuple(item.keys()))
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if (self._diff is not None and index.isValid()
+                and role in (QtCore.Qt.BackgroundRole, QtCore.Qt.FontRole)):
+            mark = self._mark(index)
+            if role == QtCore.Qt.BackgroundRole:
+                color = self.COLORS.get(mark)
+                return QtGui.QBrush(color) if color is not None else None
+            return self._bold if mark == INSIDE else None
+        return super(JsonDiffProxy, self).data(index, role)
+
+
+class JsonDiffView(QtWidgets.QWidget):
+    """Two documents side by side with their differences marked
+
+    Scrolling, expanding a row or making it current in one tree does the
+    same to the matching node of the other, or to its closest ancestor
+    that has one.
+
+    """
+
+    def __init__(self, old_fpath, new_fpath, parent=None):
+        super(JsonDiffView, self).__init__(parent)
+
+        self.diff = None
+        self.summary = ""
+        self.change_pos = -1
+        # Set while one tree follows the other
+        self._syncing = False
+
+        self.summary_label = QtWidgets.QLabel("Comparing…")
+        self.prev_button = QtWidgets.QPushButton("Prev change")
+        self.prev_button.clicked.connect(lambda: self.go_to_change(-1))
+        self.next_button = QtWidgets.QPushButton("Next change")
+        self.next_button.clicked.connect(lambda: self.go_to_change(1))
+        for button in (self.prev_button, self.next_button):
+            button.setEnabled(False)
+
+        top_layout = QtWidgets.QHBoxLayout()
+        top_layout.addWidget(self.summary_label, 1)
+        top_layout.addWidget(self.prev_button)
+        top_layout.addWidget(self.next_button)
+
+        self.old_view = self.make_tree()
+        self.new_view = self.make_tree()
+
+        splitter = QtWidgets.QSplitter()
+        for fpath, view in ((old_fpath, self.old_view),
+                            (new_fpath, self.new_view)):
+            gbox = QtWidgets.QGroupBox(fpath)
+            gbox_layout = QtWidgets.QVBoxLayout()
+            gbox_layout.addWidget(view)
+            gbox.setLayout(gbox_layout)
+            splitter.addWidget(gbox)
+
+        layout = QtWidgets.QVBoxLayout()
+        layout.addLayout(top_layout)
+        layout.addWidget(splitter)
+        self.setLayout(layout)
+
+        for view, other in ((self.old_view, self.new_view),
+                            (self.new_view, self.old_view)):
+            view.verticalScrollBar().valueChanged.connect(
+                lambda value, view=view, other=other:
+                self.sync_scroll(view, other))
+            view.expanded.connect(
+                lambda index, view=view, other=other:
+                self.sync_expanded(view, other, index, True))
+            view.collapsed.connect(
+                lambda index, view=view, other=other:
+                self.sync_expanded(view, other, index, False))
+            view.selectionModel().currentChanged.connect(
+                lambda current, previous, view=view, other=other:
+                self.sync_current(view, other, current))
+
+        self.thread = JsonDiffThread(old_fpath, new_fpath, self)
+        self.thread.done.connect(self.show_diff)
+        self.thread.failed.connect(self.show_failure)
+        self.thread.start()
+
+    def make_tree(self):
+        proxy = JsonDiffProxy(self)
+        proxy.setSourceModel(QJsonModel(proxy))
+        view = QtWidgets.QTreeView()
+        view.setUniformRowHeights(True)
+        view.setModel(proxy)
+        view.setColumnHidden(2, True)
+        view.header().setSectionResizeMode(QtWidgets.QHeaderView.Stretch)
+        return view
+
+    def stop_loading(self):
+        self.thread.wait()
+
+    def show_failure(self, message):
+        self.summary_label.setText("Compare failed: %s" % message)
+
+    def show_diff(self, result):
+        old, new, self.diff = result
+        for view, document, is_new in ((self.old_view, old, False),
+                                       (self.new_view, new, True)):
+            proxy = view.model()
+            proxy.sourceModel().load(document)
+            proxy.setDiff(self.diff, is_new)
+
+        counts = self.diff.counts()
+        if self.diff.changes:
+            self.summary = "%d added, %d removed, %d changed" % (
+                counts[ADDED], counts[REMOVED], counts[CHANGED])
+        else:
+            self.summary = "No differences"
+        self.summary_label.setText(self.summary)
+        for button in (self.prev_button, self.next_button):
+            button.setEnabled(bool(self.diff.changes))
+        if self.diff.changes:
+            self.go_to_change(1)
+
+    def path_of(self, view, index):
+        """Keys of the node of a row, of the first element of a range"""
+        item = view.model().mapToSource(index).internalPointer()
+        if isinstance(item, QJsonBucket):
+            path = item.item.keys()
+            return path + [item.start] if item.item.type is list else path
+        return item.keys()
+
+    def view_index(self, view, path):
+        """Row of the node at `path` in `view`, invalid if none"""
+        proxy = view.model()
+        return proxy.mapFromSource(proxy.sourceModel().indexForPath(path))
+
+    def counterpart(self, view, other, index):
+        """Row of `other` matching the row `index` of `view`"""
+        path = self.path_of(view, index)
+        mapped = self.diff.map_path(path, view is self.old_view)
+        return self.view_index(other, mapped)
+
+    def _syncable(self):
+        return self.diff is not None and not self._syncing
+
+    def sync_scroll(self, view, other):
+        if not self._syncable():
+            return
+        top = view.indexAt(QtCore.QPoint(0, 0))
+        if not top.isValid():
+            return
+        self._syncing = True
+        try:
+            index = self.counterpart(view, other, top)
+            if index.isValid():
+                other.scrollTo(index, QtWidgets.QAbstractItemView.PositionAtTop)
+        finally:
+            self._syncing = False
+
+    def sync_expanded(self, view, other, index, expanded):
+        if not self._syncable():
+            return
+        self._syncing = True
+        try:
+            # The matching container, not an ancestor standing for it
+            path = self.path_of(view, index)
+            mapped = self.diff.map_path(path, view is self.old_view)
+            if len(mapped) == len(path):
+                other.setExpanded(self.view_index(other, mapped), expanded)
+        finally:
+            self._syncing = False
+
+    def sync_current(self, view, other, current):
+        if not self._syncable() or not current.isValid():
+            return
+        self._syncing = True
+        try:
+            index = self.counterpart(view, other, current)
+            if index.isValid():
+                other.setCurrentIndex(index)
+                other.scrollTo(index)
+        finally:
+            self._syncing = False
+
+    def go_to_change(self, step):
+        """Select the next change, or the previous one if `step` < 0"""
+        changes = self.diff.changes
+        self.change_pos = (self.change_pos + step) % len(changes)
+        change = changes[self.change_pos]
+
+        self._syncing = True
+        try:
+            for view, path, new in ((self.old_view, change.old_path, False),
+                                    (self.new_view, change.new_path, True)):
+                if path is None:
+                    # Missing on this side, show where it would be
+                    if new:
+                        path = self.diff.map_path(change.old_path, True)
+                    else:
+                        path = self.diff.map_path(change.new_path, False)
+                index = self.view_index(view, path)
+                if index.isValid():
+                    view.setCurrentIndex(index)
+                    view.scrollTo(index,
+                                  QtWidgets.QAbstractItemView.PositionAtCenter)
+        finally:
+            self._syncing = False
+        self.summary_label.setText("%s, change %d of %d" % (
+            self.summary, self.change_pos + 1, len(changes)))
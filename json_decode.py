@@ -0,0 +1,151 @@
+import json
+import os
+
+
+# Decoders tried by get_decoder, fastest first
+PREFERRED = ("orjson", "ujson", "json")
+
+# Integers of 19 digits or more may not fit 64 bits
+_DIGITS = bytes.maketrans(b"123456789", b"000000000")
+_LONG_RUN = b"0" * 19
+
+
+def has_long_integer(data):
+    """Whether the JSON bytes `data` may hold an integer beyond 64 bits
+
+    Runs of 19 digits are found without a regex. Runs inside strings or
+    exponents count too, only fractions and mantissas are told apart.
+    """
+
+    masked = data.translate(_DIGITS)
+    size = len(masked)
+    pos = masked.find(_LONG_RUN)
+    while pos >= 0:
+        end = pos + len(_LONG_RUN)
+        while end < size and masked[end] == 48:
+            end += 1
+        if (data[pos - 1:pos] != b"."
+                and data[end:end + 1] not in (b".", b"e", b"E")):
+            return True
+        pos = masked.find(_LONG_RUN, end)
+    return False
+
+
+class JsonDecoder(object):
+    """The stdlib parser, its C scanner builds plain dicts and lists
+
+    Every decoder returns the same values as json.loads. Subclasses
+    wrap faster parsers and hand over to json.loads whatever those
+    reject or would decode differently.
+
+    """
+
+    name = "json"
+    # Decodes a whole file faster than json_stream.iter_entries does
+    fast = False
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def load(self, fpath):
+        with open(fpath, "rb") as jfile:
+            return self.loads(jfile.read())
+
+
+class _FastDecoder(JsonDecoder):
+
+    fast = True
+    _loads = None
+
+    def loads(self, data):
+        if isinstance(data, str):
+            try:
+                data = data.encode("utf-8")
+            except UnicodeEncodeError:
+                # Lone surrogates
+                return json.loads(data)
+        elif not isinstance(data, bytes):
+            data = bytes(data)
+
+        if has_long_integer(data):
+            return json.loads(data)
+        try:
+            return self._loads(data)
+        except (ValueError, OverflowError):
+            # NaN, a BOM, lone surrogates, deep nesting, or invalid JSON
+            # the stdlib words the error of
+            return json.loads(data)
+
+
+class OrjsonDecoder(_FastDecoder):
+    """orjson, turns integers beyond 64 bits into floats"""
+
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+        self._loads = orjson.loads
+
+
+class UjsonDecoder(_FastDecoder):
+
+    name = "ujson"
+
+    def __init__(self):
+        import ujson
+        self._loads = ujson.loads
+
+
+DECODERS = {
+    "json": JsonDecoder,
+    "orjson": OrjsonDecoder,
+    "ujson": UjsonDecoder,
+}
+
+_instances = {}
+
+
+def available():
+    """Names of the decoders that can be used here, fastest first"""
+    names = []
+    for name in PREFERRED:
+        try:
+            get_decoder(name)
+        except ValueError:
+            continue
+        names.append(name)
+    return names
+
+
+def get_decoder(name=None):
+    """Decoder `name`, by default the one named by the
+    JSON_VIEWER_DECODER variable, else the fastest one installed
+
+    Raises:
+        ValueError: Unknown or not installed decoder
+
+    """
+
+    if name is None:
+        name = os.environ.get("JSON_VIEWER_DECODER")
+    if name is None:
+        for name in PREFERRED:
+            try:
+                return get_decoder(name)
+            except ValueError:
+                pass
+
+    decoder = _instances.get(name)
+    if decoder is not None:
+        return decoder
+
+    cls = DECODERS.get(name)
+    if cls is None:
+        raise ValueError("Unknown JSON decoder %r, expected one of %s"
+                         % (name, ", ".join(PREFERRED)))
+    try:
+        decoder = cls()
+    except ImportError:
+        raise ValueError("JSON decoder %r is not installed" % name)
+    _instances[name] = decoder
+    return decoder
@@ -0,0 +1,98 @@
+from PyQt5 import QtCore
+from PyQt5 import QtGui
+from PyQt5 import QtWidgets
+
+from json_index import ValueRole
+from json_text import display_text
+
+
+class ValueDetail(QtWidgets.QWidget):
+    """Whole text of the current value of a view, a page at a time
+
+    The value column of the models only shows a preview of long values.
+    The full value is read through ValueRole when a row becomes current,
+    and only one page of it is ever put in the text widget.
+
+    """
+
+    PAGE_CHARS = 64 * 1024
+
+    def __init__(self, parent=None):
+        super(ValueDetail, self).__init__(parent)
+
+        self._text = ""
+        self._page = 0
+        self._selection = None
+
+        self.text_edit = QtWidgets.QPlainTextEdit()
+        self.text_edit.setReadOnly(True)
+        self.text_edit.setFont(QtGui.QFontDatabase.systemFont(
+            QtGui.QFontDatabase.FixedFont))
+
+        self.prev_button = QtWidgets.QPushButton("<")
+        self.prev_button.clicked.connect(lambda: self.show_page(self._page - 1))
+        self.next_button = QtWidgets.QPushButton(">")
+        self.next_button.clicked.connect(lambda: self.show_page(self._page + 1))
+        self.page_label = QtWidgets.QLabel()
+
+        page_layout = QtWidgets.QHBoxLayout()
+        page_layout.addWidget(self.prev_button)
+        page_layout.addWidget(self.page_label, 1)
+        page_layout.addWidget(self.next_button)
+
+        layout = QtWidgets.QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.text_edit)
+        layout.addLayout(page_layout)
+        self.setLayout(layout)
+
+        self.show_page(0)
+
+    def watch(self, view):
+        """Follow the current row of `view`, again after each setModel"""
+        selection = view.selectionModel()
+        if selection is self._selection:
+            return
+        if self._selection is not None:
+            try:
+                self._selection.currentChanged.disconnect(self.show_index)
+            except (RuntimeError, TypeError):
+                # Deleted along with its model
+                pass
+        self._selection = selection
+        selection.currentChanged.connect(self.show_index)
+        self.show_index(view.currentIndex())
+
+    def show_index(self, index, previous=None):
+        if not index.isValid():
+            self.set_text("")
+            return
+
+        row = index.row()
+        value = index.sibling(row, 1).data(ValueRole)
+        # Containers have no text of their own
+        if (isinstance(value, (dict, list))
+                or index.sibling(row, 2).data() in ("dict", "list", "tuple")):
+            self.set_text("")
+        else:
+            self.set_text(display_text(value, None))
+
+    def set_text(self, text):
+        self._text = text
+        self.show_page(0)
+
+    def page_count(self):
+        return max(1, -(-len(self._text) // self.PAGE_CHARS))
+
+    def show_page(self, page):
+        pages = self.page_count()
+        self._page = page = max(0, min(page, pages - 1))
+        start = page * self.PAGE_CHARS
+        self.text_edit.setPlainText(self._text[start:start + self.PAGE_CHARS])
+
+        self.prev_button.setEnabled(page > 0)
+        self.next_button.setEnabled(page < pages - 1)
+        self.page_label.setText("%d / %d  (%s chars)"
+                                % (page + 1, pages,
+                                   format(len(self._text), ",")))
+        self.page_label.setAlignment(QtCore.Qt.AlignCenter)
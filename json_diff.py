@@ -0,0 +1,378 @@
+import bisect
+import collections
+import difflib
+import hashlib
+import marshal
+
+from json_metrics import metrics
+
+
+# A difference between two documents. `kind` is one of ADDED, REMOVED
+# and CHANGED, paths are tuples of dict keys and list indices, None on
+# the side the node is missing from
+Change = collections.namedtuple(
+    "Change", ["kind", "old_path", "new_path", "old", "new"])
+
+ADDED = "added"
+REMOVED = "removed"
+CHANGED = "changed"
+# Mark of the containers holding changes
+INSIDE = "inside"
+
+# Largest len(old) * len(new) of a run of array elements aligned by
+# difflib, whose time grows with it when values repeat. Longer runs are
+# first split at the elements found once on each side, what is left is
+# paired index by index
+ALIGN_LIMIT = 1 << 20
+
+
+def subtree_hashes(document):
+    """Digest of the content of every dict and list in `document`
+
+    Containers are hashed after their children, in one pass over the
+    document, with blake2b over the digests of those children and over
+    their scalars as marshal writes them. Dicts hash the same whatever
+    the order of their keys, values of different types never do, not
+    even 1 and 1.0. Digests are long enough to be trusted without
+    comparing the subtrees, and the same in every process.
+
+    Returns:
+        dict of id() of each container -> digest
+
+    """
+
+    # Every container after its parent, reversed below to hash each one
+    # after its children
+    order = []
+    stack = [document]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            order.append(value)
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            order.append(value)
+            stack.extend(value)
+
+    hashes = {}
+    get = hashes.get
+    for value in reversed(order):
+        # Children are replaced by their digests, bytes, which marshal
+        # tells apart from strings as it tells 1, 1.0 and True apart.
+        # Version 2 writes no back references, whose use depends on
+        # reference counts
+        if isinstance(value, dict):
+            # Keys are unique, sorting never compares the values
+            data = marshal.dumps([(key, get(id(child), child))
+                                  for key, child in sorted(value.items())], 2)
+            person = b"dict"
+        else:
+            data = marshal.dumps([get(id(child), child) for child in value], 2)
+            person = b"list"
+        hashes[id(value)] = hashlib.blake2b(
+            data, digest_size=16, person=person).digest()
+    return hashes
+
+
+def _unique_pairs(old, new, o1, o2, n1, n2):
+    """Longest run of (i, j) in increasing order such that old[i] and
+    new[j] are equal and found once in their range, as in patience diff"""
+    old_run = old[o1:o2]
+    new_run = new[n1:n2]
+    old_count = collections.Counter(old_run)
+    new_count = collections.Counter(new_run)
+    new_once = {value: j for j, value in enumerate(new_run, n1)
+                if new_count[value] == 1}
+    pairs = [(i, new_once[value]) for i, value in enumerate(old_run, o1)
+             if value in new_once and old_count[value] == 1]
+
+    # Longest increasing subsequence of the j. Mostly in order already
+    # when little changed, those are appended without a search
+    tails = []
+    tail_pairs = []
+    links = [-1] * len(pairs)
+    for k, (i, j) in enumerate(pairs):
+        if not tails or j > tails[-1]:
+            links[k] = tail_pairs[-1] if tail_pairs else -1
+            tails.append(j)
+            tail_pairs.append(k)
+        else:
+            n = bisect.bisect_left(tails, j)
+            links[k] = tail_pairs[n - 1] if n else -1
+            tails[n] = j
+            tail_pairs[n] = k
+
+    run = []
+    k = tail_pairs[-1] if tail_pairs else -1
+    while k >= 0:
+        run.append(pairs[k])
+        k = links[k]
+    run.reverse()
+    return run
+
+
+def matching_blocks(old, new):
+    """Runs (i, j, size) of equal elements of the lists `old` and `new`,
+    in order"""
+    blocks = []
+    # Ranges still to match and blocks found, last first
+    stack = [(0, len(old), 0, len(new))]
+    while stack:
+        task = stack.pop()
+        if len(task) == 3:
+            blocks.append(task)
+            continue
+
+        o1, o2, n1, n2 = task
+        start = 0
+        while (o1 + start < o2 and n1 + start < n2
+               and old[o1 + start] == new[n1 + start]):
+            start += 1
+        if start:
+            blocks.append((o1, n1, start))
+            o1 += start
+            n1 += start
+        end = 0
+        while (end < o2 - o1 and end < n2 - n1
+               and old[o2 - 1 - end] == new[n2 - 1 - end]):
+            end += 1
+        o2 -= end
+        n2 -= end
+
+        found = []
+        if o1 < o2 and n1 < n2:
+            if (o2 - o1) * (n2 - n1) <= ALIGN_LIMIT:
+                matcher = difflib.SequenceMatcher(
+                    None, old[o1:o2], new[n1:n2], autojunk=False)
+                found = [(o1 + i, n1 + j, size)
+                         for i, j, size in matcher.get_matching_blocks()
+                         if size]
+            else:
+                runs = []
+                for i, j in _unique_pairs(old, new, o1, o2, n1, n2):
+                    if (runs and runs[-1][0] + runs[-1][2] == i
+                            and runs[-1][1] + runs[-1][2] == j):
+                        runs[-1][2] += 1
+                    else:
+                        runs.append([i, j, 1])
+                # The ranges between the runs are matched in turn
+                i, j = o1, n1
+                for bi, bj, size in runs:
+                    if i < bi or j < bj:
+                        found.append((i, bi, j, bj))
+                    found.append((bi, bj, size))
+                    i, j = bi + size, bj + size
+                if runs and (i < o2 or j < n2):
+                    found.append((i, o2, j, n2))
+        if end:
+            found.append((o2, n2, end))
+        stack.extend(reversed(found))
+    return blocks
+
+
+def align(old, new):
+    """difflib style opcodes turning the list `old` into `new`
+
+    Common ends are skipped first, an element inserted near the front of
+    a long array costs as much as comparing it once.
+
+    """
+
+    opcodes = []
+    i = j = 0
+    for bi, bj, size in matching_blocks(old, new) + [(len(old), len(new), 0)]:
+        if i < bi and j < bj:
+            opcodes.append(("replace", i, bi, j, bj))
+        elif i < bi:
+            opcodes.append(("delete", i, bi, j, j))
+        elif j < bj:
+            opcodes.append(("insert", i, i, j, bj))
+        if size:
+            if opcodes and opcodes[-1][0] == "equal" and i == bi and j == bj:
+                opcodes[-1] = ("equal", opcodes[-1][1], bi + size,
+                               opcodes[-1][3], bj + size)
+            else:
+                opcodes.append(("equal", bi, bi + size, bj, bj + size))
+        i, j = bi + size, bj + size
+    return opcodes
+
+
+def map_index(opcodes, index, to_new=True):
+    """Position of element `index` on the other side of `opcodes`,
+    None if it has no counterpart"""
+    for tag, i1, i2, j1, j2 in opcodes:
+        if not to_new:
+            i1, i2, j1, j2 = j1, j2, i1, i2
+        if i1 <= index < i2:
+            offset = index - i1
+            return j1 + offset if j1 + offset < j2 else None
+    return None
+
+
+class JsonDiff(object):
+    """Differences between two parsed documents
+
+    Both documents are hashed first, the walk then only goes down the
+    pairs of containers that differ, identical subtrees are skipped
+    whole. Dict members are paired by key, array elements by
+    aligning their hashes so that an insertion does not show every later
+    element as changed. Within a run of replaced elements, elements are
+    paired in turn and compared member by member.
+
+    Arguments:
+        old (dict or list): Document compared against
+        new (dict or list): Document compared
+
+    """
+
+    def __init__(self, old, new):
+        self.old = old
+        self.new = new
+
+        with metrics.timer("diff_hash"):
+            self._old_hashes = subtree_hashes(old)
+            self._new_hashes = subtree_hashes(new)
+
+        # Paths on one side -> (path on the other side, container there,
+        # opcodes for lists) for every pair of differing containers
+        self._pairs = {}
+        self._reverse = {}
+        # Path -> ADDED, REMOVED, CHANGED or INSIDE, per side
+        self.old_marks = {}
+        self.new_marks = {}
+        # new -> path of an array -> its marked indices, sorted
+        self._marked = {}
+
+        with metrics.timer("diff"):
+            self.changes = list(self._walk())
+
+    def __len__(self):
+        return len(self.changes)
+
+    def counts(self):
+        """Number of changes of each kind"""
+        counts = dict.fromkeys((ADDED, REMOVED, CHANGED), 0)
+        for change in self.changes:
+            counts[change.kind] += 1
+        return counts
+
+    def _same(self, old, new):
+        if type(old) is not type(new):
+            return False
+        if isinstance(old, (dict, list)):
+            return self._old_hashes[id(old)] == self._new_hashes[id(new)]
+        return old == new
+
+    def _walk(self):
+        # Pairs to compare, and changes to yield, in document order
+        stack = [((), (), self.old, self.new)]
+        while stack:
+            entry = stack.pop()
+            if isinstance(entry, Change):
+                yield entry
+                continue
+
+            old_path, new_path, old, new = entry
+            if self._same(old, new):
+                continue
+            if (type(old) is not type(new)
+                    or not isinstance(old, (dict, list))):
+                self.old_marks[old_path] = CHANGED
+                self.new_marks[new_path] = CHANGED
+                yield Change(CHANGED, old_path, new_path, old, new)
+                continue
+
+            self.old_marks[old_path] = INSIDE
+            self.new_marks[new_path] = INSIDE
+            if isinstance(old, dict):
+                opcodes = None
+                entries = self._dictEntries(old_path, new_path, old, new)
+            else:
+                opcodes = align(
+                    [self._old_hashes.get(id(v), (type(v), v)) for v in old],
+                    [self._new_hashes.get(id(v), (type(v), v)) for v in new])
+                entries = self._listEntries(old_path, new_path, old, new,
+                                            opcodes)
+            self._pairs[old_path] = (new_path, new, opcodes)
+            self._reverse[new_path] = (old_path, old, opcodes)
+            stack.extend(reversed(entries))
+
+    def _removed(self, path, value):
+        self.old_marks[path] = REMOVED
+        return Change(REMOVED, path, None, value, None)
+
+    def _added(self, path, value):
+        self.new_marks[path] = ADDED
+        return Change(ADDED, None, path, None, value)
+
+    def _dictEntries(self, old_path, new_path, old, new):
+        entries = []
+        for key, value in old.items():
+            if key in new:
+                entries.append((old_path + (key,), new_path + (key,),
+                                value, new[key]))
+            else:
+                entries.append(self._removed(old_path + (key,), value))
+        for key, value in new.items():
+            if key not in old:
+                entries.append(self._added(new_path + (key,), value))
+        return entries
+
+    def _listEntries(self, old_path, new_path, old, new, opcodes):
+        entries = []
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag == "equal":
+                continue
+            common = min(i2 - i1, j2 - j1) if tag == "replace" else 0
+            for k in range(common):
+                entries.append((old_path + (i1 + k,), new_path + (j1 + k,),
+                                old[i1 + k], new[j1 + k]))
+            for i in range(i1 + common, i2):
+                entries.append(self._removed(old_path + (i,), old[i]))
+            for j in range(j1 + common, j2):
+                entries.append(self._added(new_path + (j,), new[j]))
+        return entries
+
+    def map_path(self, path, to_new=True):
+        """Path of the node matching `path` on the other side, or of its
+        closest ancestor that has one
+
+        Arguments:
+            path (tuple): Dict keys and list indices
+            to_new (bool, optional): `path` is in the old document
+
+        """
+
+        pairs = self._pairs if to_new else self._reverse
+        mapped = ()
+        for depth, key in enumerate(path):
+            pair = pairs.get(tuple(path[:depth]))
+            if pair is None:
+                # Same below here
+                return mapped + tuple(path[depth:])
+            other_path, other, opcodes = pair
+            if opcodes is not None:
+                key = map_index(opcodes, key, to_new)
+                if key is None:
+                    return other_path
+            elif key not in other:
+                return other_path
+            mapped = other_path + (key,)
+        return mapped
+
+    def marked_between(self, path, start, stop, new=False):
+        """Whether an element `start` to `stop` - 1 of the array at
+        `path` holds a change, for rows grouping a range of a large
+        array"""
+        index = self._marked.get(new)
+        if index is None:
+            index = self._marked[new] = collections.defaultdict(list)
+            for marked in (self.new_marks if new else self.old_marks):
+                if marked and isinstance(marked[-1], int):
+                    index[marked[:-1]].append(marked[-1])
+            for positions in index.values():
+                positions.sort()
+
+        positions = index.get(tuple(path), ())
+        i = bisect.bisect_left(positions, start)
+        return i < len(positions) and positions[i] < stop
@@ -1,6 +1,4 @@
 
-import json
-import collections
 import copy
 from pathlib import Path
 
@@ -9,38 +7,189 @@ from PyQt5.QtGui import *
 from PyQt5.QtCore import *
 from PyQt5.QtWidgets import *
 from ui_res.json_win import Ui_MainWindow
+from json_decode import get_decoder
+from json_detail import ValueDetail
+from json_loader import JsonLoadThread, JsonSaveThread, LoadProgress
+from json_patch import PatchError, load_patch
+
 
-DEBUG = True
-    
 class JsonEditor(QMainWindow, Ui_MainWindow):
 
     def __init__(self, parent=None):
         super(JsonEditor, self).__init__(parent=parent)
         self.setupUi(self)
         self.test_btn.clicked.connect(self.on_click_test)
+        self.json_data = None
+        self.loader = None
+        self.saver = None
+        self.load_progress = LoadProgress(self.statusbar)
+        self.statusbar.addPermanentWidget(self.load_progress, 1)
+
+        self.undo_action = QAction("撤销", self)
+        self.undo_action.setShortcut(QKeySequence.Undo)
+        self.undo_action.triggered.connect(self.on_undo)
+        self.addAction(self.undo_action)
+        self.redo_action = QAction("重做", self)
+        self.redo_action.setShortcut(QKeySequence.Redo)
+        self.redo_action.triggered.connect(self.on_redo)
+        self.addAction(self.redo_action)
+
+        # 树中只显示长字符串的预览, 完整值在这里分页查看
+        self.value_detail = ValueDetail()
+        self.value_detail.watch(self.json_view)
+        detail_dock = QDockWidget("值", self)
+        detail_dock.setWidget(self.value_detail)
+        self.addDockWidget(Qt.RightDockWidgetArea, detail_dock)
+
+        patch_menu = self.menubar.addMenu("补丁")
+        patch_menu.addAction("导出补丁", self.on_export_patch)
+        patch_menu.addAction("应用补丁", self.on_apply_patch)
 
         self.setWindowTitle("JSON Viewer")
         self.show()
     
     def on_click_test(self):
         # self.load_json("address.json")
-        with open('dump.json', 'w') as outfile:
-            json_str = json.dump(self.json_data, outfile, indent=4)
-        print("!!!on_click_test")
+        self.save_json("dump.json")
+
+    def can_edit(self):
+        if self.json_data is None or self.saver is not None:
+            return False
+        return self.loader is None or not self.loader.isRunning()
+
+    def on_undo(self):
+        if not self.can_edit():
+            return
+        text = self.json_view.undo_stack.undo()
+        # 撤销补丁可能替换根节点
+        self.json_data = self.json_view.json_data
+        if text is not None:
+            self.statusbar.showMessage("Undo: %s" % text)
+
+    def on_redo(self):
+        if not self.can_edit():
+            return
+        text = self.json_view.undo_stack.redo()
+        self.json_data = self.json_view.json_data
+        if text is not None:
+            self.statusbar.showMessage("Redo: %s" % text)
+
+    def on_export_patch(self):
+        fpath, _ = QFileDialog.getSaveFileName(
+            self, "Export JSON Patch", "", "JSON Patch (*.json)")
+        if not fpath:
+            return
+        try:
+            self.json_view.journal.save(fpath)
+        except OSError as e:
+            self.statusbar.showMessage(str(e))
+            return
+        self.statusbar.showMessage("%d operations exported"
+                                   % len(self.json_view.journal))
+
+    def on_apply_patch(self):
+        if not self.can_edit():
+            self.statusbar.showMessage("The document cannot be edited now")
+            return
+
+        fpath, _ = QFileDialog.getOpenFileName(
+            self, "Apply JSON Patch", "", "JSON Patch (*.json)")
+        if not fpath:
+            return
+        try:
+            patch = load_patch(fpath)
+            self.json_view.apply_patch(patch)
+        except (OSError, PatchError) as e:
+            self.statusbar.showMessage(str(e))
+            return
+        finally:
+            self.json_data = self.json_view.json_data
+        self.statusbar.showMessage("%d operations applied" % len(patch))
+
+    def save_json(self, jpath, indent=4):
+        if self.json_data is None:
+            return
+        if self.loader is not None and self.loader.isRunning():
+            self.statusbar.showMessage("Wait for the document to finish loading")
+            return
+        if self.saver is not None:
+            self.statusbar.showMessage("A save is already running")
+            return
+
+        # 保存线程遍历json_data期间禁止编辑
+        self.set_editable(False)
+        self.saver = JsonSaveThread(self.json_data, str(jpath), self,
+                                    indent=indent)
+        self.saver.done.connect(self.on_save_done)
+        self.load_progress.track(self.saver, "Save")
+        self.saver.start()
+
+    def on_save_done(self, completed):
+        if self.sender() is not self.saver:
+            return
+        if completed:
+            self.statusbar.showMessage("Saved %s" % self.saver.fpath)
+        self.saver = None
+        self.set_editable(True)
+
+    def set_editable(self, editable):
+        if editable:
+            self.json_view.setEditTriggers(self.edit_triggers)
+            self.json_view.setContextMenuPolicy(Qt.CustomContextMenu)
+        else:
+            self.edit_triggers = self.json_view.editTriggers()
+            self.json_view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+            self.json_view.setContextMenuPolicy(Qt.NoContextMenu)
+
+    def stop_saving(self):
+        if self.saver is not None:
+            self.saver.cancel()
+            self.saver.wait()
+            self.saver = None
+            self.set_editable(True)
 
     def load_json(self, jpath):
         jpath = Path(jpath)
-        with open(jpath) as jfile:
-            jdata = json.load(jfile, object_pairs_hook=collections.OrderedDict)
-        
-        jscheme_path = jpath.with_suffix('.schem.json')
+        self.stop_saving()
+        self.stop_loading()
+
+        jscheme_path = jpath.with_suffix('.scheme.json')
         jscheme = None
         if jscheme_path.exists():
-            with open(jscheme_path) as jschemeFile:
-                jscheme = json.load(jschemeFile, object_pairs_hook=collections.OrderedDict)
+            jscheme = get_decoder().load(str(jscheme_path))
+
+        # 后台线程解析, 顶层节点分批加入树
+        self.load_args = (jpath, jscheme)
+        self.loader = JsonLoadThread(str(jpath), self)
+        self.loader.container_type.connect(self.on_container_type)
+        self.loader.batch_loaded.connect(self.on_batch_loaded)
+        self.load_progress.track(self.loader)
+        self.loader.start()
+
+    def on_container_type(self, container_type):
+        # Ignore signals still queued from a cancelled load
+        if self.sender() is not self.loader:
+            return
+        self.json_view.begin_load(container_type, *self.load_args)
+        self.json_data = self.json_view.json_data
+
+    def on_batch_loaded(self, entries):
+        if self.sender() is not self.loader:
+            return
+        self.json_view.append_entries(entries)
+
+    def stop_loading(self):
+        if self.loader is not None:
+            self.loader.cancel()
+            self.loader.wait()
+            self.loader = None
 
-        self.json_data = jdata
-        self.json_view.load_json(jdata, jpath, jscheme)
+    def closeEvent(self, e):
+        self.stop_loading()
+        # Let a running save complete rather than lose it
+        if self.saver is not None:
+            self.saver.wait()
+        super(JsonEditor, self).closeEvent(e)
     
     def sizeHint(self):
         return QSize(640, 480)
@@ -0,0 +1,140 @@
+import bisect
+
+from PyQt5 import QtCore
+
+from json_metrics import metrics
+from qjsonmodel import QJsonBucket
+
+
+class JsonFilterProxy(QtCore.QSortFilterProxyModel):
+    """Rows of a QJsonModel that lead to a set of nodes, in document
+    order
+
+    The filter is a tree of keys as built by SearchIndex.key_tree. A row
+    is kept when its key is in the tree of its parent, a range of rows
+    when one of the indices in it is, and every row below a key kept
+    whole. Rows are only checked once their parent is expanded, so
+    changing the filter costs what is shown, not the document size.
+
+    """
+
+    def __init__(self, parent=None):
+        super(JsonFilterProxy, self).__init__(parent)
+
+        # None to keep every row
+        self._tree = None
+        # internalId of a source parent -> its tree, None if kept whole
+        self._trees = {}
+        # id of a tree -> its list indices, sorted, for the ranges
+        self._positions = {}
+        self._connections = []
+
+    def setSourceModel(self, model):
+        for signal, slot in self._connections:
+            signal.disconnect(slot)
+        self._connections = []
+        self._trees.clear()
+
+        super(JsonFilterProxy, self).setSourceModel(model)
+
+        if model is not None:
+            # Ids of removed items may be reused
+            for signal in (model.modelReset, model.layoutChanged,
+                           model.rowsRemoved):
+                signal.connect(self._trees.clear)
+                self._connections.append((signal, self._trees.clear))
+
+    def setFilter(self, tree):
+        """Keep the rows leading to the keys of `tree`, all if None"""
+        with metrics.timer("filter"):
+            self._tree = tree
+            self._trees.clear()
+            self._positions.clear()
+            self.invalidateFilter()
+
+    def filter(self):
+        return self._tree
+
+    def _keyTree(self, source_parent):
+        """Tree of the children of `source_parent`, None if they are
+        all kept"""
+        if not source_parent.isValid():
+            return self._tree
+
+        key = source_parent.internalId()
+        try:
+            return self._trees[key]
+        except KeyError:
+            pass
+
+        tree = self._keyTree(source_parent.parent())
+        item = source_parent.internalPointer()
+        # Ranges share the tree of the container they split
+        if tree is not None and not isinstance(item, QJsonBucket):
+            tree = tree.get(item.key, {})
+        self._trees[key] = tree
+        return tree
+
+    def _positionsOf(self, tree):
+        positions = self._positions.get(id(tree))
+        if positions is None:
+            positions = self._positions[id(tree)] = sorted(
+                int(key) for key in tree)
+        return positions
+
+    def _bucketRows(self, tree, bucket):
+        """Kept children in the rows of `bucket`"""
+        if bucket.item.type is dict:
+            # Members are not found by position, see QJsonModel
+            # bucket_dicts
+            return len(tree)
+        positions = self._positionsOf(tree)
+        return (bisect.bisect_left(positions, bucket.stop())
+                - bisect.bisect_left(positions, bucket.start))
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        if self._tree is None:
+            return True
+        tree = self._keyTree(source_parent)
+        if tree is None:
+            return True
+
+        item = self.sourceModel().index(
+            source_row, 0, source_parent).internalPointer()
+        if isinstance(item, QJsonBucket):
+            return self._bucketRows(tree, item) > 0
+        return item.key in tree
+
+    def _keptRows(self, source_parent):
+        """Number of rows kept under `source_parent`, None if all"""
+        if self._tree is None:
+            return None
+        tree = self._keyTree(source_parent)
+        if tree is None:
+            return None
+        if source_parent.isValid():
+            item = source_parent.internalPointer()
+            if isinstance(item, QJsonBucket):
+                return self._bucketRows(tree, item)
+        return len(tree)
+
+    def canFetchMore(self, parent):
+        source_parent = self.mapToSource(parent)
+        if not self.sourceModel().canFetchMore(source_parent):
+            return False
+        kept = self._keptRows(source_parent)
+        return kept is None or self.rowCount(parent) < kept
+
+    def fetchMore(self, parent):
+        source = self.sourceModel()
+        source_parent = self.mapToSource(parent)
+        kept = self._keptRows(source_parent)
+        if kept is None:
+            source.fetchMore(source_parent)
+            return
+
+        # A batch may hold no kept row at all, after which the view
+        # would not ask for the next one
+        while (self.rowCount(parent) < kept
+               and source.canFetchMore(source_parent)):
+            source.fetchMore(source_parent)
@@ -0,0 +1,550 @@
+import bisect
+import collections
+import mmap
+import os
+import re
+import sys
+from array import array
+
+from PyQt5 import QtCore
+
+from json_decode import get_decoder
+from json_metrics import metrics
+from json_text import display_text
+
+
+# Strings are matched whole so that brackets and commas inside them are
+# skipped, numbers and literals are located from the separators around
+# them
+TOKEN_RE = re.compile(rb'"(?:[^"\\]|\\.)*"|[\[\]{},:]', re.DOTALL)
+WHITESPACE = b" \t\n\r"
+# Numbers and literals json.loads accepts
+SCALAR_RE = re.compile(
+    rb"(?:-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?"
+    rb"|true|false|null|NaN|-?Infinity)[ \t\n\r]*")
+
+# Shown in the type column, one shared string per type
+TYPE_LABELS = {typ: typ.__name__
+               for typ in (dict, list, str, int, float, bool, type(None))}
+
+
+def type_label(typ):
+    label = TYPE_LABELS.get(typ)
+    if label is None:
+        label = TYPE_LABELS[typ] = sys.intern(typ.__name__)
+    return label
+
+
+# Item data role of the raw value, for views that need the whole of it
+ValueRole = QtCore.Qt.UserRole + 2
+# Item data role of the key a column is sorted by, see json_sort
+SortRole = QtCore.Qt.UserRole + 3
+
+
+def sort_key(typ, value=None):
+    """Key ordering values of any JSON type: null, booleans, numbers,
+    strings, then objects and arrays
+
+    Only containers are told by `typ`, scalars by the value itself,
+    which edits may leave as text.
+    """
+
+    if typ is dict or typ is list:
+        return (4, typ is list)
+    typ = type(value)
+    if value is None:
+        return (0,)
+    if typ is bool:
+        return (1, value)
+    if typ is int or typ is float:
+        return (2, value)
+    if typ is str:
+        return (3, value.casefold(), value)
+    return (5, str(value))
+
+
+def _blank(buf, start, stop):
+    """Whether only whitespace stands between two tokens"""
+    return start == stop or not buf[start:stop].strip(WHITESPACE)
+
+
+class _Frame(object):
+    """Container being scanned, its entries are flushed on close"""
+
+    __slots__ = (
+        "cid", "is_dict", "key_gaps", "vals", "nodes", "node_rows",
+        "value_from", "key", "key_end", "val", "val_end", "node",
+    )
+
+    def __init__(self, cid, is_dict, value_from, typecode):
+        self.cid = cid
+        self.is_dict = is_dict
+        self.key_gaps = array(typecode)
+        self.vals = array(typecode)
+        # Containers among the entries and their rows
+        self.nodes = array(typecode)
+        self.node_rows = array(typecode)
+        self.value_from = value_from
+        self.reset_entry()
+
+    def reset_entry(self):
+        self.key = -1
+        self.key_end = -1
+        self.val = -1
+        self.val_end = -1
+        self.node = -1
+
+    def end_entry(self, buf, stop, closing=False):
+        if self.key >= 0 and self.value_from <= self.key:
+            raise ValueError("Expecting ':' at byte %d" % self.key_end)
+        if self.val < 0:
+            # Number or literal between the last separator and `stop`
+            start = self.value_from
+            while start < stop and buf[start] in WHITESPACE:
+                start += 1
+            if start == stop:
+                # Only an empty container has no entry before its end
+                if self.key >= 0 or not closing or self.vals:
+                    raise ValueError("Missing value at byte %d" % stop)
+                return
+            if not SCALAR_RE.fullmatch(buf, start, stop):
+                raise ValueError("Invalid value at byte %d" % start)
+            self.val = start
+            self.val_end = stop
+        elif not (_blank(buf, self.value_from, self.val)
+                  and _blank(buf, self.val_end, stop)):
+            raise ValueError("Unexpected data around the value at byte %d"
+                             % self.val)
+        if self.is_dict and self.key < 0:
+            raise ValueError("Expecting property name at byte %d" % self.val)
+        self.key_gaps.append(self.val - self.key if self.key >= 0 else 0)
+        if self.node >= 0:
+            self.nodes.append(self.node)
+            self.node_rows.append(len(self.vals))
+        self.vals.append(self.val)
+        self.reset_entry()
+
+
+class JsonIndex(object):
+    """Byte offset index over a memory-mapped JSON file
+
+    One structural scan records, for every container, where each child's
+    value starts and how far before it its key starts. Ends are found
+    again from the starts when a key or value is decoded, only decoded
+    ones are kept, in a small LRU.
+
+    Containers are numbered in document order, the root is container 0.
+    Their entries are stored contiguously so that entry
+    `first(cid) + row` is the child at `row`. Files under 4 GB are
+    indexed in 32 bit arrays, 8 bytes per entry and 24 per container.
+
+    """
+
+    LRU_SIZE = 4096
+    SCAN_REPORT_BYTES = 1 << 22
+    # The whole index besides the mapped file, see arrays
+    ARRAYS = (
+        "node_first", "node_count", "node_entry", "node_start",
+        "flushed_first", "flushed_node", "entry_key_gap", "entry_val",
+    )
+
+    def __init__(self, fpath, decoder=None):
+        self.fpath = fpath
+        # json_decode.JsonDecoder of keys and values
+        self.decoder = decoder or get_decoder()
+        self._file = open(fpath, "rb")
+        if os.fstat(self._file.fileno()).st_size == 0:
+            raise ValueError("Empty JSON document")
+        self.buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        # Offsets and counts never exceed the file size
+        typecode = "I" if len(self.buf) < 1 << 32 else "q"
+        self._typecode = typecode
+
+        # Per container, the entry of the root is unused
+        self.node_first = array(typecode)
+        self.node_count = array(typecode)
+        self.node_entry = array(typecode)
+        # Offset of the opening bracket, rising with the container id
+        self.node_start = array(typecode)
+        # First entries of the non-empty containers in the order they
+        # were flushed, rising, and the containers. Parents are found
+        # from these
+        self.flushed_first = array(typecode)
+        self.flushed_node = array(typecode)
+
+        # Per entry, the key gap is 0 in lists
+        self.entry_key_gap = array(typecode)
+        self.entry_val = array(typecode)
+
+        self._decoded = collections.OrderedDict()
+
+    @classmethod
+    def from_arrays(cls, fpath, arrays):
+        """Map `fpath` with an index built elsewhere, e.g. in another
+        process, see arrays"""
+        index = cls(fpath)
+        for name in cls.ARRAYS:
+            setattr(index, name, arrays[name])
+        return index
+
+    def arrays(self):
+        """Flat arrays of the index, cheap to pickle"""
+        return {name: getattr(self, name) for name in self.ARRAYS}
+
+    def close(self):
+        self.buf.close()
+        self._file.close()
+
+    def scan(self):
+        for _ in self.iter_scan():
+            pass
+
+    def iter_scan(self):
+        """Build the index, yielding the bytes scanned so far now and then"""
+        buf = self.buf
+        stack = []
+        frame = None
+        next_report = self.SCAN_REPORT_BYTES
+        pos = 0
+        # End of the top-level container
+        end = 0
+
+        for match in TOKEN_RE.finditer(buf):
+            pos = match.start()
+            tok = buf[pos]
+
+            if pos >= next_report:
+                next_report = pos + self.SCAN_REPORT_BYTES
+                yield pos
+
+            if tok == 0x22:  # "
+                if frame is None:
+                    raise ValueError("Top-level JSON value must be an "
+                                     "object or array")
+                if frame.is_dict and frame.key < 0:
+                    if not _blank(buf, frame.value_from, pos):
+                        raise ValueError("Unexpected data before byte %d"
+                                         % pos)
+                    frame.key = pos
+                    frame.key_end = match.end()
+                elif frame.val >= 0:
+                    raise ValueError("Expecting ',' at byte %d" % pos)
+                else:
+                    frame.val = pos
+                    frame.val_end = match.end()
+
+            elif tok == 0x7b or tok == 0x5b:  # { [
+                if frame is None and self.node_first:
+                    raise ValueError("Extra data at byte %d" % pos)
+                if frame is None and not _blank(buf, 0, pos):
+                    raise ValueError("Unexpected data before byte %d" % pos)
+                if frame is not None and frame.val >= 0:
+                    raise ValueError("Expecting ',' at byte %d" % pos)
+                cid = len(self.node_first)
+                self.node_first.append(0)
+                self.node_count.append(0)
+                self.node_entry.append(0)
+                self.node_start.append(pos)
+                if frame is not None:
+                    frame.val = pos
+                    frame.node = cid
+                    stack.append(frame)
+                frame = _Frame(cid, tok == 0x7b, pos + 1, self._typecode)
+
+            elif tok == 0x7d or tok == 0x5d:  # } ]
+                if frame is None or (tok == 0x7d) != frame.is_dict:
+                    raise ValueError("Unexpected %r at byte %d"
+                                     % (chr(tok), pos))
+                frame.end_entry(buf, pos, True)
+                self._flush(frame)
+                if not stack:
+                    frame = None
+                    end = pos + 1
+                    continue
+                # The parent's entry for this container is complete,
+                # entry numbers are assigned when the parent is flushed
+                frame = stack.pop()
+                frame.val_end = pos + 1
+
+            elif tok == 0x2c:  # ,
+                if frame is None:
+                    raise ValueError("Unexpected ',' at byte %d" % pos)
+                frame.end_entry(buf, pos)
+                frame.value_from = pos + 1
+
+            else:  # :
+                if (frame is None or frame.key < 0
+                        or frame.value_from > frame.key
+                        or not _blank(buf, frame.key_end, pos)):
+                    raise ValueError("Unexpected ':' at byte %d" % pos)
+                frame.value_from = pos + 1
+
+        if frame is not None or not self.node_first:
+            raise ValueError("Unexpected end of JSON document")
+        if not _blank(buf, end, len(buf)):
+            raise ValueError("Extra data at byte %d" % end)
+        yield len(buf)
+
+    def _flush(self, frame):
+        first = len(self.entry_val)
+        count = len(frame.vals)
+        self.node_first[frame.cid] = first
+        self.node_count[frame.cid] = count
+        if count:
+            self.flushed_first.append(first)
+            self.flushed_node.append(frame.cid)
+
+        self.entry_key_gap.extend(frame.key_gaps)
+        self.entry_val.extend(frame.vals)
+
+        node_entry = self.node_entry
+        for cid, row in zip(frame.nodes, frame.node_rows):
+            node_entry[cid] = first + row
+
+    # Navigation
+
+    def first(self, cid):
+        return self.node_first[cid]
+
+    def count(self, cid):
+        return self.node_count[cid]
+
+    def is_dict(self, cid):
+        return self.buf[self.node_start[cid]] == 0x7b
+
+    def child_node(self, entry):
+        """Container id of an entry's value, -1 for scalars"""
+        start = self.entry_val[entry]
+        if self.buf[start] not in b"{[":
+            return -1
+        return bisect.bisect_left(self.node_start, start)
+
+    def parent_node(self, entry):
+        i = bisect.bisect_right(self.flushed_first, entry) - 1
+        return self.flushed_node[i]
+
+    def node_row(self, cid):
+        """Entry number and row of a container inside its parent"""
+        if cid == 0:
+            return -1, 0
+        entry = self.node_entry[cid]
+        return entry, entry - self.node_first[self.parent_node(entry)]
+
+    # Decoding
+
+    def decoded(self, entry):
+        """(key, value) of an entry, value is None for containers
+
+        Keys of list entries are their row.
+
+        """
+
+        try:
+            self._decoded.move_to_end(entry)
+            return self._decoded[entry]
+        except KeyError:
+            pass
+
+        start = self.entry_val[entry]
+        gap = self.entry_key_gap[entry]
+        if gap:
+            key = self._decode(start - gap, self._scalar_end(start - gap))
+        else:
+            key = entry - self.node_first[self.parent_node(entry)]
+
+        if self.buf[start] in b"{[":
+            value = None
+        else:
+            value = self._decode(start, self._scalar_end(start))
+
+        self._decoded[entry] = key, value
+        if len(self._decoded) > self.LRU_SIZE:
+            self._decoded.popitem(last=False)
+        return key, value
+
+    def _scalar_end(self, start):
+        """End of the string, number or literal at `start`"""
+        if self.buf[start] == 0x22:
+            return TOKEN_RE.match(self.buf, start).end()
+        return SCALAR_RE.match(self.buf, start).end()
+
+    def _container_end(self, start):
+        """End of the object or array opening at `start`"""
+        depth = 0
+        for match in TOKEN_RE.finditer(self.buf, start):
+            tok = self.buf[match.start()]
+            if tok == 0x7b or tok == 0x5b:
+                depth += 1
+            elif tok == 0x7d or tok == 0x5d:
+                depth -= 1
+                if not depth:
+                    return match.end()
+        raise ValueError("Unexpected end of JSON document")
+
+    def _decode(self, start, end):
+        try:
+            return self.decoder.loads(self.buf[start:end])
+        except ValueError as e:
+            # The scan does not check escapes inside strings, a bad one
+            # is shown rather than raised while painting
+            return "<invalid JSON: %s>" % e
+
+    def value_type(self, entry):
+        tok = self.buf[self.entry_val[entry]]
+        if tok == 0x7b:
+            return dict
+        if tok == 0x5b:
+            return list
+        return type(self.decoded(entry)[1])
+
+    def load(self, cid=0):
+        """Decode a whole container into Python objects"""
+        if not cid:
+            return self.decoder.loads(self.buf[:])
+        start = self.node_start[cid]
+        return self.decoder.loads(
+            self.buf[start:self._container_end(start)])
+
+
+class JsonIndexThread(QtCore.QThread):
+    """Build a JsonIndex in the background
+
+    Signals match JsonLoadThread so a LoadProgress can track either.
+
+    """
+
+    # bytes scanned, bytes total, containers found
+    progress = QtCore.pyqtSignal(int, int, int)
+    failed = QtCore.pyqtSignal(str)
+    # False when cancelled or failed
+    done = QtCore.pyqtSignal(bool)
+
+    def __init__(self, fpath, parent=None):
+        super(JsonIndexThread, self).__init__(parent)
+        self.fpath = fpath
+        self.index = None
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    def run(self):
+        with metrics.timer("index"):
+            self._scan()
+
+    def _scan(self):
+        try:
+            index = JsonIndex(self.fpath)
+            total = len(index.buf)
+            for nbytes in index.iter_scan():
+                if self._cancelled:
+                    index.close()
+                    self.done.emit(False)
+                    return
+                self.progress.emit(nbytes, total, len(index.node_first))
+        except (OSError, ValueError) as e:
+            self.failed.emit(str(e))
+            self.done.emit(False)
+            return
+
+        self.index = index
+        self.done.emit(True)
+
+
+class QJsonIndexModel(QtCore.QAbstractItemModel):
+    """Read-only model over a JsonIndex
+
+    Indexes carry their entry number as internal id, no Python object
+    is kept per row.
+
+    """
+
+    def __init__(self, index, parent=None):
+        super(QJsonIndexModel, self).__init__(parent)
+
+        self._index = index
+        self._headers = ("key", "value", "type")
+
+    def getIndex(self):
+        return self._index
+
+    def data(self, index, role):
+        if not index.isValid():
+            return None
+
+        if role == ValueRole:
+            entry = index.internalId()
+            if self._index.child_node(entry) >= 0:
+                return None
+            return self._index.decoded(entry)[1]
+
+        if role == SortRole:
+            entry = index.internalId()
+            if index.column() == 0:
+                key = self._index.decoded(entry)[0]
+                return sort_key(type(key), key)
+            typ = self._index.value_type(entry)
+            if index.column() == 1:
+                return sort_key(typ, self._index.decoded(entry)[1])
+            return type_label(typ)
+
+        if role != QtCore.Qt.DisplayRole:
+            return None
+
+        entry = index.internalId()
+        if index.column() == 0:
+            return str(self._index.decoded(entry)[0])
+
+        if index.column() == 1:
+            if self._index.child_node(entry) >= 0:
+                return ""
+            return display_text(self._index.decoded(entry)[1])
+
+        if index.column() == 2:
+            return type_label(self._index.value_type(entry))
+
+    def headerData(self, section, orientation, role):
+        if role != QtCore.Qt.DisplayRole:
+            return None
+
+        if orientation == QtCore.Qt.Horizontal:
+            return self._headers[section]
+
+    def _node(self, parent):
+        if not parent.isValid():
+            return 0
+        return self._index.child_node(parent.internalId())
+
+    def index(self, row, column, parent=QtCore.QModelIndex()):
+        if not self.hasIndex(row, column, parent):
+            return QtCore.QModelIndex()
+
+        cid = self._node(parent)
+        return self.createIndex(row, column, self._index.first(cid) + row)
+
+    def parent(self, index):
+        if not index.isValid():
+            return QtCore.QModelIndex()
+
+        cid = self._index.parent_node(index.internalId())
+        entry, row = self._index.node_row(cid)
+        if entry < 0:
+            return QtCore.QModelIndex()
+
+        return self.createIndex(row, 0, entry)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.column() > 0:
+            return 0
+
+        cid = self._node(parent)
+        if cid < 0:
+            return 0
+        return self._index.count(cid)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 3
+
+
+# Only wrapped while metrics are enabled
+metrics.instrument(QJsonIndexModel, ("index", "parent", "data", "rowCount"))
@@ -0,0 +1,153 @@
+import math
+
+
+class Interner(object):
+    """Share equal keys and short strings between the values of a
+    document, and optionally equal leaf containers
+
+    Parsers build a new string for every occurrence of a text, so an
+    array of records holds its keys and repeated values once per
+    record. Values passed to `intern` are rewritten in place to use the
+    first string seen with each text. An interner is meant to live as
+    long as one load, its tables are dropped with it.
+
+    With `share_leaves`, dicts and lists holding only scalars are
+    replaced by the first equal one seen, key order and value types
+    included. The same container then appears at several places of the
+    document and must not be changed in place. QJsonModel items keep a
+    reference to the raw value they are created from, which is safe
+    only because the model never mutates raw containers: edits and
+    patches replace items instead. JsonTreeWidget edits its document in
+    place and must not be given shared leaves.
+
+    Arguments:
+        max_length (int, optional): Longer string values are left
+            alone, they rarely repeat. Keys are always interned
+        share_leaves (bool, optional): Share equal leaf containers
+
+    """
+
+    MAX_LENGTH = 32
+    # Leaves remembered before the table is dropped, records holding an
+    # id are all different
+    MAX_LEAVES = 1 << 12
+
+    def __init__(self, max_length=MAX_LENGTH, share_leaves=False):
+        self.max_length = max_length
+        self.share_leaves = share_leaves
+        self._strings = {}
+        # Items of a leaf -> first leaf container seen with them
+        self._leaves = {}
+        # Leaf containers replaced by a shared one
+        self.shared_leaves = 0
+
+    def string(self, text):
+        """The first string seen equal to `text`"""
+        return self._strings.setdefault(text, text)
+
+    def intern(self, value):
+        """Intern the keys and strings of `value` in place
+
+        Returns:
+            `value`, or the shared leaf equal to it
+
+        """
+
+        string = self._strings.setdefault
+        max_length = self.max_length
+
+        if not isinstance(value, (dict, list)):
+            if type(value) is str and len(value) <= max_length:
+                return string(value, value)
+            return value
+
+        # (parent, key or index in it, container), a shared leaf takes
+        # the place of the container in its parent
+        stack = [(None, None, value)]
+        while stack:
+            parent, slot, container = stack.pop()
+            leaf = True
+            if isinstance(container, dict):
+                items = []
+                changed = False
+                for key, child in container.items():
+                    shared = string(key, key)
+                    if shared is not key:
+                        changed = True
+                        key = shared
+                    if type(child) is str:
+                        if len(child) <= max_length:
+                            shared = string(child, child)
+                            if shared is not child:
+                                changed = True
+                                child = shared
+                    elif isinstance(child, (dict, list)):
+                        leaf = False
+                        stack.append((container, key, child))
+                    items.append((key, child))
+                # Equal keys are not replaced by assignment, the dict is
+                # rebuilt in the same order
+                if changed:
+                    container.clear()
+                    container.update(items)
+            else:
+                for i, child in enumerate(container):
+                    if type(child) is str:
+                        if len(child) <= max_length:
+                            container[i] = string(child, child)
+                    elif isinstance(child, (dict, list)):
+                        leaf = False
+                        stack.append((container, i, child))
+
+            if leaf and self.share_leaves:
+                shared = self._shareLeaf(container)
+                if shared is not container:
+                    if parent is None:
+                        value = shared
+                    else:
+                        parent[slot] = shared
+
+        return value
+
+    def _shareLeaf(self, leaf):
+        """The first leaf seen equal to `leaf`"""
+        if isinstance(leaf, dict):
+            signature = tuple(leaf.items())
+        else:
+            signature = tuple(leaf)
+
+        leaves = self._leaves
+        shared = leaves.get(signature)
+        if shared is None:
+            if len(leaves) >= self.MAX_LEAVES:
+                leaves.clear()
+            leaves[signature] = leaf
+            return leaf
+        if shared is leaf:
+            return leaf
+
+        # Equal values of different types, 1 and True, or of different
+        # signs, 0.0 and -0.0, stay apart. Empty dicts and lists have the
+        # same items
+        if type(shared) is not type(leaf):
+            return leaf
+        types = _types(leaf)
+        if (_types(shared) != types
+                or (float in types and 0.0 in _values(leaf)
+                    and _signs(shared) != _signs(leaf))):
+            return leaf
+        self.shared_leaves += 1
+        return shared
+
+
+def _values(container):
+    return container.values() if isinstance(container, dict) else container
+
+
+def _types(container):
+    return list(map(type, _values(container)))
+
+
+def _signs(container):
+    return [math.copysign(1.0, value) for value in _values(container)
+            if type(value) is float]
@@ -0,0 +1,260 @@
+import os
+import time
+
+from PyQt5 import QtCore
+from PyQt5 import QtWidgets
+
+from json_intern import Interner
+from json_metrics import metrics
+from json_stream import count_nodes, iter_file_entries
+from json_writer import JsonWriter
+
+
+class JsonLoadThread(QtCore.QThread):
+    """Parse a JSON file in the background
+
+    Top-level entries are handed to the GUI thread in batches through
+    `batch_loaded`. A batch is cut every `batch_interval` seconds or
+    `batch_nodes` parsed nodes, and the parser waits while
+    `max_pending` batches are still queued so the event loop always gets
+    a chance to repaint between batches.
+
+    Keys and short strings are interned as entries arrive, see
+    json_intern.Interner. Equal leaf containers are only shared with
+    `share_leaves`, for documents shown through a QJsonModel.
+
+    """
+
+    # type of the top-level container, dict or list
+    container_type = QtCore.pyqtSignal(object)
+    # list of (key, value) tuples, emitted in the GUI thread
+    batch_loaded = QtCore.pyqtSignal(list)
+    # bytes read, bytes total, nodes parsed
+    progress = QtCore.pyqtSignal(int, int, int)
+    failed = QtCore.pyqtSignal(str)
+    # False when cancelled
+    done = QtCore.pyqtSignal(bool)
+
+    _batch_ready = QtCore.pyqtSignal(list)
+
+    batch_interval = 0.1
+    batch_nodes = 2000
+    max_pending = 2
+
+    def __init__(self, fpath, parent=None, search_index=None, decoder=None,
+                 share_leaves=False):
+        super(JsonLoadThread, self).__init__(parent)
+        self.fpath = fpath
+        self.share_leaves = share_leaves
+        # json_decode.JsonDecoder, the fastest installed by default
+        self.decoder = decoder
+        # json_search.SearchIndex filled in this thread as entries arrive
+        self.search_index = search_index
+        self._cancelled = False
+        self._pending = QtCore.QSemaphore(self.max_pending)
+        # The thread object lives in the GUI thread, so this slot runs
+        # there
+        self._batch_ready.connect(self._deliver)
+
+    def cancel(self):
+        self._cancelled = True
+
+    def _deliver(self, batch):
+        self.batch_loaded.emit(batch)
+        self._pending.release()
+
+    def _emit_batch(self, batch):
+        while not self._pending.tryAcquire(1, 50):
+            if self._cancelled:
+                return
+        self._batch_ready.emit(batch)
+
+    def run(self):
+        with metrics.timer("parse"):
+            self._parse()
+
+    def _parse(self):
+        nodes = 0
+        batch = []
+        batch_nodes = 0
+        last_emit = time.monotonic()
+        interner = Interner(share_leaves=self.share_leaves)
+
+        try:
+            total = os.path.getsize(self.fpath)
+            with open(self.fpath, "rb") as jfile:
+                entries = iter_file_entries(jfile, self.decoder)
+                self.container_type.emit(next(entries))
+
+                for key, value, nbytes in entries:
+                    if self._cancelled:
+                        break
+
+                    if isinstance(key, str):
+                        key = interner.string(key)
+                    value = interner.intern(value)
+                    batch.append((key, value))
+                    if self.search_index is not None:
+                        before = len(self.search_index)
+                        self.search_index.add_value(
+                            self.search_index.ROOT, str(key), value)
+                        count = len(self.search_index) - before
+                    else:
+                        count = count_nodes(value)
+                    nodes += count
+                    batch_nodes += count
+
+                    now = time.monotonic()
+                    if (batch_nodes >= self.batch_nodes
+                            or now - last_emit >= self.batch_interval):
+                        self._emit_batch(batch)
+                        self.progress.emit(nbytes, total, nodes)
+                        batch = []
+                        batch_nodes = 0
+                        last_emit = now
+        except (OSError, ValueError) as e:
+            self.failed.emit(str(e))
+            self.done.emit(False)
+            return
+
+        if batch and not self._cancelled:
+            self._emit_batch(batch)
+        if not self._cancelled:
+            self.progress.emit(total, total, nodes)
+        self.done.emit(not self._cancelled)
+
+
+class JsonSaveThread(QtCore.QThread):
+    """Save a document in the background with JsonWriter.save
+
+    The document must not change until `done` is emitted. Signals match
+    JsonLoadThread so a LoadProgress can track the save.
+
+    """
+
+    # 0, 0 (size unknown), nodes written
+    progress = QtCore.pyqtSignal(int, int, int)
+    failed = QtCore.pyqtSignal(str)
+    # False when cancelled or failed
+    done = QtCore.pyqtSignal(bool)
+
+    report_interval = 0.1
+
+    def __init__(self, root, fpath, parent=None, adapter=None, indent=None,
+                 ensure_ascii=True):
+        super(JsonSaveThread, self).__init__(parent)
+        self.root = root
+        self.fpath = fpath
+        self.writer = JsonWriter(adapter, indent, ensure_ascii)
+        self._cancelled = False
+        self._last_report = 0.0
+
+    def cancel(self):
+        self._cancelled = True
+
+    def _stop(self):
+        # Called between chunks, doubles as the progress report
+        now = time.monotonic()
+        if now - self._last_report >= self.report_interval:
+            self._last_report = now
+            self.progress.emit(0, 0, self.writer.nodes)
+        return self._cancelled
+
+    def run(self):
+        try:
+            with metrics.timer("save"):
+                completed = self.writer.save(self.root, self.fpath,
+                                             self._stop)
+        except (OSError, TypeError, ValueError) as e:
+            self.failed.emit(str(e))
+            self.done.emit(False)
+            return
+
+        self.done.emit(completed)
+
+
+class LoadProgress(QtWidgets.QWidget):
+    """Progress bar with a cancel button for a JsonLoadThread
+
+    Any thread with the same progress/failed/done signals can be
+    tracked, e.g. JsonSaveThread.
+
+    """
+
+    def __init__(self, parent=None):
+        super(LoadProgress, self).__init__(parent)
+
+        self.loader = None
+        self.action = "Load"
+
+        self.label = QtWidgets.QLabel()
+        self.progress_bar = QtWidgets.QProgressBar()
+        self.progress_bar.setRange(0, 1000)
+        self.cancel_button = QtWidgets.QPushButton("Cancel")
+        self.cancel_button.clicked.connect(self.cancel)
+
+        layout = QtWidgets.QHBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.label)
+        layout.addWidget(self.progress_bar)
+        layout.addWidget(self.cancel_button)
+        self.setLayout(layout)
+        self.hide()
+
+    def track(self, loader, action="Load"):
+        """Show the progress of `loader`
+
+        Arguments:
+            loader (QThread): JsonLoadThread or compatible
+            action (str, optional): Named in the status texts
+
+        """
+
+        self.loader = loader
+        self.action = action
+        loader.progress.connect(self.on_progress)
+        loader.failed.connect(self.on_failed)
+        loader.done.connect(self.on_done)
+        self.progress_bar.setRange(0, 1000)
+        self.progress_bar.setValue(0)
+        self.label.setText("%s started..." % action)
+        self.cancel_button.setEnabled(True)
+        self.show()
+
+    def cancel(self):
+        if self.loader is not None:
+            self.loader.cancel()
+            self.cancel_button.setEnabled(False)
+
+    def on_progress(self, nbytes, total, nodes):
+        if self.sender() is not self.loader:
+            return
+        if not total:
+            # Size not known up front, show a busy indicator
+            self.progress_bar.setRange(0, 0)
+            self.label.setText("%d nodes" % nodes)
+            return
+        self.progress_bar.setValue(int(1000 * nbytes / total))
+        self.label.setText("%.1f / %.1f MB, %d nodes"
+                           % (nbytes / 1e6, total / 1e6, nodes))
+
+    def on_failed(self, message):
+        if self.sender() is not self.loader:
+            return
+        self.label.setText("%s failed: %s" % (self.action, message))
+
+    def on_done(self, completed):
+        if self.sender() is not self.loader:
+            return
+        self.loader = None
+        if completed:
+            self.hide()
+        else:
+            self.cancel_button.setEnabled(False)
+            self.progress_bar.setRange(0, 1000)
+            if self.label.text().startswith("%s failed" % self.action):
+                return
+            if self.action == "Load":
+                self.label.setText("Load cancelled, showing partial data")
+            else:
+                self.label.setText("%s cancelled" % self.action)
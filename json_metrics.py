@@ -0,0 +1,175 @@
+import atexit
+import collections
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+
+class _Timer(object):
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+# Returned by Metrics.timer while disabled
+_NULL_TIMER = contextlib.nullcontext()
+
+
+class Metrics(object):
+    """Phase timers and call counters, off unless enabled
+
+    Phases are timed with `timer` around coarse steps such as parsing
+    or saving a document, which costs nothing measurable while disabled.
+    Hot methods of models are never touched while disabled: classes
+    registered with `instrument` only get their methods wrapped with
+    counters once `enable` is called, and are restored by `disable`.
+
+    Timers may run in worker threads.
+
+    """
+
+    def __init__(self):
+        self.enabled = False
+        # name -> [calls, total seconds, longest call]
+        self.timers = collections.OrderedDict()
+        self.counters = collections.OrderedDict()
+        self._spans = {}
+        self._lock = threading.Lock()
+        # (class, method names, counter prefix)
+        self._instrumented = []
+        self._originals = []
+
+    def enable(self, enabled=True):
+        if not enabled:
+            self.disable()
+            return
+        if self.enabled:
+            return
+        self.enabled = True
+        for cls, names, prefix in self._instrumented:
+            self._wrap(cls, names, prefix)
+
+    def disable(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        for cls, name, method in self._originals:
+            setattr(cls, name, method)
+        self._originals = []
+
+    def reset(self):
+        # Cleared in place, wrappers keep a reference to the counters
+        with self._lock:
+            self.timers.clear()
+            self.counters.clear()
+            self._spans.clear()
+
+    def instrument(self, cls, names, prefix=None):
+        """Count calls of the methods `names` of `cls` while enabled"""
+        prefix = prefix or cls.__name__
+        self._instrumented.append((cls, names, prefix))
+        if self.enabled:
+            self._wrap(cls, names, prefix)
+
+    def _wrap(self, cls, names, prefix):
+        counters = self.counters
+        for name in names:
+            method = cls.__dict__[name]
+            counter = "%s.%s" % (prefix, name)
+
+            def counted(*args, _method=method, _counter=counter, **kwargs):
+                counters[_counter] = counters.get(_counter, 0) + 1
+                return _method(*args, **kwargs)
+
+            functools.update_wrapper(counted, method)
+            self._originals.append((cls, name, method))
+            setattr(cls, name, counted)
+
+    def timer(self, name):
+        """Context manager adding the time spent in it to `name`"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def start(self, name):
+        """Begin a phase ended by `stop`, e.g. from another callback"""
+        if self.enabled:
+            self._spans[name] = time.perf_counter()
+
+    def stop(self, name):
+        started = self._spans.pop(name, None)
+        if started is not None:
+            self.add_time(name, time.perf_counter() - started)
+
+    def running(self, name):
+        return name in self._spans
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                timer[2] = max(timer[2], seconds)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def stats(self):
+        """Timers and counters as plain data"""
+        with self._lock:
+            return {
+                "timers": {name: {"calls": calls, "total": total,
+                                  "max": longest}
+                           for name, (calls, total, longest)
+                           in self.timers.items()},
+                "counters": dict(self.counters),
+            }
+
+    def report(self):
+        """Timers and counters as lines of text"""
+        stats = self.stats()
+        lines = []
+        for name, timer in stats["timers"].items():
+            lines.append("%-24s %9.3f s  %6d calls  max %.3f s"
+                         % (name, timer["total"], timer["calls"],
+                            timer["max"]))
+        for name, count in stats["counters"].items():
+            lines.append("%-24s %9d" % (name, count))
+        return "\n".join(lines)
+
+    def dump(self, fpath):
+        with open(fpath, "w") as out:
+            json.dump(self.stats(), out, indent=2)
+
+
+metrics = Metrics()
+
+
+def enable_from_env(var="JSON_VIEWER_METRICS"):
+    """Enable metrics when `var` is set, dumping them to the file it
+    names when the process exits"""
+    fpath = os.environ.get(var)
+    if fpath:
+        metrics.enable()
+        atexit.register(metrics.dump, fpath)
+
+
+enable_from_env()
@@ -0,0 +1,341 @@
+import copy
+import json
+
+from json_query import QueryError, keys_to_pointer, pointer_to_keys
+from json_writer import JsonWriter
+
+
+OPERATIONS = ("add", "remove", "replace", "move", "copy", "test")
+# Members every operation needs besides "op" and "path"
+REQUIRED = {
+    "add": ("value",),
+    "remove": (),
+    "replace": ("value",),
+    "move": ("from",),
+    "copy": ("from",),
+    "test": ("value",),
+}
+
+
+class PatchError(ValueError):
+    pass
+
+
+def snapshot(value):
+    """Copy of `value` that later edits of the document cannot reach"""
+    if isinstance(value, (dict, list)):
+        return copy.deepcopy(value)
+    return value
+
+
+class Journal(object):
+    """Edits of a document recorded as RFC 6902 JSON Patch operations
+
+    Values are copied when recorded so that the journal replays to the
+    state of the document at the time of the edit. A value changed
+    several times in a row keeps only its last replace operation.
+
+    An added value can instead be held by reference and built when the
+    operations are read, see add and freeze.
+
+    """
+
+    def __init__(self):
+        self._ops = []
+        # Node held by reference -> [function building its value,
+        # operations waiting for it]
+        self._live = {}
+
+    def __len__(self):
+        return len(self._ops)
+
+    @property
+    def ops(self):
+        self.freeze()
+        return self._ops
+
+    def clear(self):
+        self._ops = []
+        self._live = {}
+
+    def add(self, path, value, build=None):
+        """Record an add operation
+
+        Arguments:
+            build (callable, optional): Builds the JSON value of `value`
+                when the operations are read. `value` is held by
+                reference until then, freeze must be called with it
+                before it changes
+
+        """
+
+        if build is None:
+            self._ops.append({"op": "add", "path": path,
+                              "value": snapshot(value)})
+            return
+        op = {"op": "add", "path": path, "value": None}
+        self._live.setdefault(value, [build, []])[1].append(op)
+        self._ops.append(op)
+
+    def freeze(self, node=None):
+        """Build the values held by reference to `node`, all of them by
+        default"""
+        if not self._live:
+            return
+        if node is None:
+            nodes = list(self._live)
+        elif node in self._live:
+            nodes = [node]
+        else:
+            return
+        for node in nodes:
+            build, ops = self._live.pop(node)
+            value = build(node)
+            for op in ops:
+                op["value"] = value
+
+    def remove(self, path):
+        self._ops.append({"op": "remove", "path": path})
+
+    def replace(self, path, value):
+        value = snapshot(value)
+        if self._ops:
+            last = self._ops[-1]
+            # An add held by reference would overwrite the value when built
+            if (last["op"] in ("add", "replace") and last["path"] == path
+                    and last["value"] is not None):
+                last["value"] = value
+                return
+        self._ops.append({"op": "replace", "path": path, "value": value})
+
+    def move(self, from_path, path):
+        self._ops.append({"op": "move", "from": from_path, "path": path})
+
+    def extend(self, patch):
+        """Record operations that were applied from a patch"""
+        self._ops.extend(snapshot(op) for op in patch)
+
+    def save(self, fpath):
+        JsonWriter(indent=2).save(self.ops, fpath)
+
+
+def load_patch(fpath):
+    """Read and check a JSON Patch file"""
+    with open(fpath, encoding="utf-8") as pfile:
+        try:
+            patch = json.load(pfile)
+        except ValueError as e:
+            raise PatchError("Invalid JSON Patch file: %s" % e)
+    return check_patch(patch)
+
+
+def check_patch(patch):
+    """Validate the shape of every operation before any is applied
+
+    Returns:
+        the operations as a list
+
+    """
+
+    if not isinstance(patch, list):
+        raise PatchError("A JSON Patch must be an array of operations")
+
+    for n, op in enumerate(patch):
+        if not isinstance(op, dict):
+            raise PatchError("Operation %d is not an object" % n)
+        name = op.get("op")
+        if name not in OPERATIONS:
+            raise PatchError("Operation %d: unknown op %r" % (n, name))
+        if not isinstance(op.get("path"), str):
+            raise PatchError("Operation %d: missing 'path'" % n)
+        for member in REQUIRED[name]:
+            if member not in op:
+                raise PatchError("Operation %d: %s needs %r"
+                                 % (n, name, member))
+        if "from" in REQUIRED[name] and not isinstance(op["from"], str):
+            raise PatchError("Operation %d: 'from' must be a string" % n)
+    return patch
+
+
+def split_pointer(pointer):
+    try:
+        return pointer_to_keys(pointer)
+    except QueryError as e:
+        raise PatchError(str(e))
+
+
+def list_index(token, size, allow_end=False):
+    """Index of a list element from a pointer token
+
+    Arguments:
+        token (str): Reference token, "-" is the end of the list
+        size (int): Length of the list
+        allow_end (bool, optional): Accept `size` itself, when adding
+
+    """
+
+    if token == "-" and allow_end:
+        return size
+    if (not (token.isascii() and token.isdigit())
+            or (token[0] == "0" and token != "0")):
+        raise PatchError("Invalid array index %r" % token)
+    index = int(token)
+    if index > size or (index == size and not allow_end):
+        raise PatchError("Array index %d out of range" % index)
+    return index
+
+
+def _resolve(document, keys):
+    node = document
+    for key in keys:
+        if isinstance(node, dict):
+            if key not in node:
+                raise PatchError("No member %r" % key)
+            node = node[key]
+        elif isinstance(node, list):
+            node = node[list_index(key, len(node))]
+        else:
+            raise PatchError("Cannot descend into a %s with %r"
+                             % (type(node).__name__, key))
+    return node
+
+
+def _add(document, keys, value, inverse):
+    if not keys:
+        inverse.append({"op": "replace", "path": "", "value": document})
+        return value
+    parent = _resolve(document, keys[:-1])
+    key = keys[-1]
+    if isinstance(parent, dict):
+        if key in parent:
+            inverse.append({"op": "replace", "path": keys_to_pointer(keys),
+                            "value": parent[key]})
+        else:
+            inverse.append({"op": "remove", "path": keys_to_pointer(keys)})
+        parent[key] = value
+    elif isinstance(parent, list):
+        index = list_index(key, len(parent), True)
+        parent.insert(index, value)
+        inverse.append({"op": "remove",
+                        "path": keys_to_pointer(keys[:-1] + [index])})
+    else:
+        raise PatchError("Cannot add %r to a %s" % (key, type(parent).__name__))
+    return document
+
+
+def _remove(document, keys, inverse):
+    if not keys:
+        raise PatchError("Cannot remove the document root")
+    parent = _resolve(document, keys[:-1])
+    key = keys[-1]
+    if isinstance(parent, dict):
+        if key not in parent:
+            raise PatchError("No member %r" % key)
+        value = parent.pop(key)
+    elif isinstance(parent, list):
+        value = parent.pop(list_index(key, len(parent)))
+    else:
+        raise PatchError("Cannot remove %r from a %s"
+                         % (key, type(parent).__name__))
+    inverse.append({"op": "add", "path": keys_to_pointer(keys),
+                    "value": value})
+    return value
+
+
+def _apply(document, op, undo, copy_values=True):
+    """Apply one operation
+
+    Operations undoing each change are appended to `undo` as the changes
+    are made, they have to be applied in reverse order.
+
+    """
+
+    name = op["op"]
+    keys = split_pointer(op["path"])
+    value = op.get("value")
+    if copy_values:
+        value = snapshot(value)
+
+    if name == "add":
+        document = _add(document, keys, value, undo)
+
+    elif name == "remove":
+        _remove(document, keys, undo)
+
+    elif name == "replace":
+        if keys:
+            parent = _resolve(document, keys[:-1])
+            key = keys[-1]
+            if isinstance(parent, list):
+                key = list_index(key, len(parent))
+            elif not isinstance(parent, dict) or key not in parent:
+                raise PatchError("No member %r" % key)
+            undo.append({"op": "replace", "path": op["path"],
+                         "value": parent[key]})
+            parent[key] = value
+        else:
+            undo.append({"op": "replace", "path": "", "value": document})
+            document = value
+
+    elif name == "test":
+        if _resolve(document, keys) != op["value"]:
+            raise PatchError("Test failed at %r" % op["path"])
+
+    else:
+        from_keys = split_pointer(op["from"])
+        if name == "move":
+            if from_keys != keys:
+                if keys[:len(from_keys)] == from_keys:
+                    raise PatchError("Cannot move %r into itself"
+                                     % op["from"])
+                moved = _remove(document, from_keys, undo)
+                document = _add(document, keys, moved, undo)
+        else:
+            value = copy.deepcopy(_resolve(document, from_keys))
+            document = _add(document, keys, value, undo)
+
+    return document
+
+
+def apply_patch(document, patch, journal=None, inverse=None,
+                copy_values=True):
+    """Apply JSON Patch operations to a plain document in place
+
+    The patch applies entirely or not at all, when an operation fails
+    the ones before it are undone before PatchError is raised.
+
+    Arguments:
+        document (dict or list): Document to patch
+        patch (list): RFC 6902 operations
+        journal (Journal, optional): Records the operations once the
+            whole patch is applied
+        inverse (list, optional): Receives the patch undoing this one.
+            Its values are the removed or replaced parts of the document
+            themselves, not copies
+        copy_values (bool, optional): Copy the values of the patch into
+            the document, pass False if the patch is not used afterwards
+
+    Returns:
+        the patched document, a different object only if the root was
+        replaced
+
+    """
+
+    undo = []
+    for n, op in enumerate(check_patch(patch)):
+        try:
+            document = _apply(document, op, undo, copy_values)
+        except PatchError as e:
+            # Inverse operations cannot fail on the state they undo
+            undo.reverse()
+            for inverse_op in undo:
+                document = _apply(document, inverse_op, [], False)
+            raise PatchError("Operation %d (%s %s): %s"
+                             % (n, op["op"], op["path"], e))
+
+    if journal is not None:
+        journal.extend(patch)
+    if inverse is not None:
+        undo.reverse()
+        inverse.extend(undo)
+    return document
@@ -0,0 +1,83 @@
+import concurrent.futures
+import multiprocessing
+import os
+
+from PyQt5 import QtCore
+
+from json_index import JsonIndex
+
+
+def scan_file(fpath):
+    """Build the JsonIndex of a file, runs in a worker process
+
+    Returns:
+        (file size, JsonIndex.arrays) of the file, flat arrays that go
+        back to the GUI process as a few byte buffers instead of a
+        pickled tree of dicts and lists
+
+    """
+
+    index = JsonIndex(fpath)
+    try:
+        index.scan()
+        return len(index.buf), index.arrays()
+    finally:
+        index.close()
+
+
+class JsonPoolLoader(QtCore.QObject):
+    """Index several JSON files in parallel worker processes
+
+    Every file is scanned in its own process and mapped again in the GUI
+    process with the arrays built there, so the GUI thread never parses
+    a document. Values are decoded on demand by a QJsonIndexModel.
+
+    """
+
+    # path, JsonIndex
+    loaded = QtCore.pyqtSignal(str, object)
+    # path, error
+    failed = QtCore.pyqtSignal(str, str)
+    # All submitted files are loaded or failed
+    done = QtCore.pyqtSignal()
+
+    _finished = QtCore.pyqtSignal(str, object)
+
+    def __init__(self, parent=None, workers=None):
+        super(JsonPoolLoader, self).__init__(parent)
+        # Workers are spawned rather than forked from a process running
+        # Qt threads
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            workers or os.cpu_count(),
+            mp_context=multiprocessing.get_context("spawn"))
+        self.pending = 0
+        # Futures finish in a thread of the executor, the signal brings
+        # them to the GUI thread
+        self._finished.connect(self._deliver)
+
+    def load(self, fpaths):
+        for fpath in fpaths:
+            self.pending += 1
+            future = self.executor.submit(scan_file, fpath)
+            future.add_done_callback(
+                lambda future, fpath=fpath: self._finished.emit(fpath, future))
+
+    def _deliver(self, fpath, future):
+        self.pending -= 1
+        try:
+            size, arrays = future.result()
+            if os.path.getsize(fpath) != size:
+                raise ValueError("File changed while it was loaded")
+            self.loaded.emit(fpath, JsonIndex.from_arrays(fpath, arrays))
+        except concurrent.futures.CancelledError:
+            pass
+        except (OSError, ValueError) as e:
+            self.failed.emit(fpath, str(e))
+        except concurrent.futures.process.BrokenProcessPool as e:
+            self.failed.emit(fpath, "Worker process died: %s" % e)
+
+        if self.pending == 0:
+            self.done.emit()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
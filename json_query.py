@@ -0,0 +1,345 @@
+import collections
+import functools
+import re
+
+
+QueryMatch = collections.namedtuple("QueryMatch", ["path", "node"])
+
+
+class QueryError(ValueError):
+    pass
+
+
+class ValueAdapter(object):
+    """Walks plain dict/list documents for a Query
+
+    Other trees are queried through a subclass overriding these methods,
+    nodes only have to be hashable by identity.
+
+    """
+
+    def is_dict(self, node):
+        return isinstance(node, dict)
+
+    def is_list(self, node):
+        return isinstance(node, list)
+
+    def is_container(self, node):
+        return self.is_dict(node) or self.is_list(node)
+
+    def count(self, node):
+        return len(node)
+
+    def children(self, node):
+        """Yield (key, child) pairs, list keys are ints"""
+        if isinstance(node, dict):
+            return iter(node.items())
+        return enumerate(node)
+
+    def child(self, node, key):
+        """Child under a dict key or list index, None when missing"""
+        try:
+            return True, node[key]
+        except (KeyError, IndexError, TypeError):
+            return False, None
+
+    def value(self, node):
+        """Python value of a scalar node"""
+        return node
+
+
+# Selectors: each one maps a node to some of its children
+
+
+class NameSelector(object):
+    def __init__(self, names):
+        self.names = names
+
+    def select(self, adapter, node, path):
+        if not adapter.is_dict(node):
+            return
+        for name in self.names:
+            found, child = adapter.child(node, name)
+            if found:
+                yield child, path + (name,)
+
+    def __repr__(self):
+        return "Name%r" % (self.names,)
+
+
+class IndexSelector(object):
+    def __init__(self, indices):
+        self.indices = indices
+
+    def select(self, adapter, node, path):
+        if not adapter.is_list(node):
+            return
+        count = adapter.count(node)
+        for index in self.indices:
+            if index < 0:
+                index += count
+            if 0 <= index < count:
+                found, child = adapter.child(node, index)
+                if found:
+                    yield child, path + (index,)
+
+    def __repr__(self):
+        return "Index%r" % (self.indices,)
+
+
+class SliceSelector(object):
+    def __init__(self, start, stop, step):
+        self.slice = slice(start, stop, step)
+
+    def select(self, adapter, node, path):
+        if not adapter.is_list(node):
+            return
+        for index in range(*self.slice.indices(adapter.count(node))):
+            found, child = adapter.child(node, index)
+            if found:
+                yield child, path + (index,)
+
+    def __repr__(self):
+        return "Slice(%r)" % (self.slice,)
+
+
+class WildcardSelector(object):
+    def select(self, adapter, node, path):
+        if not adapter.is_container(node):
+            return
+        for key, child in adapter.children(node):
+            yield child, path + (key,)
+
+    def __repr__(self):
+        return "Wildcard"
+
+
+class Step(object):
+    """One path segment: a selector applied to the node, or to the node
+    and all of its descendants for `..`"""
+
+    def __init__(self, selector, descendants=False):
+        self.selector = selector
+        self.descendants = descendants
+
+    def apply(self, adapter, node, path):
+        if not self.descendants:
+            yield from self.selector.select(adapter, node, path)
+            return
+
+        # Scalars have no descendants, only containers are walked
+        stack = [(node, path)]
+        while stack:
+            node, path = stack.pop()
+            yield from self.selector.select(adapter, node, path)
+            containers = [(child, path + (key,))
+                          for key, child in adapter.children(node)
+                          if adapter.is_container(child)]
+            containers.reverse()
+            stack.extend(containers)
+
+    def __repr__(self):
+        return "%s%r" % (".." if self.descendants else ".", self.selector)
+
+
+class Query(object):
+    """A compiled JSONPath or JSON Pointer expression
+
+    Compile once with compile_query and run against any number of
+    documents. Matches carry the path of keys from the document root, so
+    they can be fed back as the starting nodes of another query.
+
+    """
+
+    def __init__(self, expression, steps):
+        self.expression = expression
+        self.steps = steps
+
+    def __repr__(self):
+        return "Query(%r, %r)" % (self.expression, self.steps)
+
+    def run(self, root, adapter=None, start=None):
+        """Return the list of QueryMatch for this query
+
+        Arguments:
+            root: Document root node
+            adapter (ValueAdapter, optional): How to walk the nodes,
+                defaults to plain dict/list documents
+            start (list of QueryMatch, optional): Run from these nodes
+                instead of the root, e.g. the result of another query
+
+        """
+
+        return list(self.iter_run(root, adapter, start))
+
+    def iter_run(self, root, adapter=None, start=None):
+        adapter = adapter or ValueAdapter()
+        if start is None:
+            frontier = [(root, ())]
+        else:
+            frontier = [(match.node, tuple(match.path)) for match in start]
+
+        # Depth first over the steps so matches come out in document
+        # order without holding every intermediate node at once
+        def walk(depth, node, path):
+            if depth == len(self.steps):
+                yield QueryMatch(path, node)
+                return
+            for child, child_path in self.steps[depth].apply(adapter, node,
+                                                             path):
+                yield from walk(depth + 1, child, child_path)
+
+        for node, path in frontier:
+            yield from walk(0, node, path)
+
+
+_TOKEN_RE = re.compile(r"""
+    (?P<descendant>\.\.)
+  | (?P<dot>\.)
+  | (?P<star>\*)
+  | (?P<bracket>\[(?P<inner>(?:'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|[^\]'"])*)\])
+  | (?P<name>[^.\[\]*\s'"]+)
+""", re.VERBOSE)
+
+_SLICE_RE = re.compile(
+    r"^\s*(-?[0-9]*)\s*:\s*(-?[0-9]*)\s*(?::\s*(-?[0-9]*)\s*)?$")
+_QUOTED_RE = re.compile(r"""\s*('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")\s*""")
+
+
+def _unquote(text):
+    quote = text[0]
+    body = text[1:-1]
+    return re.sub(r"\\(.)",
+                  lambda m: m.group(1) if m.group(1) in (quote, "\\")
+                  else "\\" + m.group(1),
+                  body)
+
+
+def _parse_bracket(inner, expression):
+    inner = inner.strip()
+    if inner == "*":
+        return WildcardSelector()
+
+    match = _SLICE_RE.match(inner)
+    if match:
+        start, stop, step = (int(g) if g else None for g in match.groups())
+        if step == 0:
+            raise QueryError("Slice step cannot be zero in %r" % expression)
+        return SliceSelector(start, stop, step)
+
+    parts = inner.split(",") if inner[:1] not in "'\"" else None
+    if parts is not None:
+        try:
+            return IndexSelector([int(part) for part in parts])
+        except ValueError:
+            raise QueryError("Invalid index %r in %r" % (inner, expression))
+
+    names = []
+    pos = 0
+    while pos < len(inner):
+        match = _QUOTED_RE.match(inner, pos)
+        if not match:
+            raise QueryError("Invalid member %r in %r" % (inner, expression))
+        names.append(_unquote(match.group(1)))
+        pos = match.end()
+        if pos < len(inner):
+            if inner[pos] != ",":
+                raise QueryError("Expecting ',' in %r" % expression)
+            pos += 1
+    return NameSelector(names)
+
+
+def _compile_path(expression):
+    text = expression.strip()
+    if not text.startswith("$"):
+        raise QueryError("JSONPath must start with '$': %r" % expression)
+
+    steps = []
+    pos = 1
+    descendants = False
+    after_dot = False
+    while pos < len(text):
+        match = _TOKEN_RE.match(text, pos)
+        if not match:
+            raise QueryError("Unexpected %r at %d in %r"
+                             % (text[pos], pos, expression))
+        pos = match.end()
+        kind = match.lastgroup
+        if kind == "inner":
+            kind = "bracket"
+
+        if kind in ("descendant", "dot"):
+            if after_dot:
+                raise QueryError("Missing member name in %r" % expression)
+            descendants = kind == "descendant"
+            after_dot = True
+            continue
+
+        if kind == "star":
+            selector = WildcardSelector()
+        elif kind == "bracket":
+            selector = _parse_bracket(match.group("inner"), expression)
+        else:
+            if not after_dot:
+                raise QueryError("Expecting '.' before %r in %r"
+                                 % (match.group(), expression))
+            selector = NameSelector([match.group()])
+
+        steps.append(Step(selector, descendants))
+        descendants = False
+        after_dot = False
+
+    if after_dot:
+        raise QueryError("Trailing '.' in %r" % expression)
+    return steps
+
+
+def pointer_to_keys(pointer):
+    """Split a JSON Pointer into unescaped reference tokens"""
+    if pointer == "":
+        return []
+    if not pointer.startswith("/"):
+        raise QueryError("JSON Pointer must start with '/': %r" % pointer)
+    return [token.replace("~1", "/").replace("~0", "~")
+            for token in pointer[1:].split("/")]
+
+
+def keys_to_pointer(keys):
+    """Build a JSON Pointer from dict keys and list indices"""
+    return "".join("/" + str(key).replace("~", "~0").replace("/", "~1")
+                   for key in keys)
+
+
+class PointerSelector(object):
+    """A JSON Pointer token, a key for dicts or an index for lists"""
+
+    def __init__(self, token):
+        self.token = token
+        self.index = (int(token)
+                      if token.isascii() and token.isdigit()
+                      and (token == "0" or token[0] != "0")
+                      else None)
+
+    def select(self, adapter, node, path):
+        if adapter.is_dict(node):
+            found, child = adapter.child(node, self.token)
+            if found:
+                yield child, path + (self.token,)
+        elif adapter.is_list(node) and self.index is not None:
+            if self.index < adapter.count(node):
+                found, child = adapter.child(node, self.index)
+                if found:
+                    yield child, path + (self.index,)
+
+    def __repr__(self):
+        return "Pointer(%r)" % self.token
+
+
+@functools.lru_cache(maxsize=128)
+def compile_query(expression):
+    """Compile a JSONPath (`$...`) or JSON Pointer (`/...`) expression"""
+    if expression.startswith("$"):
+        return Query(expression, _compile_path(expression))
+    steps = [Step(PointerSelector(token))
+             for token in pointer_to_keys(expression)]
+    return Query(expression, steps)
@@ -0,0 +1,129 @@
+from json_query import keys_to_pointer
+
+
+NoneType = type(None)
+
+# JSON names of the types a scheme can ask for
+TYPE_NAMES = {
+    dict: "object",
+    list: "array",
+    str: "string",
+    int: "integer",
+    float: "number",
+    bool: "boolean",
+    NoneType: "null",
+}
+
+
+def type_name(value):
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, dict):
+        return "object"
+    if isinstance(value, list):
+        return "array"
+    return TYPE_NAMES.get(type(value), type(value).__name__)
+
+
+class SchemeNode(object):
+    """Compiled template of one position in a document
+
+    A scheme is an example document: containers list the children new
+    entries are built from, scalars give the type and default value of
+    a field, and null leaves the type open. Nodes are shared by every
+    item at the same position in the document.
+
+    """
+
+    __slots__ = ("type", "default", "fields", "item")
+
+    def __init__(self, typ, default=None, fields=None, item=None):
+        self.type = typ
+        self.default = default
+        # Scheme of each known member of an object
+        self.fields = fields
+        # Template of new entries: the array element, or the first
+        # member of an object used as a map
+        self.item = item
+
+    def child(self, key):
+        """Scheme of the child under `key`, None when unknown"""
+        if self.fields is not None:
+            node = self.fields.get(key)
+            if node is not None:
+                return node
+        return self.item
+
+    def new(self):
+        """Build a fresh value from the template"""
+        if self.type is dict:
+            return {key: field.new() for key, field in self.fields.items()}
+        if self.type is list:
+            return [self.item.new()] if self.item is not None else []
+        return self.default
+
+    def check(self, value):
+        """Error message when `value` does not fit this node, else None
+
+        Only the value itself is checked, not its children.
+        """
+        if self.type is NoneType:
+            return None
+        if self.type is float:
+            ok = isinstance(value, (int, float)) and not isinstance(value, bool)
+        elif self.type is int:
+            ok = isinstance(value, int) and not isinstance(value, bool)
+        else:
+            ok = isinstance(value, self.type)
+        if ok:
+            return None
+        return "Expected %s, got %s" % (TYPE_NAMES[self.type],
+                                        type_name(value))
+
+    def __repr__(self):
+        return "SchemeNode(%s)" % TYPE_NAMES[self.type]
+
+
+def compile_scheme(scheme):
+    """Compile an example document into shared SchemeNode templates"""
+    if isinstance(scheme, dict):
+        fields = {key: compile_scheme(value) for key, value in scheme.items()}
+        return SchemeNode(dict, fields=fields,
+                          item=next(iter(fields.values()), None))
+    if isinstance(scheme, list):
+        return SchemeNode(list,
+                          item=compile_scheme(scheme[0]) if scheme else None)
+    if isinstance(scheme, bool):
+        return SchemeNode(bool, scheme)
+    if type(scheme) not in TYPE_NAMES:
+        raise TypeError("Unsupported scheme value %r" % (scheme,))
+    return SchemeNode(type(scheme), scheme)
+
+
+def validate(scheme, document):
+    """Check a whole plain document against a compiled scheme
+
+    Returns:
+        list of (JSON Pointer, message) pairs, in document order
+
+    """
+
+    errors = []
+    stack = [(scheme, document, [])]
+    while stack:
+        node, value, keys = stack.pop()
+        error = node.check(value)
+        if error is not None:
+            errors.append((keys_to_pointer(keys), error))
+            continue
+        if isinstance(value, dict):
+            children = list(value.items())
+        elif isinstance(value, list):
+            children = list(enumerate(value))
+        else:
+            continue
+        for key, child in reversed(children):
+            child_node = node.child(key)
+            if child_node is not None:
+                stack.append((child_node, child, keys + [key]))
+    return errors
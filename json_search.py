@@ -0,0 +1,345 @@
+import heapq
+import sys
+import time
+from array import array
+
+from json_text import display_text
+
+
+class SearchIndex(object):
+    """Trigram index over the keys and values of a JSON document
+
+    Every node gets an integer id in the order it is added, with its
+    parent id and the ids of its key and value text in a table of unique
+    strings. Posting lists map each lowercased trigram to the ids of the
+    nodes containing it, so a substring query only verifies the nodes of
+    its rarest trigram instead of every string in the document.
+
+    Node 0 is the document root, it has neither key nor value.
+
+    """
+
+    # Longer texts are not broken into trigrams, they are always checked
+    MAX_INDEXED_CHARS = 1024
+    # Candidates verified between two calls of iter_find's `stop`
+    STOP_CHECK_INTERVAL = 4096
+    ROOT = 0
+
+    def __init__(self):
+        self.parents = array("q", [-1])
+        self.keys = array("q", [-1])
+        self.values = array("q", [-1])
+        self.strings = []
+        self._string_ids = {}
+
+        self._key_grams = {}
+        self._value_grams = {}
+        self._long_keys = array("q")
+        self._long_values = array("q")
+        # Recently seen text -> (string id, posting lists), keys and
+        # short values repeat a lot
+        self._key_cache = {}
+        self._value_cache = {}
+
+        self.build_time = 0.0
+
+    # Cached texts per field before the cache is dropped
+    CACHE_SIZE = 65536
+
+    def __len__(self):
+        return len(self.parents)
+
+    def _string_id(self, text):
+        sid = self._string_ids.get(text)
+        if sid is None:
+            sid = self._string_ids[text] = len(self.strings)
+            self.strings.append(text)
+        return sid
+
+    def _prepare(self, text, postings, cache):
+        sid = self._string_id(text)
+        if len(text) > self.MAX_INDEXED_CHARS:
+            entry = sid, None
+        else:
+            lower = text.lower()
+            lists = []
+            for gram in {lower[i:i + 3] for i in range(len(lower) - 2)}:
+                posting = postings.get(gram)
+                if posting is None:
+                    posting = postings[gram] = array("q")
+                lists.append(posting)
+            entry = sid, lists
+
+        if len(cache) > self.CACHE_SIZE:
+            cache.clear()
+        cache[text] = entry
+        return entry
+
+    def _add(self, parent, key, value):
+        node = len(self.parents)
+        self.parents.append(parent)
+
+        sid, lists = (self._key_cache.get(key)
+                      or self._prepare(key, self._key_grams, self._key_cache))
+        self.keys.append(sid)
+        if lists is None:
+            self._long_keys.append(node)
+        else:
+            for posting in lists:
+                posting.append(node)
+
+        if value is None:
+            self.values.append(-1)
+            return node
+
+        sid, lists = (self._value_cache.get(value)
+                      or self._prepare(value, self._value_grams,
+                                       self._value_cache))
+        self.values.append(sid)
+        if lists is None:
+            self._long_values.append(node)
+        else:
+            for posting in lists:
+                posting.append(node)
+        return node
+
+    def add(self, parent, key, value=None):
+        """Add a node and return its id
+
+        Arguments:
+            parent (int): Id of the parent node
+            key (str): Dict key or list index as text
+            value (str, optional): Display text of a scalar value, None
+                for dicts and lists
+
+        """
+
+        start = time.perf_counter()
+        node = self._add(parent, key, value)
+        self.build_time += time.perf_counter() - start
+        return node
+
+    def add_value(self, parent, key, value):
+        """Add a raw value and all of its descendants, in document order
+
+        Returns:
+            id of the node created for `value`
+
+        """
+
+        start = time.perf_counter()
+        add = self._add
+        first = None
+        stack = [(parent, key, value)]
+        while stack:
+            parent, key, value = stack.pop()
+            if isinstance(value, dict):
+                node = add(parent, key, None)
+                stack.extend(reversed([(node, k, v)
+                                       for k, v in value.items()]))
+            elif isinstance(value, list):
+                node = add(parent, key, None)
+                stack.extend(reversed([(node, str(i), v)
+                                       for i, v in enumerate(value)]))
+            else:
+                # The text the tree shows, null rather than None
+                node = add(parent, key, display_text(value, None))
+            if first is None:
+                first = node
+
+        self.build_time += time.perf_counter() - start
+        return first
+
+    def add_document(self, document):
+        """Index the children of a top-level dict or list"""
+        if isinstance(document, dict):
+            items = document.items()
+        else:
+            items = ((str(i), v) for i, v in enumerate(document))
+        for key, value in items:
+            self.add_value(self.ROOT, key, value)
+
+    def key(self, node):
+        sid = self.keys[node]
+        return self.strings[sid] if sid >= 0 else None
+
+    def value(self, node):
+        sid = self.values[node]
+        return self.strings[sid] if sid >= 0 else None
+
+    def path(self, node):
+        """Keys leading from the root to `node`"""
+        keys = []
+        while node > self.ROOT:
+            keys.append(self.strings[self.keys[node]])
+            node = self.parents[node]
+        keys.reverse()
+        return keys
+
+    def _candidates(self, query, postings, long_nodes, fields):
+        if len(query) < 3:
+            # Too short for trigrams, scan the unique strings once and
+            # then the nodes by string id
+            lower = query.lower()
+            sids = {sid for sid, text in enumerate(self.strings)
+                    if lower in text.lower()}
+            return (node for node, sid in enumerate(fields) if sid in sids)
+
+        lower = query.lower()
+        grams = {lower[i:i + 3] for i in range(len(lower) - 2)}
+        posting = min((postings.get(gram, ()) for gram in grams), key=len)
+        return heapq.merge(posting, long_nodes)
+
+    def _posting_size(self, query, postings, long_nodes):
+        # Candidates _candidates would verify, None if not known upfront
+        if len(query) < 3:
+            return None
+        lower = query.lower()
+        grams = {lower[i:i + 3] for i in range(len(lower) - 2)}
+        return (min(len(postings.get(gram, ())) for gram in grams)
+                + len(long_nodes))
+
+    @staticmethod
+    def narrows(query, previous, case_sensitive=True):
+        """Whether every match of `query` is also a match of `previous`,
+        with the same options, so that it can be searched within them"""
+        if not previous:
+            return False
+        if case_sensitive:
+            return previous in query
+        return previous.lower() in query.lower()
+
+    def iter_find(self, query, keys=True, values=True, case_sensitive=True,
+                  stop=None, within=None):
+        """Yield ids of the nodes whose key or value contains `query`
+
+        Nodes are yielded in the order they were added.
+
+        Arguments:
+            stop (callable, optional): Polled while verifying candidates,
+                the search ends once it returns True
+            within (list, optional): Ids of the only nodes that can
+                match, in document order, e.g. the matches of a query
+                that `query` narrows. The trigram candidates are
+                verified instead when there are fewer of them
+
+        """
+
+        if not query:
+            return
+
+        if case_sensitive:
+            def contains(text):
+                return query in text
+        else:
+            lower = query.lower()
+
+            def contains(text):
+                return lower in text.lower()
+
+        sources = None
+        if within is not None:
+            sizes = []
+            if keys:
+                sizes.append(self._posting_size(
+                    query, self._key_grams, self._long_keys))
+            if values:
+                sizes.append(self._posting_size(
+                    query, self._value_grams, self._long_values))
+            if None in sizes or sum(sizes) >= len(within):
+                sources = [within]
+
+        if sources is None:
+            sources = []
+            if keys:
+                sources.append(self._candidates(
+                    query, self._key_grams, self._long_keys, self.keys))
+            if values:
+                sources.append(self._candidates(
+                    query, self._value_grams, self._long_values,
+                    self.values))
+
+        strings = self.strings
+        last = -1
+        checked = 0
+        for node in heapq.merge(*sources):
+            if stop is not None:
+                checked += 1
+                if checked % self.STOP_CHECK_INTERVAL == 0 and stop():
+                    return
+            if node == last:
+                continue
+            if keys and contains(strings[self.keys[node]]):
+                last = node
+                yield node
+            elif values:
+                sid = self.values[node]
+                if sid >= 0 and contains(strings[sid]):
+                    last = node
+                    yield node
+
+    def find(self, query, keys=True, values=True, case_sensitive=True):
+        return list(self.iter_find(query, keys, values, case_sensitive))
+
+    def key_tree(self, nodes):
+        """Keys leading from the root to `nodes`, as nested dicts
+
+        Each key maps to the dict of the keys below it that lead on to
+        one of `nodes`, and to None for `nodes` themselves, everything
+        under them is kept. Paths shared by several nodes are only
+        walked once.
+
+        Arguments:
+            nodes (list): Node ids in document order
+
+        """
+
+        parents = self.parents
+        keys = self.keys
+        strings = self.strings
+        # Node -> its dict in the tree, None once kept whole
+        trees = {self.ROOT: {}}
+        get = trees.get
+        for node in nodes:
+            parent = parents[node]
+            tree = get(parent, False)
+            if tree is False:
+                # First match below `parent`, the dicts on the way
+                # to it are made once
+                chain = []
+                while parent not in trees:
+                    chain.append(parent)
+                    parent = parents[parent]
+                tree = trees[parent]
+                if tree is not None:
+                    for parent in reversed(chain):
+                        tree = trees[parent] = tree.setdefault(
+                            strings[keys[parent]], {})
+            # Under a node kept whole
+            if tree is None:
+                continue
+            tree[strings[keys[node]]] = None
+            trees[node] = None
+        return trees[self.ROOT]
+
+    def memory(self):
+        """Approximate size of the index in bytes"""
+        size = sum(sys.getsizeof(a) for a in (
+            self.parents, self.keys, self.values,
+            self._long_keys, self._long_values))
+        size += sys.getsizeof(self.strings) + sys.getsizeof(self._string_ids)
+        size += sum(sys.getsizeof(s) for s in self.strings)
+        for postings in (self._key_grams, self._value_grams):
+            size += sys.getsizeof(postings)
+            size += sum(sys.getsizeof(g) + sys.getsizeof(p)
+                        for g, p in postings.items())
+        return size
+
+    def stats(self):
+        return {
+            "nodes": len(self.parents) - 1,
+            "strings": len(self.strings),
+            "trigrams": len(self._key_grams) + len(self._value_grams),
+            "build_time": self.build_time,
+            "memory": self.memory(),
+        }
@@ -0,0 +1,401 @@
+from PyQt5 import QtCore
+
+from json_index import SortRole
+from json_metrics import metrics
+
+
+class _Mapping(object):
+    """Order of the children of one source parent"""
+
+    __slots__ = ("source_parent", "order", "rows", "keys", "sources")
+
+    def __init__(self, source_parent, count):
+        # QPersistentModelIndex, None for the root
+        self.source_parent = source_parent
+        # Proxy row -> source row
+        self.order = list(range(count))
+        # Source row -> proxy row
+        self.rows = list(range(count))
+        # Column -> sort key of each source row
+        self.keys = {}
+        # Source index of each source row in column 0, views ask for it
+        # several times per row on every layout
+        self.sources = [None] * count
+
+    def parentIndex(self):
+        if self.source_parent is None:
+            return QtCore.QModelIndex()
+        return QtCore.QModelIndex(self.source_parent)
+
+    def renumber(self):
+        rows = [-1] * len(self.rows)
+        for row, source_row in enumerate(self.order):
+            rows[source_row] = row
+        self.rows = rows
+
+
+class JsonSortProxy(QtCore.QAbstractProxyModel):
+    """Sorted view of a QJsonModel or QJsonIndexModel, or of a
+    JsonFilterProxy over one, the source keeps document order
+
+    The children of a parent are only sorted once a view asks for them,
+    i.e. when it is expanded. Sort keys are read through SortRole once
+    per row and column and kept until the row changes, so sorting again
+    by a column seen before reads nothing from the source. sort(-1)
+    goes back to document order, nothing is reloaded either way.
+
+    """
+
+    def __init__(self, parent=None):
+        super(JsonSortProxy, self).__init__(parent)
+
+        self._column = -1
+        self._order = QtCore.Qt.AscendingOrder
+        # Source parent (None for the root) -> _Mapping. Keyed by
+        # persistent index, source rows may move and sources such as a
+        # QSortFilterProxyModel give siblings the same internalId
+        self._mappings = {}
+        self._connections = []
+        self._source = None
+        # Set while a parent is fetched whole, see _fetchAll
+        self._deferSort = False
+        # (proxy persistent indexes, their source indexes) across a
+        # layout change of the source
+        self._layout = None
+        # (mapping, first proxy row) between the two signals of a source
+        # insert
+        self._inserting = None
+
+    # Source
+
+    def setSourceModel(self, model):
+        self.beginResetModel()
+
+        for signal, slot in self._connections:
+            signal.disconnect(slot)
+        self._connections = []
+        self._mappings.clear()
+
+        super(JsonSortProxy, self).setSourceModel(model)
+        self._source = model
+
+        if model is not None:
+            for signal, slot in (
+                (model.modelAboutToBeReset, self.beginResetModel),
+                (model.modelReset, self._sourceReset),
+                (model.layoutAboutToBeChanged, self._sourceLayoutAboutToChange),
+                (model.layoutChanged, self._sourceLayoutChanged),
+                (model.dataChanged, self._sourceDataChanged),
+                (model.rowsAboutToBeInserted,
+                 self._sourceRowsAboutToBeInserted),
+                (model.rowsInserted, self._sourceRowsInserted),
+                (model.rowsAboutToBeRemoved, self._sourceRowsAboutToBeRemoved),
+                (model.rowsRemoved, self._sourceRowsRemoved),
+                (model.headerDataChanged, self.headerDataChanged),
+            ):
+                signal.connect(slot)
+                self._connections.append((signal, slot))
+
+        self.endResetModel()
+
+    def _key(self, source_parent):
+        if not source_parent.isValid():
+            return None
+        return QtCore.QPersistentModelIndex(source_parent)
+
+    def _existingMapping(self, source_parent):
+        return self._mappings.get(self._key(source_parent))
+
+    def _mapping(self, source_parent):
+        key = self._key(source_parent)
+        mapping = self._mappings.get(key)
+        if mapping is None:
+            count = self.sourceModel().rowCount(source_parent)
+            mapping = self._mappings[key] = _Mapping(key, count)
+            if self._column >= 0:
+                self._sortMapping(mapping)
+        return mapping
+
+    def _sortKeys(self, mapping, column):
+        keys = mapping.keys.get(column)
+        if keys is None:
+            source = self._source
+            parent = mapping.parentIndex()
+            with metrics.timer("sort_keys"):
+                keys = mapping.keys[column] = [
+                    source.index(row, column, parent).data(SortRole)
+                    for row in range(len(mapping.order))]
+        return keys
+
+    def _sortedOrder(self, mapping):
+        if self._column < 0:
+            return list(range(len(mapping.rows)))
+        keys = self._sortKeys(mapping, self._column)
+        # Stable both ways, equal keys keep document order
+        return sorted(range(len(keys)), key=keys.__getitem__,
+                      reverse=self._order == QtCore.Qt.DescendingOrder)
+
+    def _sortMapping(self, mapping):
+        mapping.order = self._sortedOrder(mapping)
+        mapping.renumber()
+
+    def _resort(self, mappings):
+        """Sort `mappings` again, moving the persistent indexes below
+        them along"""
+        self.layoutAboutToBeChanged.emit()
+
+        ids = {id(mapping) for mapping in mappings}
+        old = []
+        sources = []
+        for index in self.persistentIndexList():
+            mapping = index.internalPointer()
+            if id(mapping) in ids:
+                old.append(index)
+                sources.append(mapping.order[index.row()])
+
+        for mapping in mappings:
+            self._sortMapping(mapping)
+
+        self.changePersistentIndexList(old, [
+            self.createIndex(index.internalPointer().rows[source_row],
+                             index.column(), index.internalPointer())
+            for index, source_row in zip(old, sources)])
+
+        self.layoutChanged.emit()
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        if (column, order) == (self._column, self._order):
+            return
+
+        with metrics.timer("sort"):
+            if column >= 0:
+                # Parents shown so far are sorted whole, see fetchMore
+                for mapping in list(self._mappings.values()):
+                    self._fetchAll(mapping.parentIndex())
+
+            self._column = column
+            self._order = order
+            self._resort(list(self._mappings.values()))
+
+    def sortColumn(self):
+        return self._column
+
+    def sortOrder(self):
+        return self._order
+
+    # Source changes
+
+    def _sourceReset(self):
+        self._mappings.clear()
+        self.endResetModel()
+
+    def _sourceLayoutAboutToChange(self):
+        self.layoutAboutToBeChanged.emit()
+        old = self.persistentIndexList()
+        self._layout = (old, [QtCore.QPersistentModelIndex(
+            self.mapToSource(index)) for index in old])
+
+    def _sourceLayoutChanged(self):
+        old, sources = self._layout
+        self._layout = None
+        # Rows may have moved anywhere, mappings are built again
+        self._mappings.clear()
+        self.changePersistentIndexList(old, [
+            self.mapFromSource(QtCore.QModelIndex(source))
+            for source in sources])
+        self.layoutChanged.emit()
+
+    def _sourceDataChanged(self, top_left, bottom_right, roles=()):
+        mapping = self._existingMapping(top_left.parent())
+        if mapping is None:
+            return
+
+        first, last = top_left.row(), bottom_right.row()
+        source = self._source
+        parent = mapping.parentIndex()
+        for column, keys in mapping.keys.items():
+            for row in range(first, last + 1):
+                keys[row] = source.index(row, column, parent).data(SortRole)
+
+        if (self._column >= 0
+                and self._sortedOrder(mapping) != mapping.order):
+            self._resort([mapping])
+
+        for row in range(first, last + 1):
+            proxy_row = mapping.rows[row]
+            self.dataChanged.emit(
+                self.createIndex(proxy_row, top_left.column(), mapping),
+                self.createIndex(proxy_row, bottom_right.column(), mapping),
+                roles)
+
+    def _sourceRowsAboutToBeInserted(self, source_parent, first, last):
+        # Begun while the source still has its old rows, the indexes a
+        # view asks about meanwhile must map with the mappings as they are
+        mapping = self._existingMapping(source_parent)
+        if mapping is None:
+            return
+
+        # In document order rows go where the source puts them, else to
+        # the end and then into place with the others
+        start = first if self._column < 0 else len(mapping.order)
+        self._inserting = mapping, start
+        self.beginInsertRows(self.mapFromSource(source_parent),
+                             start, start + last - first)
+
+    def _sourceRowsInserted(self, source_parent, first, last):
+        if self._inserting is None:
+            return
+        mapping, start = self._inserting
+        self._inserting = None
+
+        count = last - first + 1
+        if first == len(mapping.rows) and start == len(mapping.order):
+            # Fetched rows, appended on both sides
+            mapping.order.extend(range(first, last + 1))
+            mapping.rows.extend(range(start, start + count))
+            mapping.sources.extend([None] * count)
+        else:
+            mapping.sources = [None] * (len(mapping.rows) + count)
+            order = [row + count if row >= first else row
+                     for row in mapping.order]
+            order[start:start] = range(first, last + 1)
+            mapping.order = order
+            mapping.rows[first:first] = [-1] * count
+            mapping.renumber()
+        source = self._source
+        for column, keys in mapping.keys.items():
+            keys[first:first] = [
+                source.index(row, column, source_parent).data(SortRole)
+                for row in range(first, last + 1)]
+        self.endInsertRows()
+
+        if self._column >= 0 and not self._deferSort:
+            self._resort([mapping])
+
+    def _sourceRowsAboutToBeRemoved(self, source_parent, first, last):
+        mapping = self._existingMapping(source_parent)
+        if mapping is None:
+            return
+
+        proxy_parent = self.mapFromSource(source_parent)
+        proxy_rows = sorted(mapping.rows[first:last + 1], reverse=True)
+        # One removal per run of adjacent proxy rows, last run first
+        while proxy_rows:
+            stop = start = proxy_rows.pop(0)
+            while proxy_rows and proxy_rows[0] == start - 1:
+                start = proxy_rows.pop(0)
+            self.beginRemoveRows(proxy_parent, start, stop)
+            del mapping.order[start:stop + 1]
+            mapping.renumber()
+            self.endRemoveRows()
+
+    def _sourceRowsRemoved(self, source_parent, first, last):
+        mapping = self._existingMapping(source_parent)
+        if mapping is not None:
+            count = last - first + 1
+            mapping.order = [row - count if row > last else row
+                             for row in mapping.order]
+            del mapping.rows[first:last + 1]
+            mapping.sources = [None] * len(mapping.rows)
+            mapping.renumber()
+            for keys in mapping.keys.values():
+                del keys[first:last + 1]
+
+        # Drop the mappings of removed branches
+        for key in list(self._mappings):
+            if key is not None and not key.isValid():
+                del self._mappings[key]
+
+    # Proxy model
+
+    def mapToSource(self, proxy_index):
+        if not proxy_index.isValid():
+            return QtCore.QModelIndex()
+        mapping = proxy_index.internalPointer()
+        row = mapping.order[proxy_index.row()]
+        column = proxy_index.column()
+        if column:
+            return self._source.index(row, column, mapping.parentIndex())
+        index = mapping.sources[row]
+        if index is None:
+            index = mapping.sources[row] = self._source.index(
+                row, 0, mapping.parentIndex())
+        return index
+
+    def mapFromSource(self, source_index):
+        if not source_index.isValid():
+            return QtCore.QModelIndex()
+        mapping = self._mapping(source_index.parent())
+        return self.createIndex(mapping.rows[source_index.row()],
+                                source_index.column(), mapping)
+
+    def index(self, row, column, parent=QtCore.QModelIndex()):
+        if row < 0 or column < 0 or self._source is None:
+            return QtCore.QModelIndex()
+        source_parent = self.mapToSource(parent)
+        mapping = self._mapping(source_parent)
+        if (row >= len(mapping.order)
+                or column >= self._source.columnCount(source_parent)):
+            return QtCore.QModelIndex()
+        return self.createIndex(row, column, mapping)
+
+    def parent(self, index):
+        if not index.isValid():
+            return QtCore.QModelIndex()
+        mapping = index.internalPointer()
+        if mapping.source_parent is None:
+            return QtCore.QModelIndex()
+        return self.mapFromSource(mapping.parentIndex())
+
+    def sibling(self, row, column, index):
+        # The base class takes `row` as a row of the source
+        return self.index(row, column, index.parent())
+
+    def headerData(self, section, orientation, role):
+        if self.sourceModel() is None:
+            return None
+        return self.sourceModel().headerData(section, orientation, role)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if self.sourceModel() is None or parent.column() > 0:
+            return 0
+        return len(self._mapping(self.mapToSource(parent)).order)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if self.sourceModel() is None:
+            return 0
+        return self.sourceModel().columnCount(self.mapToSource(parent))
+
+    def hasChildren(self, parent=QtCore.QModelIndex()):
+        if self.sourceModel() is None:
+            return False
+        return self.sourceModel().hasChildren(self.mapToSource(parent))
+
+    def canFetchMore(self, parent):
+        if self.sourceModel() is None:
+            return False
+        return self.sourceModel().canFetchMore(self.mapToSource(parent))
+
+    def fetchMore(self, parent):
+        source_parent = self.mapToSource(parent)
+        if self._column < 0:
+            self._source.fetchMore(source_parent)
+            return
+
+        # Sorting a part of the children would reorder the rows shown so
+        # far on every fetch
+        self._fetchAll(source_parent)
+        mapping = self._existingMapping(source_parent)
+        if mapping is not None:
+            self._resort([mapping])
+
+    def _fetchAll(self, source_parent):
+        """Fetch every child of `source_parent`, new rows are left at the
+        end for the caller to sort once"""
+        source = self._source
+        self._deferSort = True
+        try:
+            while source.canFetchMore(source_parent):
+                source.fetchMore(source_parent)
+        finally:
+            self._deferSort = False
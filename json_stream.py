@@ -0,0 +1,217 @@
+import codecs
+import json
+import os
+
+from json_decode import get_decoder
+
+
+# Characters from the end of the buffer within which a decode error may
+# only mean the value goes on in the next chunk, e.g. "-Infinit"
+TAIL_CHARS = 16
+
+
+class IncompleteEntry(Exception):
+    pass
+
+
+def iter_entries(jfile, chunk_size=1 << 20):
+    """Parse the top-level container of a JSON file entry by entry
+
+    The file is read in chunks, only one top-level entry has to fit in
+    memory as text at a time. Invalid JSON raises a ValueError where it
+    is found, with its position in the file.
+
+    Arguments:
+        jfile (file): File opened in binary mode
+        chunk_size (int, optional): Bytes read at a time
+
+    Yields:
+        (dict or list) type of the top-level container first, then a
+        (key, value, bytes_read) tuple per entry. Keys of list entries
+        are their index.
+
+    """
+
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8-sig")()
+    # `start` counts the characters dropped before `buf`, for the
+    # positions in errors
+    state = {"buf": "", "pos": 0, "start": 0, "bytes": 0, "eof": False}
+
+    def error(message, pos):
+        return ValueError("%s (char %d)" % (message, state["start"] + pos))
+
+    def read_more(size):
+        chunk = jfile.read(size)
+        state["bytes"] += len(chunk)
+        state["eof"] = not chunk
+        state["start"] += state["pos"]
+        buf = state["buf"][state["pos"]:]
+        state["buf"] = buf + utf8.decode(chunk, final=state["eof"])
+        state["pos"] = 0
+
+    def skip_ws(buf, pos):
+        while pos < len(buf) and buf[pos] in " \t\n\r":
+            pos += 1
+        if pos == len(buf):
+            raise IncompleteEntry()
+        return pos
+
+    def decode(buf, pos):
+        try:
+            value, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError as e:
+            # A value cut by the end of the buffer fails there, or as an
+            # unterminated string, and may parse once more is read
+            if not state["eof"] and (e.pos >= len(buf) - TAIL_CHARS
+                                     or e.msg == "Unterminated string "
+                                                 "starting at"):
+                raise IncompleteEntry()
+            raise error(e.msg, e.pos)
+        # A number ending near the end of the buffer may go on in the
+        # next chunk, "2.5" of "2.5e3"
+        if not state["eof"] and end > len(buf) - TAIL_CHARS:
+            raise IncompleteEntry()
+        return value, end
+
+    def parse_entry(buf, pos, is_dict, first):
+        """Next entry and where it ends, whether it closed the
+        container. None for the entry of an empty container"""
+        closing = "}" if is_dict else "]"
+        pos = skip_ws(buf, pos)
+        if first and buf[pos] == closing:
+            return None, pos + 1, True
+        key = None
+        if is_dict:
+            if buf[pos] != '"':
+                raise error("Expecting property name enclosed in double "
+                            "quotes", pos)
+            key, pos = decode(buf, pos)
+            pos = skip_ws(buf, pos)
+            if buf[pos] != ":":
+                raise error("Expecting ':' delimiter", pos)
+            pos += 1
+        pos = skip_ws(buf, pos)
+        value, pos = decode(buf, pos)
+        pos = skip_ws(buf, pos)
+        if buf[pos] == ",":
+            return (key, value), pos + 1, False
+        if buf[pos] == closing:
+            return (key, value), pos + 1, True
+        raise error("Expecting ',' delimiter", pos)
+
+    def check_rest():
+        """Only whitespace may follow the top-level container"""
+        while True:
+            buf = state["buf"]
+            pos = state["pos"]
+            while pos < len(buf) and buf[pos] in " \t\n\r":
+                pos += 1
+            if pos < len(buf):
+                raise error("Extra data", pos)
+            if state["eof"]:
+                return
+            state["pos"] = pos
+            read_more(chunk_size)
+
+    read_more(chunk_size)
+    while True:
+        try:
+            pos = skip_ws(state["buf"], 0)
+            break
+        except IncompleteEntry:
+            if state["eof"]:
+                raise ValueError("Empty JSON document")
+            read_more(chunk_size)
+
+    opening = state["buf"][pos]
+    if opening not in "[{":
+        raise ValueError("Top-level JSON value must be an object or array")
+    is_dict = opening == "{"
+    state["pos"] = pos + 1
+    yield dict if is_dict else list
+
+    index = 0
+    want = chunk_size
+    while True:
+        try:
+            entry, end, closed = parse_entry(
+                state["buf"], state["pos"], is_dict, index == 0)
+        except IncompleteEntry:
+            if state["eof"]:
+                raise ValueError("Unexpected end of JSON document")
+            # Grow geometrically so a huge entry is not re-parsed once
+            # per chunk
+            want = max(want, len(state["buf"]) - state["pos"])
+            read_more(want)
+            continue
+
+        want = chunk_size
+        state["pos"] = end
+        if entry is not None:
+            key, value = entry
+            yield (key if is_dict else index), value, state["bytes"]
+            index += 1
+        if closed:
+            check_rest()
+            return
+
+        if state["pos"] > chunk_size:
+            state["start"] += state["pos"]
+            state["buf"] = state["buf"][state["pos"]:]
+            state["pos"] = 0
+
+
+# Files up to this size are decoded in one call by fast decoders, larger
+# ones are streamed so the first entries show before the rest is parsed
+WHOLE_FILE_LIMIT = 32 << 20
+
+
+def iter_decoded_entries(jfile, decoder):
+    """Same items as iter_entries, from a file decoded in one call"""
+    data = jfile.read()
+    document = decoder.loads(data)
+    if isinstance(document, dict):
+        items = document.items()
+    elif isinstance(document, list):
+        items = enumerate(document)
+    else:
+        raise ValueError("Top-level JSON value must be an object or array")
+    yield type(document)
+
+    total = len(data)
+    count = len(document)
+    for i, (key, value) in enumerate(items):
+        # Bytes are only known for the whole file, spread them evenly
+        yield key, value, total * (i + 1) // count
+
+
+def iter_file_entries(jfile, decoder=None, chunk_size=1 << 20):
+    """Entries of a file through the fastest way available, see
+    iter_entries
+
+    Arguments:
+        decoder (json_decode.JsonDecoder, optional): Decodes small
+            files in one call when faster than streaming, defaults to
+            json_decode.get_decoder()
+
+    """
+
+    decoder = decoder or get_decoder()
+    if (decoder.fast
+            and os.fstat(jfile.fileno()).st_size <= WHOLE_FILE_LIMIT):
+        return iter_decoded_entries(jfile, decoder)
+    return iter_entries(jfile, chunk_size)
+
+
+def count_nodes(value):
+    count = 0
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        count += 1
+        if isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+    return count
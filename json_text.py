@@ -0,0 +1,39 @@
+# Texts shown for JSON values. Shared by the models, the search index and
+# the command line tools so that what is found is what is shown, and kept
+# free of Qt for the latter.
+
+
+# Longer values are cut in the value column, a ValueDetail pages
+# through the whole text
+PREVIEW_CHARS = 256
+
+
+def preview(text, limit=PREVIEW_CHARS):
+    """`text` cut to `limit` characters, followed by its length"""
+    if len(text) <= limit:
+        return text
+    return "%s\u2026 [%s chars]" % (text[:limit], format(len(text), ","))
+
+
+def display_text(value, limit=PREVIEW_CHARS):
+    """Text shown for a scalar value, in JSON spelling
+
+    Arguments:
+        value: Scalar value
+        limit (int, optional): Longer texts are cut, None for the whole
+
+    """
+
+    if isinstance(value, str):
+        text = value
+    elif value is None:
+        return "null"
+    elif value is True:
+        return "true"
+    elif value is False:
+        return "false"
+    else:
+        text = str(value)
+    if limit is None:
+        return text
+    return preview(text, limit)
@@ -1,11 +1,22 @@
+import sys
 
 from PyQt5.QtGui import *
 from PyQt5.QtCore import *
 from PyQt5.QtWidgets import *
-
-DEBUG = True
+from json_patch import Journal, apply_patch
+from json_index import ValueRole, type_label
+from json_metrics import metrics
+from json_query import keys_to_pointer
+from json_scheme import compile_scheme
+from json_text import preview
+from json_undo import UndoStack, estimate_size
+
+DEBUG = False
 NoneType = type(None)
 
+# Item data role holding the scheme error of the item, None when valid
+SchemeErrorRole = Qt.UserRole + 1
+
 
 class QJsonTreeWidgetItem(QTreeWidgetItem):
     def __init__(self, key, value=None, parent=None, scheme=None):
@@ -13,49 +24,110 @@ class QJsonTreeWidgetItem(QTreeWidgetItem):
         super().__init__(parent)
         self.setFlags(self.flags() | Qt.ItemIsEditable)
         self.setKey(key)
-        if scheme is None:
-            self.scheme = value
-        else:
-            self.scheme = scheme
-
-        self.setValueType(type(self.scheme))
-        # 缓存下子节点scheme
-        if issubclass(self.value_type, list):
-            self.child_scheme = self.scheme[0]
-        elif issubclass(self.value_type, dict):
-            self.child_scheme = next(iter(value.values()))
-        else:
-            self.child_scheme = None
+        # 编译后的scheme节点, 同一位置的所有节点共享
+        self.scheme = scheme
 
+        self.setValueType(type(value))
         self.setValue(value)
+        self.check_scheme()
 
     def setKey(self, key):
-        self.key = key
-        self.setText(0, str(key))
+        self._key = key
+        # 列表元素的key文本由data按位置生成, 不再每个节点保存一份
+        parent = self.parent()
+        if parent is None or not parent.isList():
+            self.setText(0, str(key))
+
+    @property
+    def key(self):
+        # 列表元素的key即其位置, 不单独保存, 增删时无需重排后续节点
+        parent = self.parent()
+        if parent is not None and parent.isList():
+            return self.row()
+        return self._key
+
+    def row(self):
+        tree = self.treeWidget()
+        if tree is not None:
+            # QTreeWidget caches each item's last row, unlike indexOfChild
+            return tree.indexFromItem(self).row()
+        return self.parent().indexOfChild(self)
+
+    def data(self, column, role):
+        if column == 0 and role == Qt.DisplayRole:
+            parent = self.parent()
+            if parent is not None and parent.isList():
+                return str(self.row())
+        elif column == 2 and role == Qt.DisplayRole:
+            # 共享的类型名, 不必每次绘制都新建字符串
+            return type_label(self.value_type)
+        elif column == 1 and role == Qt.EditRole and self.isPrimitive():
+            # 显示的是截断后的预览, 编辑时用完整值
+            return str(self.value)
+        elif role == ValueRole:
+            return self.value
+        return super().data(column, role)
+
+    def scheme_for(self, key):
+        """Scheme of the child under `key`"""
+        if self.scheme is None:
+            return None
+        return self.scheme.child(key)
+
+    def child_template(self):
+        """Scheme node new children are built from"""
+        if self.scheme is not None and self.scheme.item is not None:
+            return self.scheme.item
+        # 没有scheme时以第一个子节点为模板
+        values = self.value.values() if self.isDict() else self.value
+        return compile_scheme(next(iter(values), None))
+
+    def check_scheme(self):
+        """Update the scheme error of this item alone"""
+        error = None
+        if self.scheme is not None:
+            error = self.scheme.check(self.value)
+        if error is None and self.data(0, SchemeErrorRole) is None:
+            return
+        self.setData(0, SchemeErrorRole, error)
+        for column in range(self.columnCount()):
+            self.setData(column, Qt.ToolTipRole, error)
+            self.setData(column, Qt.ForegroundRole,
+                         QBrush(Qt.red) if error else None)
+
+    def bind_scheme(self, scheme):
+        """Take a new scheme and check the subtree again"""
+        stack = [(self, scheme)]
+        while stack:
+            item, scheme = stack.pop()
+            item.scheme = scheme
+            item.check_scheme()
+            for row in range(item.childCount()):
+                child = item.child(row)
+                stack.append((child, item.scheme_for(child.key)))
 
     def setValueType(self, v_type):
+        # 类型列由data生成, 节点只引用类型对象
         self.value_type = v_type
-        self.setText(2, str(self.value_type))
 
     def setValue(self, val):
         try:
             if issubclass(self.value_type, NoneType):
                 self.value = val
-                self.setText(1, str(self.value))
+                self.setText(1, preview(str(self.value)))
             elif self.isPrimitive():
                 self.value = self.value_type(val)
-                self.setText(1, str(self.value))
+                self.setText(1, preview(str(self.value)))
             else:
                 self.value = val
 
             if DEBUG:
                 self.setText(3, str(id(self.value)))
-        except ValueError as e:
-            print(e)
+        except ValueError:
+            # 无法转换为当前类型, 保留原值
+            pass
 
     def setData(self, column: int, role: int, str_val):
-        if DEBUG:
-            print("override setData:", column, role, str_val, type(str_val))
         if role != Qt.EditRole:
             super().setData(column, role, str_val)
             return
@@ -63,21 +135,97 @@ class QJsonTreeWidgetItem(QTreeWidgetItem):
         if column == 0:
             parent = self.parent()
             if parent and issubclass(parent.value_type, dict):
+                old_key = self.key
                 new_key = str_val
-                parent_map = parent.value
-                cur_val = parent_map.pop(self.key)
-                parent_map[new_key] = cur_val
-                self.setKey(new_key)
+                # 不能与兄弟节点重名, 否则会覆盖其值
+                if new_key == old_key or new_key in parent.value:
+                    return
+                self.rename(new_key)
+                tree = self.treeWidget()
+                path = parent.path()
+                tree.undo_stack.push(
+                    "Rename %s" % old_key,
+                    lambda: tree.item_at(path + [new_key]).rename(old_key),
+                    lambda: tree.item_at(path + [old_key]).rename(new_key))
 
         elif column == 1:
             # 限制只有基础类型才能编辑
             if not self.isPrimitive():
                 return
-            self.setValue(str_val)
+            old_val = self.value
+            self.set_value(str_val)
+            new_val = self.value
+            if new_val != old_val:
+                tree = self.treeWidget()
+                path = self.path()
+                tree.undo_stack.push(
+                    "Edit %s" % self.key,
+                    lambda: tree.item_at(path).set_value(old_val, False),
+                    lambda: tree.item_at(path).set_value(new_val, False),
+                    sys.getsizeof(old_val) + sys.getsizeof(new_val))
+
+    def rename(self, new_key):
+        from_path = self.pointer()
+        parent = self.parent()
+        parent_map = parent.value
+        old_key = self.key
+        # 原位置替换key, 撤销时顺序不变, 与节点顺序一致
+        items = list(parent_map.items())
+        parent_map.clear()
+        for key, value in items:
+            parent_map[new_key if key == old_key else key] = value
+        self.setKey(new_key)
+        self.journal().move(from_path, self.pointer())
+        # 新key可能对应不同的scheme
+        self.bind_scheme(parent.scheme_for(new_key))
+
+    def set_value(self, val, convert=True):
+        old_val = self.value
+        # 输入按scheme类型转换, 可修正类型错误的值
+        scheme = self.scheme
+        if not convert:
+            # 撤销/重做时原样恢复
+            self.setValueType(type(val))
+        elif (scheme is not None and scheme.type is not self.value_type
+                and scheme.type not in (dict, list, NoneType)):
+            try:
+                val = scheme.type(val)
+                self.setValueType(scheme.type)
+            except (TypeError, ValueError):
+                pass
+        self.setValue(val)
+        parent = self.parent()
+        if parent is not None and self.value != old_val:
+            # 同步到父节点数据, 记录修改
+            parent.value[self.key] = self.value
+            self.journal().replace(self.pointer(), self.value)
+        self.check_scheme()
+
+    def path(self):
+        """Dict keys and list indices from the root item"""
+        keys = []
+        item = self
+        while item.parent() is not None:
+            keys.append(item.key)
+            item = item.parent()
+        keys.reverse()
+        return keys
+
+    def pointer(self):
+        return keys_to_pointer(self.path())
+
+    def journal(self):
+        return self.treeWidget().journal
 
     def isRoot(self):
         return self.parent() == None
 
+    def isList(self):
+        return self.value_type is not None and issubclass(self.value_type, list)
+
+    def isDict(self):
+        return self.value_type is not None and issubclass(self.value_type, dict)
+
     def isPrimitive(self):
         if self.value_type is None:
             return False
@@ -90,31 +238,37 @@ class QJsonTreeWidgetItem(QTreeWidgetItem):
         if self.isPrimitive():
             return
 
+        # 由模板直接生成新值, 不再deepcopy
+        child_obj = self.child_template().new()
         if issubclass(self.value_type, list):
             p_list = self.value
-            child_obj = copy.deepcopy(self.child_scheme)
             p_list.append(child_obj)
             idx = len(p_list)-1
-            self._add_child_recursive(idx, child_obj, self, self.child_scheme)
+            key = idx
         elif issubclass(self.value_type, dict):
             p_dict = self.value
-            child_obj = copy.deepcopy(self.child_scheme)
             key = str(id(child_obj))
+            idx = self.childCount()
             p_dict[key] = child_obj
-            self._add_child_recursive(key, child_obj, self, self.child_scheme)
+        else:
+            return
+        self._add_child_recursive(key, child_obj, self, self.scheme_for(key))
+
+        self.journal().add(keys_to_pointer(self.path() + [key]), child_obj)
+        self.treeWidget().push_child_change("Add %s" % key, self.path(),
+                                            idx, key, self.child(idx), False)
 
-    def recursive_json_tree(self, jdata, parent=None, scheme=None):
+    def recursive_json_tree(self, jdata, parent=None):
         if parent is None:
             parent = self
 
         if isinstance(jdata, dict):
             for key, val in jdata.items():
-                self._add_child_recursive(key, val, parent, scheme)
+                self._add_child_recursive(key, val, parent,
+                                          parent.scheme_for(key))
         elif isinstance(jdata, list):
             for i, val in enumerate(jdata):
-                self._add_child_recursive(i, val, parent, scheme)
-        else:
-            print("This should never be reached!")
+                self._add_child_recursive(i, val, parent, parent.scheme_for(i))
 
     def _add_child_recursive(self, key, val, parent, scheme):
         if isinstance(val, dict) or isinstance(val, list):
@@ -128,25 +282,37 @@ class QJsonTreeWidgetItem(QTreeWidgetItem):
         if self.isPrimitive():
             return
 
-        idx = self.indexOfChild(child)
+        idx = child.row()
+        key = child.key
+        self.journal().remove(child.pointer())
 
-        # 列表类型按idx值移除，并重置后续节点key值
+        # 列表类型按idx值移除, 后续节点key由位置得出
         if issubclass(self.value_type, list):
             p_list = self.value
-            for i in range(len(p_list)-1, idx, -1):
-                child = self.child(i)
-                child.setKey(i-1)
-
             del p_list[idx]
-            if DEBUG:
-                print("remove list idx:", idx)
         else:
-            self.value[child.key] = None
-            if DEBUG:
-                print("remove child key:", idx, child.key)
+            del self.value[child.key]
 
         self.takeChild(idx)
 
+        # 移除的子树直接保留用于撤销, 不做拷贝
+        self.treeWidget().push_child_change("Remove %s" % key, self.path(),
+                                            idx, key, child, True)
+
+    def insert_child(self, idx, child, key):
+        """Insert a detached child item, e.g. one removed earlier"""
+        if issubclass(self.value_type, list):
+            self.value.insert(idx, child.value)
+        else:
+            # 在原位置插入key, 与节点顺序一致
+            items = list(self.value.items())
+            items.insert(idx, (key, child.value))
+            self.value.clear()
+            self.value.update(items)
+            child.setKey(key)
+        self.insertChild(idx, child)
+        self.journal().add(child.pointer(), child.value)
+
 
 class JsonTreeWidget(QTreeWidget):
     def __init__(self, parent=None):
@@ -158,6 +324,15 @@ class JsonTreeWidget(QTreeWidget):
             self.setHeaderLabels(["key","value","type","uid"])
         else:
             self.setHeaderLabels(["key","value"])
+
+        # Edits since the document was loaded, as JSON Patch
+        self.journal = Journal()
+        # 撤销命令按路径查找节点, 整树重建后依然有效
+        self.undo_stack = UndoStack()
+        self.json_data = None
+        self.json_scheme = None
+        self.root_name = None
+        self.root_item = None
     
         self.customContextMenuRequested.connect(self.prepareMenu)
         self.item_add_action = QAction("新增", self)
@@ -186,7 +361,6 @@ class JsonTreeWidget(QTreeWidget):
         treeItem = self.itemAt(pos)
         if treeItem is None:
             return
-        print("prepareMenu:", pos, treeItem)
 
         menu = QMenu("ItemAction", self)
         self.selected_item = treeItem
@@ -196,12 +370,139 @@ class JsonTreeWidget(QTreeWidget):
         if not menu.isEmpty():
             menu.exec(self.viewport().mapToGlobal(pos))
 
+    def begin_load(self, container_type, root_name, jscheme=None):
+        """Start a document whose top-level entries arrive in batches"""
+        self.json_data = container_type()
+        self.json_scheme = self._compile_scheme(jscheme)
+        self.root_name = root_name
+        self.root_item = None
+        self.journal.clear()
+        self.undo_stack.clear()
+        self.clear()
+
+    def append_entries(self, entries):
+        if isinstance(self.json_data, dict):
+            for key, val in entries:
+                self.json_data[key] = val
+        else:
+            self.json_data.extend(val for _, val in entries)
+
+        # 根节点需要至少一个子节点来推断子节点scheme
+        if self.root_item is None:
+            if not self.json_data:
+                return
+            self.root_item = QJsonTreeWidgetItem(self.root_name, self.json_data,
+                                                 scheme=self.json_scheme)
+            self.addTopLevelItem(self.root_item)
+            self.root_item.setExpanded(True)
+
+        self.setUpdatesEnabled(False)
+        with metrics.timer("build"):
+            for key, val in entries:
+                self.root_item._add_child_recursive(
+                    key, val, self.root_item, self.root_item.scheme_for(key))
+        self.setUpdatesEnabled(True)
+
     def load_json(self, jdata, root_name, jscheme=None):
         self.json_data = jdata
+        self.json_scheme = self._compile_scheme(jscheme)
+        self.root_name = root_name
+        self.journal.clear()
+        self.undo_stack.clear()
+        with metrics.timer("build"):
+            self._build_tree()
+
+    def _build_tree(self):
         self.clear()
 
-        self.root_item = QJsonTreeWidgetItem(root_name, self.json_data)
+        self.root_item = QJsonTreeWidgetItem(self.root_name, self.json_data,
+                                             scheme=self.json_scheme)
         self.addTopLevelItem(self.root_item)
-        self.root_item.recursive_json_tree(self.json_data, scheme=jscheme)
+        self.root_item.recursive_json_tree(self.json_data)
 
         self.root_item.setExpanded(True)
+
+    @staticmethod
+    def _compile_scheme(jscheme):
+        # 加载时编译一次, 所有节点共享
+        if jscheme is None:
+            return None
+        return compile_scheme(jscheme)
+
+    def scheme_errors(self):
+        """Items whose value does not fit the scheme"""
+        errors = []
+        it = QTreeWidgetItemIterator(self)
+        while it.value() is not None:
+            item = it.value()
+            if item.data(0, SchemeErrorRole) is not None:
+                errors.append(item)
+            it += 1
+        return errors
+
+    def item_at(self, path):
+        """Item at a path of dict keys and list indices"""
+        item = self.root_item
+        for key in path:
+            if item.isList():
+                item = item.child(key)
+                continue
+            for row in range(item.childCount()):
+                if item.child(row).key == key:
+                    item = item.child(row)
+                    break
+            else:
+                raise KeyError(key)
+        return item
+
+    def push_child_change(self, text, path, idx, key, child, removed):
+        """Push the undo command of addChild/removeChild
+
+        The detached child item is held for reinsertion, the item
+        removed again is taken from the tree since a patch may have
+        rebuilt it in between.
+        """
+        held = [child]
+
+        def insert():
+            self.item_at(path).insert_child(idx, held[0], key)
+
+        def remove():
+            parent = self.item_at(path)
+            held[0] = parent.child(idx)
+            parent.removeChild(held[0])
+
+        if removed:
+            self.undo_stack.push(text, insert, remove,
+                                 estimate_size(child.value))
+        else:
+            self.undo_stack.push(text, remove, insert)
+
+    def apply_patch(self, patch):
+        """Apply JSON Patch operations to json_data and rebuild the tree once
+
+        The patch is undone as one command, by applying its inverse.
+
+        Raises:
+            json_patch.PatchError: if an operation cannot be applied
+        """
+        inverse = self._patch_data(patch)
+
+        def undo():
+            self._patch_data(inverse, False)
+
+        def redo():
+            inverse[:] = self._patch_data(patch)
+
+        self.undo_stack.push("Apply patch", undo, redo,
+                             sum(estimate_size(op["value"]) for op in inverse
+                                 if "value" in op))
+
+    def _patch_data(self, patch, copy_values=True):
+        inverse = []
+        self.json_data = apply_patch(self.json_data, patch, self.journal,
+                                     inverse, copy_values)
+        self.setUpdatesEnabled(False)
+        self._build_tree()
+        self.setUpdatesEnabled(True)
+        return inverse
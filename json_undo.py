@@ -0,0 +1,165 @@
+import collections
+import contextlib
+import sys
+
+from json_query import ValueAdapter
+
+
+# Bytes counted for a command besides the values it holds
+COMMAND_OVERHEAD = 256
+
+
+def estimate_size(node, adapter=None, limit=1000):
+    """Approximate bytes kept alive by holding a reference to `node`
+
+    At most `limit` nodes are visited, the size of larger subtrees is
+    extrapolated from the nodes seen and the children found so far, so
+    the estimate stays cheap for huge removed subtrees.
+
+    """
+
+    adapter = adapter or ValueAdapter()
+    size = 0
+    visited = 0
+    queue = collections.deque([node])
+    while queue and visited < limit:
+        node = queue.popleft()
+        visited += 1
+        size += sys.getsizeof(node)
+        if adapter.is_container(node):
+            queue.extend(child for _, child in adapter.children(node))
+        else:
+            size += sys.getsizeof(adapter.value(node))
+    if queue:
+        size = size * (visited + len(queue)) // visited
+    return size
+
+
+class UndoCommand(object):
+    __slots__ = ("text", "undo", "redo", "size")
+
+    def __init__(self, text, undo, redo, size):
+        self.text = text
+        self.undo = undo
+        self.redo = redo
+        self.size = size
+
+
+class UndoStack(object):
+    """Undo/redo history of inverse operations under a memory budget
+
+    An edit is pushed after it is done, as a pair of functions undoing
+    and redoing it. Values the functions need, such as removed subtrees,
+    are held by reference, `size` is the memory they keep alive. Once
+    the history holds more than `limit` bytes the oldest commands are
+    dropped.
+
+    Edits made while a command is undone or redone are not pushed.
+
+    """
+
+    DEFAULT_LIMIT = 64 * 1024 * 1024
+
+    def __init__(self, limit=DEFAULT_LIMIT):
+        self.limit = limit
+        self._undo = collections.deque()
+        self._redo = []
+        self._size = 0
+        self._replaying = False
+        self._group = None
+
+    def __len__(self):
+        return len(self._undo)
+
+    def memory(self):
+        return self._size
+
+    def clear(self):
+        self._undo.clear()
+        self._redo = []
+        self._size = 0
+
+    def can_undo(self):
+        return bool(self._undo)
+
+    def can_redo(self):
+        return bool(self._redo)
+
+    def undo_text(self):
+        return self._undo[-1].text if self._undo else None
+
+    def redo_text(self):
+        return self._redo[-1].text if self._redo else None
+
+    def push(self, text, undo, redo, size=0):
+        """Record an edit that was just done"""
+        if self._replaying:
+            return
+        command = UndoCommand(text, undo, redo, size + COMMAND_OVERHEAD)
+        if self._group is not None:
+            self._group.append(command)
+            return
+
+        for dropped in self._redo:
+            self._size -= dropped.size
+        self._redo = []
+        self._undo.append(command)
+        self._size += command.size
+        self._evict()
+
+    def _evict(self):
+        # The latest command is always kept, even above the limit
+        while self._size > self.limit and len(self._undo) > 1:
+            self._size -= self._undo.popleft().size
+
+    @contextlib.contextmanager
+    def group(self, text):
+        """Push the edits made inside the block as one command"""
+        if self._group is not None or self._replaying:
+            yield
+            return
+
+        self._group = commands = []
+        try:
+            yield
+        finally:
+            self._group = None
+
+        if not commands:
+            return
+
+        def undo():
+            for command in reversed(commands):
+                command.undo()
+
+        def redo():
+            for command in commands:
+                command.redo()
+
+        self.push(text, undo, redo,
+                  sum(command.size for command in commands))
+
+    def _replay(self, action):
+        self._replaying = True
+        try:
+            action()
+        finally:
+            self._replaying = False
+
+    def undo(self):
+        """Undo the latest command, returns its text or None"""
+        if not self._undo:
+            return None
+        command = self._undo.pop()
+        self._replay(command.undo)
+        self._redo.append(command)
+        return command.text
+
+    def redo(self):
+        if not self._redo:
+            return None
+        command = self._redo.pop()
+        self._replay(command.redo)
+        self._undo.append(command)
+        self._evict()
+        return command.text
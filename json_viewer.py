@@ -8,51 +8,141 @@ __author__ = "Ashwin Nanjappa"
 
 # Std
 import argparse
-import collections
-import json
+import os
 import sys
+import time
 
 # External
 from PyQt5 import QtCore
 from PyQt5 import QtGui
 from PyQt5 import QtWidgets
 
+# Local
+from json_compare import JsonDiffView
+from json_detail import ValueDetail
+from json_filter import JsonFilterProxy
+from json_index import QJsonIndexModel
+from json_loader import JsonLoadThread, LoadProgress
+from json_metrics import metrics
+from json_pool import JsonPoolLoader
+from json_search import SearchIndex
+from json_sort import JsonSortProxy
+from qjsonmodel import QJsonModel
+
 class TextToTreeItem:
 
-    def __init__(self):
-        self.text_list = []
-        self.titem_list = []
+    def __init__(self, model):
+        self.model = model
+        self.index = SearchIndex()
+
+    # Return ids of nodes whose key or value contains string
+    def find(self, find_str, keys=True, values=True, case_sensitive=True):
+
+        return self.index.find(find_str, keys, values, case_sensitive)
+
+    # Model index of a node, fetching the rows leading to it
+    def model_index(self, node):
+
+        return self.model.indexForPath(self.index.path(node))
+
+
+class SearchThread(QtCore.QThread):
+
+    # Ids of matching nodes, in document order
+    found = QtCore.pyqtSignal(list)
+    # False when cancelled
+    done = QtCore.pyqtSignal(bool)
+
+    batch_size = 256
+    batch_interval = 0.05
+
+    def __init__(self, index, find_str, find_opts, parent=None,
+                 within=None, key_tree=False):
+        """
+        Arguments:
+            within (list, optional): Matches of a search this one
+                narrows, see SearchIndex.iter_find
+            key_tree (bool, optional): Also build the key tree of the
+                matches once they are all found, to filter the tree by
+
+        """
+
+        super(SearchThread, self).__init__(parent)
+
+        self.index = index
+        self.find_str = find_str
+        self.find_opts = find_opts
+        self.within = within
+        self.build_tree = key_tree
+        # SearchIndex.key_tree of the matches, set before done
+        self.key_tree = None
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
 
-    def append(self, text_list, titem):
-        for text in text_list:
-            self.text_list.append(text)
-            self.titem_list.append(titem)
+    def run(self):
 
-    # Return model indices that match string
-    def find(self, find_str):
+        with metrics.timer("search"):
+            self.search()
 
-        titem_list = []
-        for i, s in enumerate(self.text_list):
-            if find_str in s:
-                titem_list.append(self.titem_list[i])
+    def search(self):
 
-        return titem_list
+        batch = []
+        last_emit = None
+        found = []
+        nodes = self.index.iter_find(self.find_str, *self.find_opts,
+                                     stop=lambda: self._cancelled,
+                                     within=self.within)
+
+        for node in nodes:
+            batch.append(node)
+            if self.build_tree:
+                found.append(node)
+
+            # First match goes out on its own so it can be shown at once
+            now = time.monotonic()
+            if (last_emit is None or len(batch) >= self.batch_size
+                    or now - last_emit >= self.batch_interval):
+                self.found.emit(batch)
+                batch = []
+                last_emit = now
+
+            if self._cancelled:
+                break
+
+        if batch and not self._cancelled:
+            self.found.emit(batch)
+        if self.build_tree and not self._cancelled:
+            self.key_tree = self.index.key_tree(found)
+        self.done.emit(not self._cancelled)
 
 
 class JsonView(QtWidgets.QWidget):
 
-    def __init__(self, fpath):
+    # Pause in typing before the tree is filtered, in ms
+    filter_delay = 250
+    # Matches whose parents are expanded once the tree is filtered
+    expand_matches = 100
+
+    def __init__(self, fpath, share_leaves=False):
         super(JsonView, self).__init__()
 
         self.find_box = None
-        self.tree_widget = None
-        self.text_to_titem = TextToTreeItem()
+        self.tree_view = None
+        self.model = QJsonModel()
+        self.text_to_titem = TextToTreeItem(self.model)
         self.find_str = ""
-        self.found_titem_list = []
+        self.find_opts = None
+        self.found_node_list = []
         self.found_idx = 0
-
-        jfile = open(fpath)
-        jdata = json.load(jfile, object_pairs_hook=collections.OrderedDict)
+        self.search_thread = None
+        # (find_str, find_opts, nodes indexed) of the last search that
+        # completed, the next one only checks its matches if it narrows
+        # it, see last_search
+        self.searched = None
+        # Nodes indexed when the running search started
+        self.search_size = 0
 
         # Find UI
 
@@ -60,46 +150,161 @@ class JsonView(QtWidgets.QWidget):
 
         # Tree
 
-        self.tree_widget = QtWidgets.QTreeWidget()
-        self.tree_widget.setHeaderLabels(["Key", "Value"])
-        self.tree_widget.header().setSectionResizeMode(QtWidgets.QHeaderView.Stretch)
-
-        root_item = QtWidgets.QTreeWidgetItem(["Root"])
-        self.recurse_jdata(jdata, root_item)
-        self.tree_widget.addTopLevelItem(root_item)
+        # Filtered then sorted on demand by the proxies, the model keeps
+        # every row in document order
+        self.filter_proxy = JsonFilterProxy(self)
+        self.filter_proxy.setSourceModel(self.model)
+        self.proxy = JsonSortProxy(self)
+        self.proxy.setSourceModel(self.filter_proxy)
+
+        self.tree_view = QtWidgets.QTreeView()
+        self.tree_view.setUniformRowHeights(True)
+        self.tree_view.setModel(self.proxy)
+        self.tree_view.setColumnHidden(2, True)
+        header = self.tree_view.header()
+        header.setSortIndicator(-1, QtCore.Qt.AscendingOrder)
+        header.sortIndicatorChanged.connect(
+            lambda column, order: self.order_box.setCurrentIndex(column + 1))
+        self.tree_view.setSortingEnabled(True)
+        self.tree_view.header().setSectionResizeMode(QtWidgets.QHeaderView.Stretch)
+
+        # Full text of the selected value, the tree only shows previews
+
+        self.value_detail = ValueDetail()
+        self.value_detail.watch(self.tree_view)
 
         # Add table to layout
 
+        splitter = QtWidgets.QSplitter()
+        splitter.addWidget(self.tree_view)
+        splitter.addWidget(self.value_detail)
+        splitter.setStretchFactor(0, 3)
+        splitter.setStretchFactor(1, 1)
+
         layout = QtWidgets.QHBoxLayout()
-        layout.addWidget(self.tree_widget)
+        layout.addWidget(splitter)
 
         # Group box
 
         gbox = QtWidgets.QGroupBox(fpath)
         gbox.setLayout(layout)
 
+        # Load progress
+
+        self.load_progress = LoadProgress()
+
         layout2 = QtWidgets.QVBoxLayout()
         layout2.addLayout(find_layout)
         layout2.addWidget(gbox)
+        layout2.addWidget(self.load_progress)
 
         self.setLayout(layout2)
 
+        # Parse and index in the background, rows are added as entries
+        # arrive and their children created when expanded
+
+        self.loader = JsonLoadThread(fpath, self, self.text_to_titem.index,
+                                     share_leaves=share_leaves)
+        self.loader.container_type.connect(self.start_document)
+        self.loader.batch_loaded.connect(self.model.appendEntries)
+        self.loader.done.connect(self.show_index_stats)
+        self.load_progress.track(self.loader)
+
+        # Time from now until the first rows are painted
+        if metrics.enabled:
+            metrics.start("first_paint")
+            self.tree_view.viewport().installEventFilter(self)
+
+        self.loader.start()
+
+    def eventFilter(self, obj, event):
+
+        if (event.type() == QtCore.QEvent.Paint
+                and self.model.rowCount() > 0):
+            obj.removeEventFilter(self)
+            # Stopped once the paint is done
+            QtCore.QTimer.singleShot(0, lambda: metrics.stop("first_paint"))
+        return False
+
+    def start_document(self, container_type):
+
+        self.model.beginStream(container_type)
+
+    def stop_loading(self):
+
+        self.stop_search()
+        self.loader.cancel()
+        self.loader.wait()
+
     def make_find_ui(self):
 
         # Text box
         self.find_box = QtWidgets.QLineEdit()
         self.find_box.returnPressed.connect(self.find_button_clicked)
 
+        # Search keys, values or both
+        self.find_in_box = QtWidgets.QComboBox()
+        self.find_in_box.addItems(["Keys and values", "Keys", "Values"])
+
+        self.match_case_box = QtWidgets.QCheckBox("Match case")
+        self.match_case_box.setChecked(True)
+
+        # Hide what does not lead to a match, while typing
+        self.filter_box = QtWidgets.QCheckBox("Filter")
+        self.filter_box.toggled.connect(self.filter_toggled)
+
+        self.filter_timer = QtCore.QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(self.filter_delay)
+        self.filter_timer.timeout.connect(self.update_filter)
+        self.find_box.textChanged.connect(self.schedule_filter)
+        self.find_in_box.currentIndexChanged.connect(self.schedule_filter)
+        self.match_case_box.toggled.connect(self.schedule_filter)
+
         # Find Button
         find_button = QtWidgets.QPushButton("Find")
         find_button.clicked.connect(self.find_button_clicked)
 
+        # Match counter
+        self.match_label = QtWidgets.QLabel()
+
+        # Row order, also set by clicking the headers
+        self.order_box = QtWidgets.QComboBox()
+        self.order_box.addItems(["Document order", "Sort by key",
+                                 "Sort by value", "Sort by type"])
+        self.order_box.activated.connect(
+            lambda i: self.tree_view.sortByColumn(i - 1,
+                                                  QtCore.Qt.AscendingOrder))
+
+        # Search index size
+        self.index_label = QtWidgets.QLabel()
+
         layout = QtWidgets.QHBoxLayout()
         layout.addWidget(self.find_box)
+        layout.addWidget(self.find_in_box)
+        layout.addWidget(self.match_case_box)
+        layout.addWidget(self.filter_box)
         layout.addWidget(find_button)
+        layout.addWidget(self.match_label)
+        layout.addWidget(self.index_label)
+        layout.addStretch()
+        layout.addWidget(self.order_box)
 
         return layout
 
+    def find_options(self):
+
+        find_in = self.find_in_box.currentIndex()
+        keys = find_in in (0, 1)
+        values = find_in in (0, 2)
+        return keys, values, self.match_case_box.isChecked()
+
+    def show_index_stats(self):
+
+        stats = self.text_to_titem.index.stats()
+        self.index_label.setText("Index: %.1f MB, built in %.2f s"
+                                 % (stats["memory"] / 1e6, stats["build_time"]))
+
     def find_button_clicked(self):
 
         find_str = self.find_box.text()
@@ -108,68 +313,391 @@ class JsonView(QtWidgets.QWidget):
         if find_str == "":
             return
 
-        # New search string
-        if find_str != self.find_str:
+        # New search string or options
+        find_opts = self.find_options()
+        if find_str != self.find_str or find_opts != self.find_opts:
             self.find_str = find_str
-            self.found_titem_list = self.text_to_titem.find(self.find_str)
-            self.found_idx = 0
-        else:
-            item_num = len(self.found_titem_list)
+            self.find_opts = find_opts
+            self.start_search()
+            return
+
+        # Find next, also while the search is still running
+        item_num = len(self.found_node_list)
+        if item_num:
             self.found_idx = (self.found_idx + 1) % item_num
+            self.select_node(self.found_node_list[self.found_idx])
+        self.update_match_label()
+
+    def view_index(self, node):
 
-        self.tree_widget.setCurrentItem(self.found_titem_list[self.found_idx])
+        index = self.text_to_titem.model_index(node)
+        return self.proxy.mapFromSource(self.filter_proxy.mapFromSource(index))
 
+    def select_node(self, node):
 
-    def recurse_jdata(self, jdata, tree_widget):
+        index = self.view_index(node)
+        if index.isValid():
+            self.tree_view.setCurrentIndex(index)
+            self.tree_view.scrollTo(index)
 
-        if isinstance(jdata, dict):
-            for key, val in jdata.items():
-                self.tree_add_row(key, val, tree_widget)
-        elif isinstance(jdata, list):
-            for i, val in enumerate(jdata):
-                key = str(i)
-                self.tree_add_row(key, val, tree_widget)
-        else:
-            print("This should never be reached!")
+    def schedule_filter(self):
 
-    def tree_add_row(self, key, val, tree_widget):
+        # Restarted by every key, filters once typing pauses
+        if self.filter_box.isChecked():
+            self.filter_timer.start()
 
-        text_list = []
+    def filter_toggled(self, checked):
 
-        if isinstance(val, dict) or isinstance(val, list):
-            text_list.append(key)
-            row_item = QtWidgets.QTreeWidgetItem([key])
-            self.recurse_jdata(val, row_item)
-        else:
-            text_list.append(key)
-            text_list.append(str(val))
-            row_item = QtWidgets.QTreeWidgetItem([key, str(val)])
+        self.filter_timer.stop()
+        if checked:
+            self.update_filter()
+            return
+
+        self.filter_proxy.setFilter(None)
+        current = self.tree_view.currentIndex()
+        if current.isValid():
+            self.tree_view.scrollTo(current)
 
-        tree_widget.addChild(row_item)
-        self.text_to_titem.append(text_list, row_item)
+    def update_filter(self):
+
+        if not self.filter_box.isChecked():
+            return
+
+        find_str = self.find_box.text()
+        find_opts = self.find_options()
+        if find_str == "":
+            self.stop_search()
+            self.find_str = ""
+            self.find_opts = None
+            self.searched = None
+            self.found_node_list = []
+            self.found_idx = 0
+            self.filter_proxy.setFilter(None)
+            self.update_match_label()
+            return
+
+        if (find_str, find_opts) == self.last_search():
+            # Found already, e.g. by Find before filtering
+            self.apply_filter(
+                self.text_to_titem.index.key_tree(self.found_node_list))
+        elif ((find_str, find_opts) != (self.find_str, self.find_opts)
+                or self.search_thread is None):
+            self.find_str = find_str
+            self.find_opts = find_opts
+            self.start_search()
+
+    def apply_filter(self, key_tree):
+
+        self.filter_proxy.setFilter(key_tree)
+
+        # Open the way to the first matches
+        expanded = set()
+        for node in self.found_node_list[:self.expand_matches]:
+            parent = self.view_index(node).parent()
+            while parent.isValid() and parent not in expanded:
+                expanded.add(parent)
+                self.tree_view.expand(parent)
+                parent = parent.parent()
+
+        if self.found_node_list:
+            self.select_node(self.found_node_list[self.found_idx])
+
+    def start_search(self):
+
+        # Typing on only narrows the last search, its matches are the
+        # only candidates
+        within = None
+        searched = self.last_search()
+        if searched is not None:
+            find_str, find_opts = searched
+            if (find_opts == self.find_opts
+                    and SearchIndex.narrows(self.find_str, find_str,
+                                            find_opts[2])):
+                within = self.found_node_list
+
+        self.stop_search()
+
+        self.searched = None
+        self.found_node_list = []
+        self.found_idx = 0
+
+        self.search_size = len(self.text_to_titem.index)
+        self.search_thread = SearchThread(
+            self.text_to_titem.index, self.find_str, self.find_opts, self,
+            within=within, key_tree=self.filter_box.isChecked())
+        self.search_thread.found.connect(self.search_found)
+        self.search_thread.done.connect(self.search_done)
+        self.search_thread.start()
+        self.update_match_label()
+
+    def last_search(self):
+        """(find_str, find_opts) of the last completed search, None if
+        nodes were indexed since it started, it may have missed them"""
+        if self.searched is None:
+            return None
+        find_str, find_opts, size = self.searched
+        if size != len(self.text_to_titem.index):
+            return None
+        return find_str, find_opts
+
+    def stop_search(self):
+
+        if self.search_thread is not None:
+            self.search_thread.cancel()
+            self.search_thread.wait()
+            self.search_thread = None
+
+    def search_found(self, nodes):
+
+        # Ignore batches still queued from a cancelled search
+        if self.sender() is not self.search_thread:
+            return
+
+        first = not self.found_node_list
+        self.found_node_list.extend(nodes)
+
+        if first and self.found_node_list:
+            self.select_node(self.found_node_list[0])
+        self.update_match_label()
+
+    def search_done(self, completed):
+
+        thread = self.sender()
+        if thread is not self.search_thread:
+            return
+
+        self.search_thread = None
+        if completed:
+            self.searched = (self.find_str, self.find_opts, self.search_size)
+            if self.filter_box.isChecked():
+                key_tree = thread.key_tree
+                if key_tree is None:
+                    # Started before filtering was turned on
+                    key_tree = self.text_to_titem.index.key_tree(
+                        self.found_node_list)
+                self.apply_filter(key_tree)
+        self.update_match_label()
+
+    def update_match_label(self):
+
+        item_num = len(self.found_node_list)
+        current = self.found_idx + 1 if item_num else 0
+        running = "+" if self.search_thread is not None else ""
+        self.match_label.setText("%d / %d%s" % (current, item_num, running))
+
+
+class StatsPanel(QtWidgets.QPlainTextEdit):
+
+    refresh_interval = 1000
+
+    def __init__(self, parent=None):
+        super(StatsPanel, self).__init__(parent)
+
+        self.setReadOnly(True)
+        self.setLineWrapMode(QtWidgets.QPlainTextEdit.NoWrap)
+        self.setFont(QtGui.QFontDatabase.systemFont(
+            QtGui.QFontDatabase.FixedFont))
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(self.refresh_interval)
+        self.timer.timeout.connect(self.refresh)
+
+    def showEvent(self, e):
+        self.refresh()
+        self.timer.start()
+        super(StatsPanel, self).showEvent(e)
+
+    def hideEvent(self, e):
+        self.timer.stop()
+        super(StatsPanel, self).hideEvent(e)
+
+    def refresh(self):
+        self.setPlainText(metrics.report() or "No metrics yet")
 
 
 class JsonViewer(QtWidgets.QMainWindow):
 
-    def __init__(self):
+    def __init__(self, fpath="test.json", share_leaves=False):
         super(JsonViewer, self).__init__()
 
-        fpath = "test.json"
-        json_view = JsonView(fpath)
+        self.json_view = JsonView(fpath, share_leaves)
+
+        self.setCentralWidget(self.json_view)
+
+        # Metrics, toggled with F12
+        self.stats_dock = QtWidgets.QDockWidget("Stats", self)
+        self.stats_dock.setWidget(StatsPanel())
+        self.stats_dock.hide()
+        self.addDockWidget(QtCore.Qt.BottomDockWidgetArea, self.stats_dock)
 
-        self.setCentralWidget(json_view)
         self.setWindowTitle("JSON Viewer")
         self.show()
 
+    def closeEvent(self, e):
+        self.json_view.stop_loading()
+        super(JsonViewer, self).closeEvent(e)
+
     def keyPressEvent(self, e):
         if e.key() == QtCore.Qt.Key_Escape:
             self.close()
+        elif e.key() == QtCore.Qt.Key_F12:
+            # Counting starts when the panel is first shown
+            metrics.enable()
+            self.stats_dock.setVisible(not self.stats_dock.isVisible())
+
 
+class MultiJsonViewer(QtWidgets.QMainWindow):
+    """Several files in tabs, indexed in parallel by worker processes
 
-def main():
-    qt_app = QtWidgets.QApplication(sys.argv)
-    json_viewer = JsonViewer()
-    sys.exit(qt_app.exec_())
+    Tabs are read-only views over the offset index of each file.
+
+    """
+
+    def __init__(self, fpaths):
+        super(MultiJsonViewer, self).__init__()
+
+        self.fpaths = fpaths
+        self.failed = []
+
+        self.tabs = QtWidgets.QTabWidget()
+        self.tabs.setDocumentMode(True)
+        self.setCentralWidget(self.tabs)
+
+        self.status_label = QtWidgets.QLabel()
+        self.statusBar().addWidget(self.status_label, 1)
+
+        self.stats_dock = QtWidgets.QDockWidget("Stats", self)
+        self.stats_dock.setWidget(StatsPanel())
+        self.stats_dock.hide()
+        self.addDockWidget(QtCore.Qt.BottomDockWidgetArea, self.stats_dock)
+
+        self.start = time.perf_counter()
+        metrics.start("pool_load")
+        self.loader = JsonPoolLoader(self)
+        self.loader.loaded.connect(self.on_loaded)
+        self.loader.failed.connect(self.on_failed)
+        self.loader.done.connect(self.on_done)
+        self.loader.load(fpaths)
+        self.update_status()
+
+        self.setWindowTitle("JSON Viewer")
+        self.show()
+
+    def on_loaded(self, fpath, index):
+        tree_view = QtWidgets.QTreeView()
+        proxy = JsonSortProxy(tree_view)
+        proxy.setSourceModel(QJsonIndexModel(index, proxy))
+        tree_view.setModel(proxy)
+        tree_view.header().resizeSection(0, 200)
+        tree_view.header().setSortIndicator(-1, QtCore.Qt.AscendingOrder)
+        tree_view.setSortingEnabled(True)
+
+        value_detail = ValueDetail()
+        value_detail.watch(tree_view)
+
+        splitter = QtWidgets.QSplitter(QtCore.Qt.Vertical)
+        splitter.addWidget(tree_view)
+        splitter.addWidget(value_detail)
+        splitter.setStretchFactor(0, 3)
+        splitter.setStretchFactor(1, 1)
+
+        # Tabs keep the order of the command line, not of completion
+        order = self.fpaths.index(fpath)
+        pos = sum(1 for i in range(self.tabs.count())
+                  if self.fpaths.index(self.tabs.tabToolTip(i)) < order)
+        tab = self.tabs.insertTab(pos, splitter, os.path.basename(fpath))
+        self.tabs.setTabToolTip(tab, fpath)
+        self.update_status()
+
+    def on_failed(self, fpath, message):
+        self.failed.append(fpath)
+        QtWidgets.QMessageBox.warning(self, "Load failed",
+                                      "%s\n%s" % (fpath, message))
+        self.update_status()
+
+    def on_done(self):
+        metrics.stop("pool_load")
+        self.update_status()
+
+    def update_status(self):
+        done = self.tabs.count() + len(self.failed)
+        text = "%d / %d files" % (done, len(self.fpaths))
+        if self.failed:
+            text += ", %d failed" % len(self.failed)
+        if done == len(self.fpaths):
+            text += " in %.2f s" % (time.perf_counter() - self.start)
+        self.status_label.setText(text)
+
+    def closeEvent(self, e):
+        self.loader.shutdown()
+        super(MultiJsonViewer, self).closeEvent(e)
+
+    def keyPressEvent(self, e):
+        if e.key() == QtCore.Qt.Key_Escape:
+            self.close()
+        elif e.key() == QtCore.Qt.Key_F12:
+            metrics.enable()
+            self.stats_dock.setVisible(not self.stats_dock.isVisible())
+
+
+class JsonDiffViewer(QtWidgets.QMainWindow):
+    """Two files compared side by side"""
+
+    def __init__(self, old_fpath, new_fpath):
+        super(JsonDiffViewer, self).__init__()
+
+        self.diff_view = JsonDiffView(old_fpath, new_fpath)
+        self.setCentralWidget(self.diff_view)
+
+        self.stats_dock = QtWidgets.QDockWidget("Stats", self)
+        self.stats_dock.setWidget(StatsPanel())
+        self.stats_dock.hide()
+        self.addDockWidget(QtCore.Qt.BottomDockWidgetArea, self.stats_dock)
+
+        self.setWindowTitle("JSON Diff")
+        self.show()
+
+    def closeEvent(self, e):
+        self.diff_view.stop_loading()
+        super(JsonDiffViewer, self).closeEvent(e)
+
+    def keyPressEvent(self, e):
+        if e.key() == QtCore.Qt.Key_Escape:
+            self.close()
+        elif e.key() == QtCore.Qt.Key_F12:
+            metrics.enable()
+            self.stats_dock.setVisible(not self.stats_dock.isVisible())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="View a JSON file as a tree")
+    parser.add_argument("fpaths", nargs="*", metavar="fpath",
+                        help="JSON files, several open in tabs")
+    parser.add_argument("--diff", nargs=2, metavar=("OLD", "NEW"),
+                        help="compare two files side by side")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="record timings and call counts to FILE")
+    parser.add_argument("--share-leaves", action="store_true",
+                        help="hold equal objects and arrays of scalars "
+                             "once, less memory for a slower load")
+    args = parser.parse_args(argv)
+
+    if args.metrics:
+        metrics.enable()
+
+    qt_app = QtWidgets.QApplication(sys.argv[:1])
+    if args.diff:
+        json_viewer = JsonDiffViewer(*args.diff)
+    elif len(args.fpaths) > 1:
+        json_viewer = MultiJsonViewer(args.fpaths)
+    else:
+        json_viewer = JsonViewer(*args.fpaths,
+                                 share_leaves=args.share_leaves)
+    status = qt_app.exec_()
+
+    if args.metrics:
+        metrics.dump(args.metrics)
+    sys.exit(status)
 
 
 if "__main__" == __name__:
@@ -0,0 +1,211 @@
+import os
+import shutil
+import tempfile
+from json.encoder import encode_basestring, encode_basestring_ascii
+
+from json_query import ValueAdapter
+
+
+# Read once, os.umask can only be queried by setting it
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+INFINITY = float("inf")
+
+
+def _encode_float(value):
+    # Same spelling as json.dumps with allow_nan
+    if value != value:
+        return "NaN"
+    if value == INFINITY:
+        return "Infinity"
+    if value == -INFINITY:
+        return "-Infinity"
+    return float.__repr__(value)
+
+
+def _encode_scalar(value, encode_str):
+    if isinstance(value, str):
+        return encode_str(value)
+    if value is None:
+        return "null"
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    if isinstance(value, int):
+        return int.__repr__(value)
+    if isinstance(value, float):
+        return _encode_float(value)
+    raise TypeError("Object of type %s is not JSON serializable"
+                    % type(value).__name__)
+
+
+def _encode_key(key, encode_str):
+    # Dict keys are always strings in JSON, converted in json.dump's
+    # order so True is "true" rather than the int "1" or "True"
+    if isinstance(key, str):
+        return encode_str(key)
+    if isinstance(key, float):
+        return '"%s"' % _encode_float(key)
+    if key is True:
+        return '"true"'
+    if key is False:
+        return '"false"'
+    if key is None:
+        return '"null"'
+    if isinstance(key, int):
+        return '"%s"' % int.__repr__(key)
+    raise TypeError("Keys must be str, int, float, bool or None, not %s"
+                    % type(key).__name__)
+
+
+class JsonWriter(object):
+    """Iterative JSON serializer over any tree a ValueAdapter can walk
+
+    The document is written as it is walked, with one frame per open
+    container, so neither a copy of the document nor the whole output
+    text is ever held in memory and deep documents cannot hit the
+    recursion limit. Output matches json.dump with the same `indent` and
+    `separators`.
+
+    """
+
+    # Pieces joined into one chunk before it is handed out
+    CHUNK_PARTS = 4096
+
+    def __init__(self, adapter=None, indent=None, ensure_ascii=True,
+                 separators=None):
+        self.adapter = adapter or ValueAdapter()
+        if indent is not None and not isinstance(indent, str):
+            indent = " " * indent
+        self.indent = indent
+        self.ensure_ascii = ensure_ascii
+        # (item separator, key separator), json.dump's defaults
+        if separators is None:
+            separators = ("," if indent is not None else ", "), ": "
+        self.separators = separators
+
+        # Updated while iterencode runs, read by progress reports
+        self.nodes = 0
+        # Whether the last iterencode was ended early by `stop`
+        self.stopped = False
+
+    def iterencode(self, root, stop=None):
+        """Yield the JSON text of `root` in chunks
+
+        Arguments:
+            root: Document root node
+            stop (callable, optional): Polled between chunks, writing
+                ends early once it returns True
+
+        """
+
+        adapter = self.adapter
+        encode_str = (encode_basestring_ascii if self.ensure_ascii
+                      else encode_basestring)
+        indent = self.indent
+        item_separator, key_separator = self.separators
+        newlines = ["\n"]
+
+        parts = []
+        # [children iterator, is dict, children written]
+        stack = []
+
+        def open_node(node):
+            if adapter.is_dict(node):
+                parts.append("{")
+                stack.append([iter(adapter.children(node)), True, 0])
+            elif adapter.is_list(node):
+                parts.append("[")
+                stack.append([iter(adapter.children(node)), False, 0])
+            else:
+                parts.append(_encode_scalar(adapter.value(node), encode_str))
+
+        self.nodes = 1
+        self.stopped = False
+        open_node(root)
+        while stack:
+            frame = stack[-1]
+            entry = next(frame[0], None)
+            if entry is None:
+                stack.pop()
+                if frame[2] and indent is not None:
+                    parts.append(newlines[len(stack)])
+                parts.append("}" if frame[1] else "]")
+                continue
+
+            if frame[2]:
+                parts.append(item_separator)
+            frame[2] += 1
+            if indent is not None:
+                depth = len(stack)
+                while len(newlines) <= depth:
+                    newlines.append("\n" + indent * len(newlines))
+                parts.append(newlines[depth])
+
+            key, child = entry
+            if frame[1]:
+                parts.append(_encode_key(key, encode_str))
+                parts.append(key_separator)
+            open_node(child)
+            self.nodes += 1
+
+            if len(parts) >= self.CHUNK_PARTS:
+                yield "".join(parts)
+                parts.clear()
+                if stop is not None and stop():
+                    self.stopped = True
+                    return
+
+        yield "".join(parts)
+
+    def dump(self, root, fp, stop=None):
+        """Write `root` to a text file object
+
+        Returns:
+            False if `stop` ended the write early
+
+        """
+
+        for chunk in self.iterencode(root, stop):
+            fp.write(chunk)
+        # Not stop() again, a stop after the last chunk is too late
+        return not self.stopped
+
+    def save(self, root, fpath, stop=None):
+        """Write `root` to `fpath` atomically
+
+        The document goes to a temporary file next to `fpath` which
+        replaces it once complete, a failed or stopped save leaves the
+        previous file untouched.
+
+        Returns:
+            False if `stop` ended the write early
+
+        """
+
+        fpath = os.path.abspath(fpath)
+        fd, tmp_path = tempfile.mkstemp(
+            prefix="." + os.path.basename(fpath) + ".",
+            suffix=".tmp", dir=os.path.dirname(fpath))
+        try:
+            with open(fd, "w", encoding="utf-8",
+                      buffering=1 << 20) as fp:
+                if not self.dump(root, fp, stop):
+                    os.remove(tmp_path)
+                    return False
+                fp.flush()
+                os.fsync(fp.fileno())
+
+            # mkstemp creates the file private to the user
+            if os.path.exists(fpath):
+                shutil.copymode(fpath, tmp_path)
+            else:
+                os.chmod(tmp_path, 0o666 & ~_UMASK)
+            os.replace(tmp_path, fpath)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return True
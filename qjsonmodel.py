@@ -1,29 +1,83 @@
 
-import json
-import collections
+import itertools
+import os
+import sys
 
 from PyQt5 import QtWidgets, QtCore
 from PyQt5.QtGui import *
 from PyQt5.QtCore import *
 from PyQt5.QtWidgets import *
 from ui_res.json_win import Ui_MainWindow
+from json_loader import JsonLoadThread, JsonSaveThread, LoadProgress
+from json_metrics import metrics
+from json_detail import ValueDetail
+from json_index import (JsonIndexThread, QJsonIndexModel, SortRole,
+                        ValueRole, sort_key, type_label)
+from json_patch import (Journal, PatchError, check_patch, list_index,
+                        load_patch, split_pointer)
+from json_query import QueryError, ValueAdapter, compile_query, keys_to_pointer
+from json_text import display_text
+from json_undo import UndoStack, estimate_size
 
 
 class QJsonTreeItem(object):
+    # Items are created for every viewed node, keep them compact
+    __slots__ = (
+        "_parent", "_key", "_value", "_type",
+        "_children", "_source", "_fetched", "_row",
+    )
+
     def __init__(self, parent=None):
         self._parent = parent
 
-        self._key = ""
+        # None for list elements, see key
+        self._key = None
         self._value = ""
         self._type = None
-        self._children = list()
+        # Leaves share the empty tuple, a list is only allocated on the
+        # first appendChild/insertChild
+        self._children = ()
+        # Raw dict/list whose children have not all been turned into
+        # items yet, see canFetchMore/fetchMore
+        self._source = None
+        # Entries of _source already turned into items. Kept apart from
+        # childCount() so that adding or removing items does not shift
+        # the entries still pending
+        self._fetched = 0
+        # Position in the parent's children when last checked. Insert and
+        # remove leave later siblings stale, row() renumbers them once on
+        # demand so a run of edits near the front of a long list stays
+        # linear
+        self._row = 0
 
     def appendChild(self, item):
+        if not self._children:
+            self._children = list()
+        item._row = len(self._children)
         self._children.append(item)
-    
-    def removeChild(self, child):
-        if child in self._children:
-            self._children.remove(child)
+
+    def insertChild(self, row, item):
+        if not self._children:
+            self._children = list()
+        item._row = row
+        self._children.insert(row, item)
+
+    def removeChild(self, child, row=None):
+        if row is None:
+            row = child.row()
+        children = self._children
+        if (child._parent is not self or not children
+                or row >= len(children) or children[row] is not child):
+            return
+        del children[row]
+
+    def replaceChild(self, row, item):
+        item._row = row
+        self._children[row] = item
+
+    def _renumber(self):
+        for row, child in enumerate(self._children):
+            child._row = row
 
     def child(self, row):
         return self._children[row]
@@ -34,14 +88,157 @@ class QJsonTreeItem(object):
     def childCount(self):
         return len(self._children)
 
-    def row(self):
+    def hasChildren(self):
+        return bool(self._children) or self.canFetchMore()
+
+    def canFetchMore(self):
         return (
-            self._parent._children.index(self)
-            if self._parent else 0
+            self._source is not None
+            and self._fetched < len(self._source)
         )
 
+    def pendingCount(self):
+        """Number of raw children not materialized yet"""
+        if self._source is None:
+            return 0
+        return len(self._source) - self._fetched
+
+    def fetchMore(self, count=None):
+        """Materialize up to `count` more children from the raw source
+
+        Children keep document order, views sort them through a
+        json_sort.JsonSortProxy.
+
+        Arguments:
+            count (int, optional): Number of children to create,
+                defaults to all remaining children
+
+        Returns:
+            number of children created
+
+        """
+
+        if not self.canFetchMore():
+            return 0
+
+        if isinstance(self._source, dict):
+            # Freeze the dict order once so that batches line up
+            items = self._source.items()
+            self._source = list(items)
+
+        start = self._fetched
+        stop = len(self._source)
+        if count is not None:
+            stop = min(stop, start + count)
+
+        if self._type is dict:
+            entries = self._source[start:stop]
+        else:
+            entries = zip(itertools.repeat(None), self._source[start:stop])
+
+        # Same items as appendValue, without the per-item calls, since
+        # a bucket far down a large array creates all rows before it
+        if not self._children:
+            self._children = []
+        children = self._children
+        row = len(children)
+        for key, value in entries:
+            child = QJsonTreeItem(self)
+            child._key = key
+            child._type = type(value)
+            if isinstance(value, (dict, list)):
+                if value:
+                    child._source = value
+            else:
+                child._value = value
+            child._row = row
+            row += 1
+            children.append(child)
+
+        if stop == len(self._source):
+            self._source = None
+            self._fetched = 0
+        else:
+            self._fetched = stop
+
+        return stop - start
+
+    def makeChild(self, key, value):
+        """Create, without adding it, a child item for a raw value
+
+        List children are given no key, it is derived from their row.
+
+        """
+
+        child = self.load(value, self)
+        child.key = key
+        child.type = type(value)
+        return child
+
+    def appendValue(self, key, value):
+        """Append a child item for a raw value"""
+        child = self.makeChild(key, value)
+        self.appendChild(child)
+        return child
+
+    def extendSource(self, values):
+        """Queue more raw children behind the existing ones
+
+        Used while a document is streamed in, `values` are (key, value)
+        pairs for dicts and plain values for lists.
+
+        """
+
+        if self._source is None:
+            self._source = []
+            self._fetched = 0
+        elif isinstance(self._source, dict):
+            self._source = list(self._source.items())
+        self._source.extend(values)
+
+    def fetchAll(self):
+        return self.fetchMore()
+
+    def pendingItems(self):
+        """Yield (key, value) pairs not materialized as items yet"""
+        if self._source is None:
+            return
+        start = self._fetched
+        if isinstance(self._source, dict):
+            yield from self._source.items()
+        elif self._type is dict:
+            yield from itertools.islice(self._source, start, None)
+        else:
+            yield from enumerate(
+                itertools.islice(self._source, start, None),
+                len(self._children))
+
+    def row(self):
+        parent = self._parent
+        if parent is None:
+            return 0
+        row = self._row
+        children = parent._children
+        if (children and (row >= len(children)
+                          or children[row] is not self)):
+            parent._renumber()
+            row = self._row
+        return row
+
+    def keys(self):
+        """Dict keys and list indices leading from the root to this item"""
+        keys = []
+        item = self
+        while item._parent is not None:
+            keys.append(item._key if item._key is not None else item.row())
+            item = item._parent
+        keys.reverse()
+        return keys
+
     @property
     def key(self):
+        if self._key is None:
+            return str(self.row())
         return self._key
 
     @key.setter
@@ -75,35 +272,38 @@ class QJsonTreeItem(object):
         return True
     
     def addIntField(self):
+        self.fetchAll()
         newItem = QJsonTreeItem(self)
-        newItem.key = "New Key"
-        newItem.type = type(int)
+        if self._type is dict:
+            # Keys must stay unique for the item to have a JSON path
+            taken = {child.key for child in self._children}
+            key = "New Key"
+            n = 1
+            while key in taken:
+                n += 1
+                key = "New Key %d" % n
+            newItem.key = key
+        newItem.type = int
         newItem.value = 0
         self.appendChild(newItem)
+        return newItem
 
     @classmethod
-    def load(self, value, parent=None, sort=True):
+    def load(self, value, parent=None):
+        """Create the item for `value` without its children
+
+        Children of a dict or list are created on demand by fetchMore,
+        so the cost of loading only grows with what has been viewed.
+
+        """
+
         rootItem = QJsonTreeItem(parent)
         rootItem.key = "root"
 
-        if isinstance(value, dict):
-            items = (
-                sorted(value.items())
-                if sort else value.items()
-            )
-
-            for key, value in items:
-                child = self.load(value, rootItem)
-                child.key = key
-                child.type = type(value)
-                rootItem.appendChild(child)
-
-        elif isinstance(value, list):
-            for index, value in enumerate(value):
-                child = self.load(value, rootItem)
-                child.key = str(index)
-                child.type = type(value)
-                rootItem.appendChild(child)
+        if isinstance(value, (dict, list)):
+            rootItem.type = type(value)
+            if value:
+                rootItem._source = value
 
         else:
             rootItem.value = value
@@ -112,19 +312,179 @@ class QJsonTreeItem(object):
         return rootItem
 
 
+class QJsonBucket(object):
+    """Virtual row grouping a range of the children of a large container
+
+    Buckets are nested: `size` is a power of the model's bucket size,
+    a bucket holds sub-buckets until it is as small as the bucket size
+    and then holds the child items of rows start to start + size.
+
+    """
+
+    __slots__ = ("item", "start", "size", "parent", "row")
+
+    def __init__(self, item, start, size, parent, row):
+        self.item = item
+        self.start = start
+        self.size = size
+        # Enclosing bucket, None for the top level under `item`
+        self.parent = parent
+        # Position under the parent bucket or item
+        self.row = row
+
+    def stop(self):
+        # The last bucket of a streamed root grows as entries arrive
+        return min(self.start + self.size,
+                   self.item.childCount() + self.item.pendingCount())
+
+    def label(self):
+        return "[%d \u2026 %d]" % (self.start, self.stop() - 1)
+
+
+def _within(item, ancestor):
+    """Whether `item` is `ancestor` or one of its descendants"""
+    while item is not None:
+        if item is ancestor:
+            return True
+        item = item._parent
+    return False
+
+
+def _attachItem(parent, row, child, key, replace=False):
+    child._parent = parent
+    child._key = key
+    if replace:
+        parent.replaceChild(row, child)
+    else:
+        parent.insertChild(row, child)
+
+
+class QJsonModelAdapter(ValueAdapter):
+    """Lets json_query walk a QJsonTreeItem tree
+
+    Materialized children are visited as items, branches that were never
+    expanded are read straight from the raw document so a query does not
+    create any item.
+
+    """
+
+    def is_dict(self, node):
+        if isinstance(node, QJsonTreeItem):
+            return node.type is dict
+        return isinstance(node, dict)
+
+    def is_list(self, node):
+        if isinstance(node, QJsonTreeItem):
+            return node.type in (list, tuple)
+        return isinstance(node, list)
+
+    def count(self, node):
+        if isinstance(node, QJsonTreeItem):
+            return node.childCount() + node.pendingCount()
+        return len(node)
+
+    def children(self, node):
+        if not isinstance(node, QJsonTreeItem):
+            yield from super(QJsonModelAdapter, self).children(node)
+            return
+
+        is_dict = node.type is dict
+        for row in range(node.childCount()):
+            child = node.child(row)
+            yield (child.key if is_dict else row), child
+        yield from node.pendingItems()
+
+    def child(self, node, key):
+        if not isinstance(node, QJsonTreeItem):
+            return super(QJsonModelAdapter, self).child(node, key)
+
+        if node.type is dict:
+            for row in range(node.childCount()):
+                child = node.child(row)
+                if child.key == key:
+                    return True, child
+            if isinstance(node._source, dict):
+                return super(QJsonModelAdapter, self).child(node._source, key)
+            for pending_key, value in node.pendingItems():
+                if pending_key == key:
+                    return True, value
+            return False, None
+
+        if not isinstance(key, int) or not 0 <= key < self.count(node):
+            return False, None
+        if key < node.childCount():
+            return True, node.child(key)
+        # Pending elements follow the items in the raw list
+        return True, node._source[node._fetched + key - node.childCount()]
+
+    def value(self, node):
+        if isinstance(node, QJsonTreeItem):
+            return node.value
+        return node
+
+
 class QJsonModel(QAbstractItemModel):
-    def __init__(self, parent=None):
+    # Rows created per fetchMore call when a branch is expanded or
+    # scrolled to its end
+    FETCH_BATCH = 1000
+    # Items whose display texts are cached
+    DISPLAY_CACHE_SIZE = 4096
+    # Containers with more children are shown as nested ranges of rows
+    BUCKET_SIZE = 1000
+
+    def __init__(self, parent=None, undo_limit=UndoStack.DEFAULT_LIMIT,
+                 bucket_size=BUCKET_SIZE, bucket_dicts=False):
+        """
+        Arguments:
+            undo_limit (int, optional): Memory held by the undo history
+            bucket_size (int, optional): Children shown under one parent
+                before they are grouped into QJsonBucket rows, 0 to
+                never group them
+            bucket_dicts (bool, optional): Group dict members as well,
+                not only array elements
+
+        """
+
         super(QJsonModel, self).__init__(parent)
 
         self._rootItem = QJsonTreeItem()
         self._headers = ("key", "value", "type")
+        self._frozen = False
+        # Edits since the document was loaded, as JSON Patch
+        self.journal = Journal()
+        self.undo_stack = UndoStack(undo_limit)
+
+        # item -> (key text, value text). List keys follow the row, so
+        # any change of rows drops it all
+        self._display = {}
+        for signal in (self.rowsInserted, self.rowsRemoved,
+                       self.modelReset, self.layoutChanged):
+            signal.connect(self._display.clear)
+
+        self._bucketSize = bucket_size
+        self._bucketDicts = bucket_dicts
+        # (item, start, size) -> QJsonBucket, indexes only hold a raw
+        # pointer so buckets are kept until the next reset
+        self._buckets = {}
+        self.modelReset.connect(self._buckets.clear)
 
     def getRoot(self):
         return self._rootItem
 
+    def setFrozen(self, frozen):
+        """Stop fetching and editing rows, e.g. while the document is
+        walked from another thread by a JsonSaveThread"""
+        self._frozen = frozen
+
+    def isFrozen(self):
+        return self._frozen
+
     def load(self, document):
         """Load from dictionary
 
+        Only the top-level item is created here, deeper items are
+        materialized as branches get expanded.
+
         Arguments:
             document (dict): JSON-compatible dictionary
 
@@ -135,14 +495,77 @@ class QJsonModel(QAbstractItemModel):
             "not %s" % type(document)
         )
 
+        with metrics.timer("build"):
+            self.beginResetModel()
+
+            self._rootItem = QJsonTreeItem.load(list(document)
+                                                if isinstance(document, tuple)
+                                                else document)
+            self._rootItem.type = type(document)
+            self._rootItem.fetchMore(self.FETCH_BATCH)
+            self.journal.clear()
+            self.undo_stack.clear()
+
+            self.endResetModel()
+
+        return True
+
+    def beginStream(self, container_type):
+        """Reset to an empty document filled through appendEntries
+
+        Arguments:
+            container_type (type): dict or list
+
+        """
+
         self.beginResetModel()
 
-        self._rootItem = QJsonTreeItem.load(document)
-        self._rootItem.type = type(document)
+        self._rootItem = QJsonTreeItem.load(container_type())
+        self.journal.clear()
+        self.undo_stack.clear()
 
         self.endResetModel()
 
-        return True
+    def appendEntries(self, entries):
+        """Append top-level (key, value) entries of a streamed document
+
+        Entries are queued on the root item, rows for them are created
+        through fetchMore like for any other branch.
+
+        """
+        if not entries:
+            return
+
+        with metrics.timer("build"):
+            root = self._rootItem
+            total = self._childTotal(root)
+            span = self._bucketSpan(root)
+            new_span = self._bucketSpan(root, total + len(entries))
+            if new_span != span:
+                # Top-level rows become ranges of another size
+                self.beginResetModel()
+            elif span:
+                rows = -(-total // span)
+                new_rows = -(-(total + len(entries)) // span)
+                if new_rows > rows:
+                    self.beginInsertRows(QtCore.QModelIndex(),
+                                         rows, new_rows - 1)
+
+            if root.type is dict:
+                root.extendSource(entries)
+            else:
+                root.extendSource(value for _, value in entries)
+
+            if new_span != span:
+                self.endResetModel()
+            elif span and new_rows > rows:
+                self.endInsertRows()
+
+            # Rows past the first batch are created as the view scrolls,
+            # inserting every streamed row would make attached views lay
+            # out all top-level rows again on each batch
+            if root.childCount() < self.FETCH_BATCH:
+                self.fetchMore(QtCore.QModelIndex())
 
     def json(self, root=None):
         """Serialise model as JSON-compliant dictionary
@@ -165,29 +588,67 @@ class QJsonModel(QAbstractItemModel):
 
         item = index.internalPointer()
 
+        if isinstance(item, QJsonBucket):
+            if role == QtCore.Qt.DisplayRole:
+                if index.column() == 0:
+                    return item.label()
+                if index.column() == 1:
+                    return "%d items" % (item.stop() - item.start)
+                return ""
+            if role == ValueRole:
+                return ""
+            if role == SortRole:
+                # Ranges keep their order whatever the column
+                return item.start
+            return None
+
         if role == QtCore.Qt.DisplayRole:
-            if index.column() == 0:
-                return item.key
+            column = index.column()
+            if column == 2:
+                return type_label(item.type)
+            return self.displayTexts(item)[column]
 
+        elif role == QtCore.Qt.EditRole:
             if index.column() == 1:
                 return item.value
 
-            if index.column() == 2:
-                return str(item.type)
+        elif role == ValueRole:
+            return item.value
 
-        elif role == QtCore.Qt.EditRole:
-            if index.column() == 1:
-                return item.value
+        elif role == SortRole:
+            column = index.column()
+            if column == 0:
+                key = item._key if item._key is not None else item.row()
+                return sort_key(type(key), key)
+            if column == 1:
+                return sort_key(item.type, item.value)
+            return type_label(item.type)
+
+    def displayTexts(self, item):
+        """Cached (key, value) texts shown for an item"""
+        texts = self._display.get(item)
+        if texts is None:
+            # Dropped whole when full, the rows on screen come back at
+            # the next paint
+            if len(self._display) >= self.DISPLAY_CACHE_SIZE:
+                self._display.clear()
+            texts = self._display[item] = item.key, display_text(item.value)
+        return texts
 
     def setData(self, index, value, role):
+        if self._frozen:
+            return False
+
         if role == QtCore.Qt.EditRole:
             if index.column() == 1:
                 item = index.internalPointer()
-                item.value = str(value)
-                print("Edit item type:", item.type)
-
-                # self.dataChanged.emit(index, index, [QtCore.Qt.EditRole])
-                self.dataChanged.emit(index, index)
+                old = item.value
+                new = str(value)
+                self.setItemValue(item, new)
+                self.undo_stack.push("Edit %s" % item.key,
+                                     lambda: self.setItemValue(item, old),
+                                     lambda: self.setItemValue(item, new),
+                                     sys.getsizeof(old) + sys.getsizeof(new))
 
                 return True
 
@@ -201,7 +662,9 @@ class QJsonModel(QAbstractItemModel):
             return self._headers[section]
 
     def index(self, row, column, parent=QtCore.QModelIndex()):
-        if not self.hasIndex(row, column, parent):
+        # Bounds are checked here rather than by hasIndex, which would
+        # call back into rowCount through Qt
+        if row < 0 or not 0 <= column < 3 or parent.column() > 0:
             return QtCore.QModelIndex()
 
         if not parent.isValid():
@@ -209,24 +672,51 @@ class QJsonModel(QAbstractItemModel):
         else:
             parentItem = parent.internalPointer()
 
-        childItem = parentItem.child(row)
-        if childItem:
-            return self.createIndex(row, column, childItem)
+        if isinstance(parentItem, QJsonBucket):
+            bucket = parentItem
+            if row >= self.rowCount(parent):
+                return QtCore.QModelIndex()
+            if bucket.size > self._bucketSize:
+                size = bucket.size // self._bucketSize
+                childItem = self._bucket(bucket.item,
+                                         bucket.start + row * size, size,
+                                         bucket, row)
+            else:
+                childItem = bucket.item.child(bucket.start + row)
         else:
-            return QtCore.QModelIndex()
+            span = self._bucketSpan(parentItem)
+            if span:
+                if row >= -(-self._childTotal(parentItem) // span):
+                    return QtCore.QModelIndex()
+                childItem = self._bucket(parentItem, row * span, span,
+                                         None, row)
+            elif row < parentItem.childCount():
+                childItem = parentItem.child(row)
+            else:
+                return QtCore.QModelIndex()
+
+        return self.createIndex(row, column, childItem)
 
     def parent(self, index):
         if not index.isValid():
             return QtCore.QModelIndex()
 
         childItem = index.internalPointer()
-        print("=====parent", childItem.key)
+        if isinstance(childItem, QJsonBucket):
+            if childItem.parent is not None:
+                return self.createIndex(childItem.parent.row, 0,
+                                        childItem.parent)
+            return self.indexFromItem(childItem.item)
+
         parentItem = childItem.parent()
+        bucket = self._leafBucket(parentItem, childItem.row())
+        if bucket is not None:
+            return self.createIndex(bucket.row, 0, bucket)
 
         if parentItem == self._rootItem:
             return QtCore.QModelIndex()
 
-        return self.createIndex(parentItem.row(), 0, parentItem)
+        return self.createIndex(self._modelRow(parentItem), 0, parentItem)
 
     def rowCount(self, parent=QtCore.QModelIndex()):
         if parent.column() > 0:
@@ -237,16 +727,567 @@ class QJsonModel(QAbstractItemModel):
         else:
             parentItem = parent.internalPointer()
 
+        if isinstance(parentItem, QJsonBucket):
+            bucket = parentItem
+            stop = bucket.stop()
+            if bucket.size > self._bucketSize:
+                size = bucket.size // self._bucketSize
+                return -(-(stop - bucket.start) // size)
+            return max(0, min(stop, bucket.item.childCount()) - bucket.start)
+
+        span = self._bucketSpan(parentItem)
+        if span:
+            return -(-self._childTotal(parentItem) // span)
         return parentItem.childCount()
 
+    # Buckets
+
+    def _childTotal(self, item):
+        return item.childCount() + item.pendingCount()
+
+    def _bucketSpan(self, item, total=None):
+        """Rows per top-level bucket under `item`, 0 if not grouped
+
+        Arguments:
+            total (int, optional): Number of children to plan for,
+                defaults to the current one
+
+        """
+
+        size = self._bucketSize
+        if not size or item.type not in (list, tuple, dict):
+            return 0
+        if item.type is dict and not self._bucketDicts:
+            return 0
+        if total is None:
+            total = item.childCount() + item.pendingCount()
+        if total <= size:
+            return 0
+        span = size
+        while -(-total // span) > size:
+            span *= size
+        return span
+
+    def _bucket(self, item, start, size, parent, row):
+        key = item, start, size
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = QJsonBucket(item, start, size,
+                                                      parent, row)
+        return bucket
+
+    def _leafBucket(self, item, row):
+        """Innermost bucket holding child `row` of `item`, None if the
+        children of `item` are not grouped"""
+        if item is None:
+            return None
+        span = self._bucketSpan(item)
+        if not span:
+            return None
+        n = row // span
+        bucket = self._bucket(item, n * span, span, None, n)
+        while bucket.size > self._bucketSize:
+            size = bucket.size // self._bucketSize
+            n = (row - bucket.start) // size
+            bucket = self._bucket(item, bucket.start + n * size, size,
+                                  bucket, n)
+        return bucket
+
+    def _modelRow(self, item):
+        """Row of an item under its parent index, a bucket or an item"""
+        row = item.row()
+        bucket = self._leafBucket(item.parent(), row)
+        if bucket is not None:
+            return row - bucket.start
+        return row
+
+    def _fetchRows(self, item, stop):
+        """Create the children of a grouped item up to row `stop`, a
+        whole leaf bucket at a time"""
+        if self._frozen:
+            return
+        while item.childCount() < stop and item.canFetchMore():
+            start = item.childCount()
+            bucket = self._leafBucket(item, start)
+            count = min(bucket.stop(), start + item.pendingCount()) - start
+            first = start - bucket.start
+            self.beginInsertRows(self.createIndex(bucket.row, 0, bucket),
+                                 first, first + count - 1)
+            item.fetchMore(count)
+            self.endInsertRows()
+
+    def _fetchNext(self, item, index):
+        """Create the next rows under `item`, False if there are none"""
+        if self._frozen or not item.canFetchMore():
+            return False
+        if self._bucketSpan(item):
+            self._fetchRows(item, item.childCount() + 1)
+        else:
+            self.fetchMore(index)
+        return True
+
+    def _groupsRows(self, item, added=0):
+        """Whether the rows of `item` are grouped in buckets before or
+        after `added` rows are added to it, or removed if negative"""
+        return bool(self._bucketSpan(item) or self._bucketSpan(
+            item, self._childTotal(item) + added))
+
+    def _changeGroupedRows(self, item, change, removed=None):
+        """Insert or remove a child of a grouped `item` through `change`
+
+        Later rows move between buckets and ranges shift, so this is a
+        layout change of the rows under `item`. Persistent indexes of its
+        children and buckets follow them, other branches of the views,
+        their expanded rows and selection, are left alone.
+
+        Arguments:
+            change (callable): Inserts or removes the child
+            removed (QJsonTreeItem, optional): Child removed by
+                `change`, indexes into its subtree become invalid
+
+        """
+
+        span = self._bucketSpan(item)
+        parents = [QtCore.QPersistentModelIndex(self.indexFromItem(item))]
+        self.layoutAboutToBeChanged.emit(parents)
+        change()
+
+        new_span = self._bucketSpan(item)
+        total = self._childTotal(item)
+        old_indexes = []
+        new_indexes = []
+        for index in self.persistentIndexList():
+            node = index.internalPointer()
+            if isinstance(node, QJsonBucket):
+                if node.item is not item:
+                    continue
+                if new_span == span and node.start < total:
+                    # Same range, same row
+                    continue
+                new_index = QtCore.QModelIndex()
+            elif removed is not None and _within(node, removed):
+                new_index = QtCore.QModelIndex()
+            elif node._parent is item:
+                new_index = self.indexFromItem(node, index.column())
+            else:
+                continue
+            old_indexes.append(index)
+            new_indexes.append(new_index)
+        self.changePersistentIndexList(old_indexes, new_indexes)
+        self.layoutChanged.emit(parents)
+
     def columnCount(self, parent=QtCore.QModelIndex()):
         return 3
 
+    def itemFromIndex(self, index):
+        """Item of an index, the grouped container for a bucket"""
+        if not index.isValid():
+            return self._rootItem
+        item = index.internalPointer()
+        if isinstance(item, QJsonBucket):
+            return item.item
+        return item
+
+    def indexFromItem(self, item, column=0):
+        if item is None or item is self._rootItem:
+            return QtCore.QModelIndex()
+        return self.createIndex(self._modelRow(item), column, item)
+
+    def indexForPath(self, path):
+        """Index of the node at a path of keys, fetching rows as needed
+
+        Arguments:
+            path (list): Dict keys and list indices from the root
+
+        Returns:
+            QModelIndex, invalid if the path does not exist
+
+        """
+
+        index = QtCore.QModelIndex()
+        item = self._rootItem
+        for key in path:
+            if item.type is dict:
+                row = 0
+                while True:
+                    while row < item.childCount():
+                        if item.child(row).key == key:
+                            break
+                        row += 1
+                    if (row < item.childCount()
+                            or not self._fetchNext(item, index)):
+                        break
+                if row == item.childCount():
+                    return QtCore.QModelIndex()
+            else:
+                row = int(key)
+                if row >= item.childCount() and self._bucketSpan(item):
+                    # Only the buckets up to the row are filled
+                    self._fetchRows(item, row + 1)
+                while (row >= item.childCount()
+                       and self._fetchNext(item, index)):
+                    pass
+                if not 0 <= row < item.childCount():
+                    return QtCore.QModelIndex()
+
+            item = item.child(row)
+            index = self.indexFromItem(item)
+
+        return index
+
+    def pointerFor(self, item):
+        """JSON Pointer of an item"""
+        return keys_to_pointer(item.keys())
+
+    def fetchAll(self, parent=QtCore.QModelIndex()):
+        """Create all remaining rows under `parent` in one insert"""
+        item = self.itemFromIndex(parent)
+        count = item.pendingCount()
+        if count == 0 or self._frozen:
+            return
+
+        if self._bucketSpan(item):
+            self._fetchRows(item, self._childTotal(item))
+            return
+
+        start = item.childCount()
+        self.beginInsertRows(parent, start, start + count - 1)
+        item.fetchAll()
+        self.endInsertRows()
+
+    def _willChange(self, item):
+        """Build the journal values `item` is part of before it changes"""
+        while item is not None:
+            self.journal.freeze(item)
+            item = item._parent
+
+    def setItemValue(self, item, value):
+        self._willChange(item)
+        item.value = value
+        self._display.pop(item, None)
+        self.journal.replace(self.pointerFor(item), value)
+        index = self.indexFromItem(item, 1)
+        self.dataChanged.emit(index, index)
+
+    def insertItem(self, parent, row, item):
+        """Insert a detached item, e.g. one removed earlier, at `row`"""
+        self._willChange(parent)
+
+        def insert():
+            item._parent = parent
+            parent.insertChild(row, item)
+
+        if self._groupsRows(parent, 1):
+            self._changeGroupedRows(parent, insert)
+        else:
+            self.beginInsertRows(self.indexFromItem(parent), row, row)
+            insert()
+            self.endInsertRows()
+        # The subtree is not changed until the journal freezes it, it is
+        # only serialised if the patch is exported
+        self.journal.add(self.pointerFor(item), item, self.genJson)
+
+    def addIntField(self, parent=QtCore.QModelIndex()):
+        """Append an int field under `parent`, the root by default"""
+        item = self.itemFromIndex(parent)
+        # The new row goes after all existing ones
+        self.fetchAll(parent)
+
+        row = item.childCount()
+        self._willChange(item)
+        if self._groupsRows(item, 1):
+            added = []
+            self._changeGroupedRows(
+                item, lambda: added.append(item.addIntField()))
+            child = added[0]
+        else:
+            self.beginInsertRows(parent, row, row)
+            child = item.addIntField()
+            self.endInsertRows()
+
+        self.journal.add(self.pointerFor(child), child.value)
+        self.undo_stack.push("Add field",
+                             lambda: self.removeItem(child),
+                             lambda: self.insertItem(item, row, child))
+        return child
+
+    def removeItem(self, item):
+        parent = item.parent()
+        if parent is None:
+            return
+        self.journal.remove(self.pointerFor(item))
+
+        row = item.row()
+        self._willChange(parent)
+        if self._groupsRows(parent, -1):
+            self._changeGroupedRows(
+                parent, lambda: parent.removeChild(item, row), item)
+        else:
+            self.beginRemoveRows(self.indexFromItem(parent), row, row)
+            parent.removeChild(item, row)
+            self.endRemoveRows()
+
+        # The removed subtree is kept as is for undo
+        self.undo_stack.push("Remove %s" % item.key,
+                             lambda: self.insertItem(parent, row, item),
+                             lambda: self.removeItem(item),
+                             estimate_size(item, QJsonModelAdapter()))
+
+    def applyPatch(self, patch):
+        """Apply JSON Patch operations as one model update
+
+        Only the containers along each operation's path are fetched,
+        untouched branches stay raw. The patch applies entirely or not
+        at all, and is undone as a single command.
+
+        Arguments:
+            patch (list): RFC 6902 operations
+
+        Raises:
+            PatchError: if an operation cannot be applied
+
+        """
+
+        check_patch(patch)
+        # Operations may change any item
+        self.journal.freeze()
+
+        # (redo, undo, inverse operation, bytes held) per item change
+        changes = []
+        self.beginResetModel()
+        # Dict key -> row maps of the dict items touched by this patch
+        rows = {}
+        try:
+            for n, op in enumerate(patch):
+                try:
+                    self._applyOperation(op, rows, changes)
+                except PatchError as e:
+                    for _, undo, _, _ in reversed(changes):
+                        undo()
+                    raise PatchError("Operation %d (%s %s): %s"
+                                     % (n, op["op"], op["path"], e))
+        finally:
+            self.endResetModel()
+
+        self.journal.extend(patch)
+        self.undo_stack.push("Apply patch",
+                             lambda: self._replayChanges(changes, False),
+                             lambda: self._replayChanges(changes, True, patch),
+                             sum(change[3] for change in changes))
+
+    def _replayChanges(self, changes, forward, patch=None):
+        self.journal.freeze()
+        self.beginResetModel()
+        try:
+            if forward:
+                for redo, _, _, _ in changes:
+                    redo()
+                self.journal.extend(patch)
+            else:
+                for _, undo, inverse, _ in reversed(changes):
+                    undo()
+                    self.journal.extend([inverse()])
+        finally:
+            self.endResetModel()
+
+    def _setRoot(self, item):
+        item._parent = None
+        self._rootItem = item
+
+    def _rowForKey(self, item, key, rows, adding=False):
+        item.fetchAll()
+        if item.type is dict:
+            key_rows = rows.get(item)
+            if key_rows is None:
+                key_rows = rows[item] = {
+                    item.child(row).key: row
+                    for row in range(item.childCount())}
+            row = key_rows.get(key)
+            if row is not None:
+                return row
+            if adding:
+                return item.childCount()
+            raise PatchError("No member %r" % key)
+
+        if item.type in (list, tuple):
+            return list_index(key, item.childCount(), adding)
+
+        raise PatchError("Cannot descend into a %s with %r"
+                         % (item.type.__name__, key))
+
+    def _itemForKeys(self, keys, rows):
+        item = self._rootItem
+        for key in keys:
+            item = item.child(self._rowForKey(item, key, rows))
+        return item
+
+    def _insertItem(self, keys, child, rows, changes, replace=False):
+        if not keys:
+            if child.type not in (dict, list):
+                raise PatchError("The document root must be an object or "
+                                 "an array")
+            old = self._rootItem
+            changes.append((
+                lambda: self._setRoot(child),
+                lambda: self._setRoot(old),
+                lambda: {"op": "replace", "path": "",
+                         "value": self.genJson(old)},
+                estimate_size(old, QJsonModelAdapter()),
+            ))
+            self._setRoot(child)
+            rows.clear()
+            return
+
+        parent = self._itemForKeys(keys[:-1], rows)
+        key = keys[-1]
+        row = self._rowForKey(parent, key, rows, adding=not replace)
+        if parent.type is dict:
+            child_key = key
+        else:
+            child_key = None
+            key = row
+        pointer = keys_to_pointer(keys[:-1] + [key])
+
+        if row < parent.childCount() and (replace or child_key is not None):
+            old = parent.child(row)
+            old_key = old._key
+            changes.append((
+                lambda: _attachItem(parent, row, child, child_key, True),
+                lambda: _attachItem(parent, row, old, old_key, True),
+                lambda: {"op": "replace", "path": pointer,
+                         "value": self.genJson(old)},
+                estimate_size(old, QJsonModelAdapter()),
+            ))
+            _attachItem(parent, row, child, child_key, True)
+            return
+
+        changes.append((
+            lambda: _attachItem(parent, row, child, child_key, False),
+            lambda: parent.removeChild(child, row),
+            lambda: {"op": "remove", "path": pointer},
+            0,
+        ))
+        _attachItem(parent, row, child, child_key, False)
+        if child_key is not None:
+            rows[parent][child_key] = row
+
+    def _takeItem(self, keys, rows, changes):
+        if not keys:
+            raise PatchError("Cannot remove the document root")
+        parent = self._itemForKeys(keys[:-1], rows)
+        row = self._rowForKey(parent, keys[-1], rows)
+        child = parent.child(row)
+        child_key = child._key
+        pointer = keys_to_pointer(keys)
+
+        changes.append((
+            lambda: parent.removeChild(child, row),
+            lambda: _attachItem(parent, row, child, child_key, False),
+            lambda: {"op": "add", "path": pointer,
+                     "value": self.genJson(child)},
+            estimate_size(child, QJsonModelAdapter()),
+        ))
+        parent.removeChild(child, row)
+        # Later rows moved up
+        rows.pop(parent, None)
+        return child
+
+    def _applyOperation(self, op, rows, changes):
+        name = op["op"]
+        keys = split_pointer(op["path"])
+
+        if name == "add":
+            self._insertItem(keys, self._rootItem.makeChild(None, op["value"]),
+                             rows, changes)
+
+        elif name == "remove":
+            self._takeItem(keys, rows, changes)
+
+        elif name == "replace":
+            self._insertItem(keys, self._rootItem.makeChild(None, op["value"]),
+                             rows, changes, replace=True)
+
+        elif name == "test":
+            if self.genJson(self._itemForKeys(keys, rows)) != op["value"]:
+                raise PatchError("Test failed")
+
+        else:
+            from_keys = split_pointer(op["from"])
+            if name == "move":
+                if from_keys == keys:
+                    return
+                if keys[:len(from_keys)] == from_keys:
+                    raise PatchError("Cannot move %r into itself"
+                                     % op["from"])
+                child = self._takeItem(from_keys, rows, changes)
+                self._insertItem(keys, child, rows, changes)
+            else:
+                value = self.genJson(self._itemForKeys(from_keys, rows))
+                self._insertItem(keys, self._rootItem.makeChild(None, value),
+                                 rows, changes)
+
+    def query(self, expression, start=None):
+        """Run a JSONPath or JSON Pointer query over the document
+
+        Arguments:
+            expression (str): `$...` JSONPath or `/...` JSON Pointer
+            start (list, optional): Matches of a previous query to run
+                from instead of the root
+
+        Returns:
+            list of json_query.QueryMatch, see indexForPath
+
+        """
+
+        query = compile_query(expression)
+        return query.run(self._rootItem, QJsonModelAdapter(), start)
+
+    def hasChildren(self, parent=QtCore.QModelIndex()):
+        if parent.column() > 0:
+            return False
+        if parent.isValid() and isinstance(parent.internalPointer(),
+                                           QJsonBucket):
+            return True
+        return self.itemFromIndex(parent).hasChildren()
+
+    def canFetchMore(self, parent):
+        if parent.column() > 0 or self._frozen:
+            return False
+        if parent.isValid() and isinstance(parent.internalPointer(),
+                                           QJsonBucket):
+            bucket = parent.internalPointer()
+            return (bucket.size <= self._bucketSize
+                    and bucket.item.childCount() < bucket.stop())
+        item = self.itemFromIndex(parent)
+        return not self._bucketSpan(item) and item.canFetchMore()
+
+    def fetchMore(self, parent):
+        if not self.canFetchMore(parent):
+            return
+
+        if isinstance(parent.internalPointer(), QJsonBucket):
+            # A leaf bucket is filled at once, earlier ones first
+            bucket = parent.internalPointer()
+            self._fetchRows(bucket.item, bucket.stop())
+            return
+
+        item = self.itemFromIndex(parent)
+        start = item.childCount()
+        count = min(self.FETCH_BATCH, item.pendingCount())
+        if count <= 0:
+            return
+
+        self.beginInsertRows(parent, start, start + count - 1)
+        item.fetchMore(count)
+        self.endInsertRows()
+
     def flags(self, index):
         flags = super(QJsonModel, self).flags(index)
 
-        if index.column() == 1:
+        if index.column() == 1 and not self._frozen:
             item = index.internalPointer()
+            if isinstance(item, QJsonBucket):
+                return flags
             if item.isEditable():
                 return QtCore.Qt.ItemIsEditable | flags
         
@@ -260,6 +1301,8 @@ class QJsonModel(QAbstractItemModel):
             for i in range(nchild):
                 ch = item.child(i)
                 document[ch.key] = self.genJson(ch)
+            # Branches never expanded still live in the raw document
+            document.update(item.pendingItems())
             return document
 
         elif item.type == list:
@@ -267,12 +1310,21 @@ class QJsonModel(QAbstractItemModel):
             for i in range(nchild):
                 ch = item.child(i)
                 document.append(self.genJson(ch))
+            document.extend(value for _, value in item.pendingItems())
             return document
 
         else:
             return item.value
-    
+
+
+# Only wrapped while metrics are enabled
+metrics.instrument(QJsonModel, ("index", "parent", "data", "rowCount"))
+
+
 class JsonEditor(QMainWindow, Ui_MainWindow):
+    # Files larger than this are viewed through a memory-mapped offset
+    # index, see json_index
+    MMAP_THRESHOLD = 512 * 1024 * 1024
 
     def __init__(self, parent=None):
         super(JsonEditor, self).__init__(parent=parent)
@@ -281,6 +1333,13 @@ class JsonEditor(QMainWindow, Ui_MainWindow):
         self.model = QJsonModel()
         self.json_view.setModel(self.model)
 
+        # Whole text of the current value, the tree only shows previews
+        self.value_detail = ValueDetail()
+        self.value_detail.watch(self.json_view)
+        detail_dock = QDockWidget("值", self)
+        detail_dock.setWidget(self.value_detail)
+        self.addDockWidget(Qt.RightDockWidgetArea, detail_dock)
+
         self.json_view.customContextMenuRequested.connect(self.prepareMenu)
         self.item_add_action = QAction("新增", self.json_view)
         self.item_add_action.triggered.connect(self.do_item_add)
@@ -290,31 +1349,69 @@ class JsonEditor(QMainWindow, Ui_MainWindow):
 
         self.test_btn.clicked.connect(self.on_click_test)
 
+        # JSONPath / JSON Pointer query bar
+        self.query_box = QLineEdit(self.centralwidget)
+        self.query_box.setPlaceholderText("$.path[*].key or /json/pointer")
+        self.query_box.returnPressed.connect(self.on_query)
+        self.query_in_results = QCheckBox("In results", self.centralwidget)
+        query_layout = QHBoxLayout()
+        query_layout.addWidget(self.query_box)
+        query_layout.addWidget(self.query_in_results)
+        self.verticalLayout.insertLayout(0, query_layout)
+        self.query_matches = []
+
+        self.loader = None
+        self.load_progress = LoadProgress(self.statusbar)
+        self.statusbar.addPermanentWidget(self.load_progress, 1)
+
+        self.json_path = None
+        self.saver = None
+        self.save_action = QAction("保存", self)
+        self.save_action.setShortcut(QKeySequence.Save)
+        self.save_action.triggered.connect(self.on_save)
+        self.addAction(self.save_action)
+
+        self.undo_action = QAction("撤销", self)
+        self.undo_action.setShortcut(QKeySequence.Undo)
+        self.undo_action.triggered.connect(self.on_undo)
+        self.addAction(self.undo_action)
+        self.redo_action = QAction("重做", self)
+        self.redo_action.setShortcut(QKeySequence.Redo)
+        self.redo_action.triggered.connect(self.on_redo)
+        self.addAction(self.redo_action)
+
+        patch_menu = self.menubar.addMenu("补丁")
+        patch_menu.addAction("导出补丁", self.on_export_patch)
+        patch_menu.addAction("应用补丁", self.on_apply_patch)
+
         self.setWindowTitle("JSON Viewer")
         self.show()
 
     def do_item_add(self):
-        rootItem = self.model.getRoot()
-        rootItem.addIntField()
-        self.model.layoutChanged.emit()
+        self.model.addIntField()
 
     def do_item_del(self):
         if self.selected_item is None:
             return
         
-        rootItem = self.model.getRoot()
-        rootItem.removeChild(self.selected_item)
+        self.model.removeItem(self.selected_item)
         self.selected_item = None
-        self.model.layoutChanged.emit()
     
     def prepareMenu(self, pos):
+        # Memory-mapped documents are read-only, the model is frozen
+        # while it is saved
+        if self.json_view.model() is not self.model or self.model.isFrozen():
+            return
+
         index = self.json_view.indexAt(pos)
-        print("prepareMenu:", pos, index, index.internalPointer())
         if not index.isValid():
             return
-        
-        menu = QMenu("ItemAction", self.json_view)
+
         item = index.internalPointer()
+        if isinstance(item, QJsonBucket):
+            return
+
+        menu = QMenu("ItemAction", self.json_view)
         self.selected_item = item
         # if item.isPrimitive():
 
@@ -323,13 +1420,197 @@ class JsonEditor(QMainWindow, Ui_MainWindow):
         if not menu.isEmpty():
             menu.exec(self.json_view.viewport().mapToGlobal(pos))
     
+    def on_query(self):
+        expression = self.query_box.text().strip()
+        if self.json_view.model() is not self.model:
+            self.statusbar.showMessage("Queries need a parsed document")
+            return
+
+        start = None
+        if self.query_in_results.isChecked():
+            start = self.query_matches
+
+        try:
+            self.query_matches = self.model.query(expression, start)
+        except QueryError as e:
+            self.statusbar.showMessage(str(e))
+            return
+
+        selection = self.json_view.selectionModel()
+        selection.clearSelection()
+        first = None
+        for match in self.query_matches:
+            index = self.model.indexForPath(match.path)
+            if not index.isValid():
+                continue
+            selection.select(index, QItemSelectionModel.Select | QItemSelectionModel.Rows)
+            if first is None:
+                first = index
+
+        if first is not None:
+            self.json_view.scrollTo(first)
+            selection.setCurrentIndex(first, QItemSelectionModel.NoUpdate)
+        self.statusbar.showMessage("%d matches" % len(self.query_matches))
+
     def on_click_test(self):
         self.load_json("address.json")
 
-    def load_json(self, jpath):
-        jfile = open(jpath)
-        jdata = json.load(jfile)
-        self.model.load(jdata)
+    def can_edit(self):
+        if self.json_view.model() is not self.model or self.model.isFrozen():
+            return False
+        return self.loader is None or not self.loader.isRunning()
+
+    def on_undo(self):
+        if not self.can_edit():
+            return
+        text = self.model.undo_stack.undo()
+        if text is not None:
+            self.statusbar.showMessage("Undo: %s" % text)
+
+    def on_redo(self):
+        if not self.can_edit():
+            return
+        text = self.model.undo_stack.redo()
+        if text is not None:
+            self.statusbar.showMessage("Redo: %s" % text)
+
+    def on_export_patch(self):
+        fpath, _ = QFileDialog.getSaveFileName(
+            self, "Export JSON Patch", "", "JSON Patch (*.json)")
+        if not fpath:
+            return
+        try:
+            self.model.journal.save(fpath)
+        except OSError as e:
+            self.statusbar.showMessage(str(e))
+            return
+        self.statusbar.showMessage("%d operations exported"
+                                   % len(self.model.journal))
+
+    def on_apply_patch(self):
+        if not self.can_edit():
+            self.statusbar.showMessage("The document cannot be edited now")
+            return
+
+        fpath, _ = QFileDialog.getOpenFileName(
+            self, "Apply JSON Patch", "", "JSON Patch (*.json)")
+        if not fpath:
+            return
+        try:
+            patch = load_patch(fpath)
+            self.model.applyPatch(patch)
+        except (OSError, PatchError) as e:
+            self.statusbar.showMessage(str(e))
+            return
+        self.statusbar.showMessage("%d operations applied" % len(patch))
+
+    def load_json(self, jpath, mapped=None):
+        """Load a JSON file in the background
+
+        Arguments:
+            jpath (str): Path of the file
+            mapped (bool, optional): View the file read-only through a
+                memory-mapped offset index instead of parsing it,
+                defaults to files above MMAP_THRESHOLD
+
+        """
+
+        self.stop_saving()
+        self.stop_loading()
+        self.json_path = jpath
+
+        if mapped is None:
+            mapped = os.path.getsize(jpath) > self.MMAP_THRESHOLD
+
+        if mapped:
+            self.loader = JsonIndexThread(jpath, self)
+            self.loader.done.connect(self.on_index_done)
+            self.load_progress.track(self.loader)
+            self.loader.start()
+            return
+
+        self.loader = JsonLoadThread(jpath, self)
+        self.loader.container_type.connect(self.on_container_type)
+        self.loader.batch_loaded.connect(self.on_batch_loaded)
+        self.load_progress.track(self.loader)
+        self.loader.start()
+
+    def on_container_type(self, container_type):
+        # Ignore signals still queued from a cancelled load
+        if self.sender() is not self.loader:
+            return
+        self.model.beginStream(container_type)
+        self.json_view.setModel(self.model)
+        self.value_detail.watch(self.json_view)
+
+    def on_index_done(self, completed):
+        if self.sender() is not self.loader or not completed:
+            return
+        self.json_view.setModel(QJsonIndexModel(self.loader.index, self))
+        self.value_detail.watch(self.json_view)
+
+    def on_batch_loaded(self, entries):
+        if self.sender() is not self.loader:
+            return
+        self.model.appendEntries(entries)
+
+    def stop_loading(self):
+        if self.loader is not None:
+            self.loader.cancel()
+            self.loader.wait()
+            self.loader = None
+
+    def on_save(self):
+        if self.json_path is not None:
+            self.save_json(self.json_path)
+
+    def save_json(self, jpath, indent=4):
+        """Save the document in the background
+
+        Items and the raw data of never expanded branches are written as
+        they are walked, the file is replaced once complete. The model is
+        frozen until the save is done.
+
+        """
+
+        if self.json_view.model() is not self.model:
+            self.statusbar.showMessage("Memory-mapped documents are read-only")
+            return
+        if self.loader is not None and self.loader.isRunning():
+            self.statusbar.showMessage("Wait for the document to finish loading")
+            return
+        if self.saver is not None:
+            self.statusbar.showMessage("A save is already running")
+            return
+
+        self.model.setFrozen(True)
+        self.saver = JsonSaveThread(self.model.getRoot(), jpath, self,
+                                    QJsonModelAdapter(), indent)
+        self.saver.done.connect(self.on_save_done)
+        self.load_progress.track(self.saver, "Save")
+        self.saver.start()
+
+    def on_save_done(self, completed):
+        if self.sender() is not self.saver:
+            return
+        if completed:
+            self.statusbar.showMessage("Saved %s" % self.saver.fpath)
+        self.saver = None
+        self.model.setFrozen(False)
+
+    def stop_saving(self):
+        if self.saver is not None:
+            self.saver.cancel()
+            self.saver.wait()
+            self.saver = None
+            self.model.setFrozen(False)
+
+    def closeEvent(self, e):
+        self.stop_loading()
+        # Let a running save complete rather than lose it
+        if self.saver is not None:
+            self.saver.wait()
+        super(JsonEditor, self).closeEvent(e)
     
     def sizeHint(self):
         return QSize(640, 480)
@@ -0,0 +1,35 @@
+import unittest
+
+from json_search import SearchIndex
+
+
+class SearchIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = SearchIndex()
+        self.index.add_document({
+            "id": None,
+            "flags": [True, False],
+            "name": "None of these",
+            "count": 12,
+        })
+
+    def find(self, text, **kwargs):
+        return [self.index.path(node)
+                for node in self.index.iter_find(text, keys=False, **kwargs)]
+
+    def test_literals_as_shown(self):
+        self.assertEqual(self.find("null"), [["id"]])
+        self.assertEqual(self.find("true"), [["flags", "0"]])
+        self.assertEqual(self.find("fals"), [["flags", "1"]])
+
+    def test_python_spelling_not_indexed(self):
+        self.assertEqual(self.find("None"), [["name"]])
+        self.assertEqual(self.find("True"), [])
+
+    def test_numbers(self):
+        self.assertEqual(self.find("12"), [["count"]])
+
+
+if __name__ == "__main__":
+    unittest.main()
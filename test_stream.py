@@ -0,0 +1,142 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import json_stream
+from json_decode import available, get_decoder
+from json_index import JsonIndex
+from json_stream import iter_file_entries
+
+
+INVALID = [
+    '',
+    '   ',
+    '1',
+    '[',
+    '[1, 2',
+    '[1,]',
+    '[,1]',
+    '[1,,2]',
+    '[1 2]',
+    '[1}',
+    '[01]',
+    '[-]',
+    '[tru]',
+    '{"a": tru}',
+    '{"a": 1,}',
+    '{"a" 1}',
+    '{"a": 1 "b": 2}',
+    '{"a": 1]',
+    '{1: 2}',
+    "{'a': 1}",
+    '{,}',
+    '[1]garbage',
+    '[1] 2',
+    '{"a": 1}}',
+    '["abc',
+]
+
+# Caught by the parsers, the index scan does not look inside strings
+INVALID_STRINGS = [
+    '["a\x01"]',
+    '["\\x"]',
+]
+
+VALID = [
+    '[]',
+    '{}',
+    ' [1, -0, 2.5e3, "x\\u00e9", true, false, null] \n',
+    '[NaN, Infinity, -Infinity]',
+    '{"a": {"b": [1, {"c": []}]}, "d": "e", "f": 12345678901234567890}',
+    '[' + ', '.join('{"n": %d, "s": "%s"}' % (i, "v" * i)
+                    for i in range(100)) + ']',
+]
+
+
+class IterFileEntriesTest(unittest.TestCase):
+    """Every decoder and both the whole file and the streamed path must
+    accept and reject what json.loads does"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.fpath = os.path.join(self.tmpdir.name, "doc.json")
+
+    def parse(self, text, decoder, chunk_size):
+        with open(self.fpath, "wb") as jfile:
+            jfile.write(text.encode("utf-8"))
+        with open(self.fpath, "rb") as jfile:
+            entries = iter_file_entries(jfile, decoder, chunk_size)
+            document = next(entries)()
+            for key, value, nbytes in entries:
+                if isinstance(document, dict):
+                    document[key] = value
+                else:
+                    document.append(value)
+        return document
+
+    def ways(self):
+        """(description, decoder, chunk size, whole file limit)"""
+        for name in available():
+            decoder = get_decoder(name)
+            for chunk_size in (1, 7, 1 << 20):
+                yield name, decoder, chunk_size, 0
+            if decoder.fast:
+                yield name, decoder, 1 << 20, json_stream.WHOLE_FILE_LIMIT
+
+    def test_invalid(self):
+        for text in INVALID + INVALID_STRINGS:
+            for name, decoder, chunk_size, limit in self.ways():
+                with self.subTest(text=text, decoder=name,
+                                  chunk_size=chunk_size, whole=bool(limit)):
+                    with mock.patch.object(json_stream, "WHOLE_FILE_LIMIT",
+                                           limit):
+                        with self.assertRaises(ValueError):
+                            self.parse(text, decoder, chunk_size)
+
+    def test_valid(self):
+        for text in VALID:
+            expected = json.dumps(json.loads(text))
+            for name, decoder, chunk_size, limit in self.ways():
+                with self.subTest(text=text, decoder=name,
+                                  chunk_size=chunk_size, whole=bool(limit)):
+                    with mock.patch.object(json_stream, "WHOLE_FILE_LIMIT",
+                                           limit):
+                        document = self.parse(text, decoder, chunk_size)
+                    self.assertEqual(json.dumps(document), expected)
+
+
+class JsonIndexTest(unittest.TestCase):
+    """The index scan must reject the structure json.loads rejects"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.fpath = os.path.join(self.tmpdir.name, "doc.json")
+
+    def scan(self, text):
+        with open(self.fpath, "wb") as jfile:
+            jfile.write(text.encode("utf-8"))
+        index = JsonIndex(self.fpath)
+        self.addCleanup(index.close)
+        index.scan()
+        return index
+
+    def test_invalid(self):
+        for text in INVALID:
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    self.scan(text)
+
+    def test_valid(self):
+        for text in VALID:
+            with self.subTest(text=text):
+                index = self.scan(text)
+                self.assertEqual(json.dumps(index.load()),
+                                 json.dumps(json.loads(text)))
+
+
+if __name__ == "__main__":
+    unittest.main()